@@ -0,0 +1,46 @@
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from heritagesites.auth import TIMEOUT
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+KEY_PREFIX = 'api:auth:token:'
+
+
+def _token_key(key):
+    # Hashed so that token values never appear in cache keys.
+    return KEY_PREFIX + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that caches each valid token with its (active) user, so repeated
+    calls with the same token need no query. Deleting the token (logout, rotation) or
+    saving or deleting its user (e.g. deactivation) drops the cache entry at once.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = _token_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, token, TIMEOUT)
+        return token.user, token
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed_handler(sender, instance, **kwargs):
+    cache.delete(_token_key(instance.key))
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def user_changed_handler(sender, instance, **kwargs):
+    keys = Token.objects.filter(user_id=instance.pk).values_list('key', flat=True)
+    cache.delete_many([_token_key(key) for key in keys])
@@ -0,0 +1,98 @@
+import hashlib
+
+from django.core.cache import cache
+from heritagesites.versions import get_version
+from rest_framework.response import Response
+
+
+KEY_PREFIX = 'api:responses:'
+STATS_PREFIX = 'api:responses:stats:'
+TIMEOUT = 60 * 10
+
+
+def _count(basename, action, outcome):
+    key = '{}{}:{}:{}'.format(STATS_PREFIX, basename, action, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_stats(basename):
+    """
+    Returns the response cache hit and miss counts of a viewset per action, shared by all
+    workers.
+    :param basename: the viewset's router basename
+    :return: dict of action -> {'hits', 'misses', 'hit_ratio'}
+    """
+    stats = {}
+    for action in CachedResponseMixin.cached_actions:
+        hits = cache.get('{}{}:{}:hits'.format(STATS_PREFIX, basename, action), 0)
+        misses = cache.get('{}{}:{}:misses'.format(STATS_PREFIX, basename, action), 0)
+        stats[action] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    return stats
+
+
+def reset_stats(basename):
+    cache.delete_many([
+        '{}{}:{}:{}'.format(STATS_PREFIX, basename, action, outcome)
+        for action in CachedResponseMixin.cached_actions
+        for outcome in ('hits', 'misses')
+    ])
+
+
+class CachedResponseMixin:
+    """
+    Caches the data of successful list and retrieve responses of a viewset whose
+    representations do not depend on the user or on the renderer, so one entry serves
+    anonymous and authenticated clients and every format. Entries are keyed on the host,
+    path and query string and on the versions of the namespaces the data comes from
+    (cache_namespaces, or get_cache_namespaces() per request): bumping any of them
+    invalidates the entries at once.
+    """
+    cached_actions = ('list', 'retrieve')
+    cache_namespaces = ()
+    cache_timeout = TIMEOUT
+
+    def get_cache_namespaces(self):
+        """
+        :return: the version namespaces the response of the current action depends on, or
+            None not to cache it
+        """
+        return self.cache_namespaces
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(
+            lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response(
+            lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
+
+    def _cached_response(self, respond):
+        namespaces = self.get_cache_namespaces()
+        if namespaces is None:
+            return respond()
+
+        request = self.request
+        versions = ':'.join(str(get_version(namespace)) for namespace in namespaces)
+        location = hashlib.md5(
+            '{}{}'.format(request.get_host(), request.get_full_path()).encode('utf-8')
+        ).hexdigest()
+        key = '{}{}:{}:{}:{}'.format(KEY_PREFIX, self.basename, self.action, versions, location)
+
+        data = cache.get(key)
+        if data is not None:
+            _count(self.basename, self.action, 'hits')
+            return Response(data)
+
+        _count(self.basename, self.action, 'misses')
+        response = respond()
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        return response
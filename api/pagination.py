@@ -0,0 +1,73 @@
+from collections import OrderedDict
+
+from django.db.models import QuerySet
+from heritagesites.pagination import CachedCountPaginator, paginate_keyset
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class SitePagination(PageNumberPagination):
+    """
+    Page-number pagination (?page=N, with a total count) unless a `cursor` query parameter
+    is given, in which case the QuerySet is paginated by keyset on (site_name,
+    heritage_site_id): ?cursor= starts at the first page and each response links the
+    opaque cursors of its neighbours. Keyset pages cost the same at any depth and do not
+    shift under concurrent inserts, but carry no count. Either mode takes ?page_size=
+    (up to max_page_size). Page counts are cached per query until the next write (see
+    CachedCountPaginator).
+    """
+    django_paginator_class = CachedCountPaginator
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_page = None
+        if self.cursor_query_param not in request.query_params \
+                or not isinstance(queryset, QuerySet):
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.request = request
+        try:
+            self.keyset_page = paginate_keyset(
+                queryset, request.query_params[self.cursor_query_param], page_size)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        return list(self.keyset_page)
+
+    def get_paginated_response(self, data):
+        if self.keyset_page is None:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self._cursor_link(self.keyset_page.next_cursor)),
+            ('previous', self._cursor_link(self.keyset_page.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def _cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_schema_fields(self, view):
+        fields = super().get_schema_fields(view)
+        return fields + [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Cursor',
+                    description='Keyset pagination cursor; empty for the first page.'
+                )
+            )
+        ]
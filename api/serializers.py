@@ -1,8 +1,47 @@
 from heritagesites.models import CountryArea, DevStatus, HeritageSite, HeritageSiteCategory, \
-    HeritageSiteJurisdiction, Location, Planet, Region, SubRegion, IntermediateRegion
+    HeritageSiteJurisdiction, Location, Planet, Region, SiteChange, SubRegion, IntermediateRegion
+from collections import OrderedDict
+import decimal
+from decimal import Decimal
+from django.db import transaction
+from heritagesites.bulk import bulk_update
+from heritagesites.changes import MAX_LIMIT as MAX_CHANGES
+from heritagesites.jurisdictions import set_jurisdictions, sync_jurisdictions
+from heritagesites.refdata import get_reference_data
+from heritagesites.signals import sites_changed
 from rest_framework import response, serializers, status
 
 
+class ReferencePrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField for UNSD/lookup models that resolves ids (and lists choices for
+    the browsable API) from the per-worker reference data cache instead of the database.
+    """
+
+    def to_internal_value(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        instance = get_reference_data().get(self.queryset.model, pk)
+        if instance is None:
+            self.fail('does_not_exist', pk_value=data)
+        return instance
+
+    def get_choices(self, cutoff=None):
+        instances = get_reference_data().all(self.queryset.model)
+        if cutoff is not None:
+            instances = instances[:cutoff]
+        return OrderedDict(
+            (self.to_representation(instance), self.display_value(instance))
+            for instance in instances
+        )
+
+
 class PlanetSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -80,6 +119,109 @@ class HeritageSiteJurisdictionSerializer(serializers.ModelSerializer):
         fields = ('heritage_site_id', 'country_area_id')
 
 
+class HeritageSiteListSerializer(serializers.ListSerializer):
+    """
+    many=True counterpart of HeritageSiteSerializer behind the bulk endpoint. Items are
+    validated independently, with errors reported per item in input order, and written in
+    one transaction with a fixed number of statements whatever the batch size: a bulk insert
+    or a CASE-based UPDATE of heritage_site rows and one jurisdiction sync for the batch.
+    """
+
+    def to_internal_value(self, data):
+        errors = self._site_name_errors(data)
+        try:
+            validated = super().to_internal_value(data)
+        except serializers.ValidationError as exc:
+            if not isinstance(exc.detail, list) or len(exc.detail) != len(errors):
+                raise
+            raise serializers.ValidationError([
+                dict(name_errors, **item_errors)
+                for name_errors, item_errors in zip(errors, exc.detail)
+            ])
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated
+
+    def _site_name_errors(self, data):
+        """
+        site_name is UNIQUE (and compared case-insensitively by MySQL): reports clashes with
+        existing sites and within the request per item, instead of failing the whole
+        transaction on an IntegrityError.
+        """
+        if not isinstance(data, list):
+            return []
+        instances = self.instance or [None] * len(data)
+        positions = {}
+        for index, item in enumerate(data):
+            name = item.get('site_name') if isinstance(item, dict) else None
+            if isinstance(name, str) and name.strip():
+                positions.setdefault(name.strip().casefold(), []).append(index)
+
+        names = [data[indexes[0]]['site_name'].strip() for indexes in positions.values()]
+        taken = {
+            name.casefold(): site_id
+            for name, site_id in HeritageSite.objects
+                .filter(site_name__in=names)
+                .values_list('site_name', 'heritage_site_id')
+        }
+
+        errors = [{} for item in data]
+        for name, indexes in positions.items():
+            for index in indexes:
+                if len(indexes) > 1:
+                    errors[index] = {'site_name': ['Duplicate site_name in this request.']}
+                elif name in taken and (
+                        index >= len(instances)
+                        or instances[index] is None
+                        or instances[index].pk != taken[name]):
+                    errors[index] = {'site_name': ['A site with this site_name already exists.']}
+        return errors
+
+    def create(self, validated_data):
+        sites = []
+        countries = []
+        for attrs in validated_data:
+            attrs = dict(attrs)
+            countries.append(attrs.pop('heritage_site_jurisdiction', None) or [])
+            sites.append(HeritageSite(**attrs))
+
+        with transaction.atomic():
+            HeritageSite.objects.bulk_create(sites)
+            if any(site.pk is None for site in sites):
+                # MySQL does not return the ids of bulk inserted rows.
+                site_ids = dict(
+                    HeritageSite.objects
+                        .filter(site_name__in=[site.site_name for site in sites])
+                        .values_list('site_name', 'heritage_site_id'))
+                for site in sites:
+                    site.pk = site_ids[site.site_name]
+
+            sync_jurisdictions({
+                site.pk: site_countries for site, site_countries in zip(sites, countries)
+            })
+            sites_changed.send(sender=HeritageSite, site_ids=[site.pk for site in sites])
+        return sites
+
+    def update(self, instances, validated_data):
+        fields = set()
+        jurisdictions = {}
+        for site, attrs in zip(instances, validated_data):
+            attrs = dict(attrs)
+            if 'heritage_site_jurisdiction' in attrs:
+                jurisdictions[site.pk] = attrs.pop('heritage_site_jurisdiction')
+            for name, value in attrs.items():
+                setattr(site, name, value)
+            fields.update(attrs)
+
+        with transaction.atomic():
+            if fields:
+                bulk_update(instances, sorted(fields))
+
+            sync_jurisdictions(jurisdictions)
+            sites_changed.send(sender=HeritageSite, site_ids=[site.pk for site in instances])
+        return instances
+
+
 class HeritageSiteSerializer(serializers.ModelSerializer):
     site_name = serializers.CharField(
         allow_blank=False,
@@ -113,7 +255,7 @@ class HeritageSiteSerializer(serializers.ModelSerializer):
         many=False,
         read_only=True
     )
-    heritage_site_category_id = serializers.PrimaryKeyRelatedField(
+    heritage_site_category_id = ReferencePrimaryKeyRelatedField(
         allow_null=False,
         many=False,
         write_only=True,
@@ -121,19 +263,24 @@ class HeritageSiteSerializer(serializers.ModelSerializer):
         source='heritage_site_category'
     )
     heritage_site_jurisdiction = HeritageSiteJurisdictionSerializer(
-        source='heritage_site_jurisdiction_set', # Note use of _set
+        source='heritagesitejurisdiction_set', # Note use of _set
         many=True,
         read_only=True
     )
-    jurisdiction_ids = serializers.PrimaryKeyRelatedField(
+    jurisdiction_ids = ReferencePrimaryKeyRelatedField(
         many=True,
         write_only=True,
         queryset=CountryArea.objects.all(),
         source='heritage_site_jurisdiction'
     )
 
+    # Nested representations left out of sparse responses unless named in ?expand= (or
+    # ?fields=).
+    expandable_fields = ('heritage_site_category', 'heritage_site_jurisdiction')
+
     class Meta:
         model = HeritageSite
+        list_serializer_class = HeritageSiteListSerializer
         fields = (
             'heritage_site_id',
             'site_name',
@@ -150,99 +297,298 @@ class HeritageSiteSerializer(serializers.ModelSerializer):
             'jurisdiction_ids'
         )
 
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        """
+        :param fields: names of the fields to keep (see select_fields), or None for all
+        :param expand: names of the nested fields to add, or None
+        """
+        super().__init__(*args, **kwargs)
+        if fields is not None or expand is not None:
+            selected = self.select_fields(fields, expand)
+            for name in set(self.fields) - selected:
+                self.fields.pop(name)
+
+    @classmethod
+    def select_fields(cls, fields=None, expand=None):
+        """
+        Resolves a sparse fieldset: the given fields (by default every field that is not
+        expandable) plus the expanded nested fields; heritage_site_id is always kept.
+        :return: set of field names
+        :raises ValidationError: on unknown or non-expandable names
+        """
+        expand = set(expand or ())
+        unknown = expand - set(cls.expandable_fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {'expand': 'Not expandable: {}.'.format(', '.join(sorted(unknown)))})
+
+        if fields is None:
+            fields = [name for name in cls.Meta.fields if name not in cls.expandable_fields]
+        unknown = set(fields) - set(cls.Meta.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {'fields': 'Unknown fields: {}.'.format(', '.join(sorted(unknown)))})
+
+        return set(fields) | expand | {'heritage_site_id'}
+
+    @classmethod
+    def project_queryset(cls, queryset, selected):
+        """
+        Restricts a HeritageSite QuerySet to what a sparse fieldset needs: only() the
+        selected columns (plus site_name, the pagination key), join heritage_site_category
+        and prefetch the jurisdictions only when they are serialized.
+        :param selected: set of field names from select_fields()
+        """
+        columns = {'heritage_site_id', 'site_name'}
+        columns.update(
+            field.name for field in HeritageSite._meta.concrete_fields if field.name in selected)
+
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if 'heritage_site_category' in selected:
+            queryset = queryset.select_related('heritage_site_category')
+        if 'heritage_site_jurisdiction' in selected:
+            queryset = queryset.with_jurisdictions()
+        return queryset.only(*columns)
+
     def create(self, validated_data):
         """
         This method persists a new HeritageSite instance as well as adds all related
         countries/areas to the heritage_site_jurisdiction table.  It does so by first
         removing (validated_data.pop('heritage_site_jurisdiction')) from the validated
-        data before the new HeritageSite instance is saved to the database. It then loops
-        over the heritage_site_jurisdiction array in order to extract each country_area_id
-        element and add entries to junction/associative heritage_site_jurisdiction table.
+        data before the new HeritageSite instance is saved to the database. The
+        jurisdictions are then written with a single bulk insert (see
+        heritagesites.jurisdictions.set_jurisdictions).
         :param validated_data:
         :return: site
         """
+        countries = validated_data.pop('heritage_site_jurisdiction', None) or []
+        with transaction.atomic():
+            site = HeritageSite.objects.create(**validated_data)
+            set_jurisdictions(site, countries)
+            sites_changed.send(sender=HeritageSite, site_ids=[site.heritage_site_id])
+        return site
 
-        # print(validated_data)
+    def update(self, instance, validated_data):
+        """
+        Saves the given fields (all of them on PUT, those sent on PATCH) and, if
+        jurisdiction_ids was sent, replaces the site's countries/areas using a set
+        difference: one bulk insert and one delete.
+        :param instance:
+        :param validated_data:
+        :return: instance
+        """
+        countries = validated_data.pop('heritage_site_jurisdiction', None)
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+
+        with transaction.atomic():
+            instance.save()
+            if countries is not None:
+                set_jurisdictions(instance, countries)
+            sites_changed.send(sender=HeritageSite, site_ids=[instance.heritage_site_id])
+        return instance
 
-        countries = validated_data.pop('heritage_site_jurisdiction')
-        site = HeritageSite.objects.create(**validated_data)
 
-        if countries is not None:
-            for country in countries:
-                HeritageSiteJurisdiction.objects.create(
-                    heritage_site_id=site.heritage_site_id,
-                    country_area_id=country.country_area_id
-                )
-        return site
+def _decimal_representation(field):
+    """
+    Returns a function formatting values exactly like `field` (a DecimalField) does, with
+    the quantization context built once instead of per value.
+    """
+    if field.decimal_places is None or field.localize \
+            or not getattr(field, 'coerce_to_string', True):
+        return field.to_representation
+    quantum = Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+
+    def to_representation(value):
+        if not isinstance(value, Decimal):
+            value = Decimal(str(value).strip())
+        return '{:f}'.format(value.quantize(quantum, rounding=field.rounding, context=context))
+    return to_representation
+
+
+class HeritageSiteRowListSerializer(serializers.ListSerializer):
+    """
+    many=True counterpart of HeritageSiteRowSerializer: reads the jurisdictions of every
+    row with one query before serializing the rows.
+    """
+
+    def to_representation(self, data):
+        rows = list(data)
+        self.child.load_jurisdictions(rows)
+        return [self.child.to_representation(row) for row in rows]
+
+
+class HeritageSiteRowSerializer(serializers.BaseSerializer):
+    """
+    Read-only fast path for HeritageSiteSerializer. It serializes the dicts of a values()
+    QuerySet (see project_queryset) with one plain conversion per field instead of DRF's
+    field machinery, takes category and country names from the reference data cache, and
+    produces the same JSON, sparse fieldsets included. Views opt in per action.
+    """
+    field_names = [
+        name for name in HeritageSiteSerializer.Meta.fields
+        if not HeritageSiteSerializer._declared_fields.get(name, serializers.Field()).write_only
+    ]
 
-    def update(self, instance, validated_data):
-        # site_id = validated_data.pop('heritage_site_id')
-        site_id = instance.heritage_site_id
-        new_countries = validated_data.pop('heritage_site_jurisdiction')
+    class Meta:
+        list_serializer_class = HeritageSiteRowListSerializer
 
-        instance.site_name = validated_data.get(
-            'site_name',
-            instance.site_name
-        )
-        instance.description = validated_data.get(
-            'description',
-            instance.description
-        )
-        instance.justification = validated_data.get(
-            'justification',
-            instance.justification
-        )
-        instance.date_inscribed = validated_data.get(
-            'date_inscribed',
-            instance.date_inscribed
-        )
-        instance.longitude = validated_data.get(
-            'longitude',
-            instance.longitude
-        )
-        instance.latitude = validated_data.get(
-            'latitude',
-            instance.latitude
-        )
-        instance.area_hectares = validated_data.get(
-            'area_hectares',
-            instance.area_hectares
-        )
-        instance.heritage_site_category_id = validated_data.get(
-            'heritage_site_category_id',
-            instance.heritage_site_category_id
-        )
-        instance.transboundary = validated_data.get(
-            'transboundary',
-            instance.transboundary
-        )
-        instance.save()
-
-        # If any existing country/areas are not in updated list, delete them
-        new_ids = []
-        old_ids = HeritageSiteJurisdiction.objects \
-            .values_list('country_area_id', flat=True) \
-            .filter(heritage_site_id__exact=site_id)
-
-        # TODO Insert may not be required (Just return instance)
-
-        # Insert new unmatched country entries
-        for country in new_countries:
-            new_id = country.country_area_id
-            new_ids.append(new_id)
-            if new_id in old_ids:
-                continue
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        """
+        :param fields: names of the fields to keep (see HeritageSiteSerializer.select_fields),
+            or None for all
+        :param expand: names of the nested fields to add, or None
+        """
+        super().__init__(*args, **kwargs)
+        if fields is not None or expand is not None:
+            selected = HeritageSiteSerializer.select_fields(fields, expand)
+            self.selected = [name for name in self.field_names if name in selected]
+        else:
+            self.selected = list(self.field_names)
+        self.jurisdictions = None
+
+    @classmethod
+    def project_queryset(cls, queryset, selected=None):
+        """
+        Turns a HeritageSite QuerySet into a values() QuerySet of the columns the (sparse)
+        representation needs, plus site_name, the pagination key. No join, no prefetch.
+        :param selected: set of field names from HeritageSiteSerializer.select_fields(), or
+            None for all
+        """
+        selected = set(cls.field_names if selected is None else selected)
+        columns = ['heritage_site_id', 'site_name']
+        columns.extend(
+            field.name for field in HeritageSite._meta.concrete_fields
+            if field.name in selected and field.name not in columns)
+        if 'heritage_site_category' in selected:
+            columns.append('heritage_site_category_id')
+        return queryset.select_related(None).prefetch_related(None).values(*columns)
+
+    def load_jurisdictions(self, rows):
+        """
+        Reads the country/area ids of the given rows' sites, ordered by country/area name as
+        HeritageSite.objects.with_jurisdictions() returns them.
+        """
+        if 'heritage_site_jurisdiction' not in self.selected:
+            return
+        self.jurisdictions = {row['heritage_site_id']: [] for row in rows}
+        pairs = HeritageSiteJurisdiction.objects \
+            .filter(heritage_site_id__in=list(self.jurisdictions)) \
+            .order_by() \
+            .values_list('heritage_site_id', 'country_area_id')
+        for site_id, country_area_id in pairs:
+            self.jurisdictions[site_id].append(country_area_id)
+
+        refdata = get_reference_data()
+
+        def name(country_area_id):
+            country = refdata.get(CountryArea, country_area_id)
+            return country.country_area_name if country is not None else ''
+        for country_area_ids in self.jurisdictions.values():
+            country_area_ids.sort(key=lambda pk: (name(pk), pk))
+
+    def to_representation(self, row):
+        if self.jurisdictions is None:
+            self.load_jurisdictions([row])
+        representation = OrderedDict()
+        for name in self.selected:
+            if name == 'heritage_site_category':
+                value = self._category(row['heritage_site_category_id'])
+            elif name == 'heritage_site_jurisdiction':
+                value = [
+                    OrderedDict([
+                        ('heritage_site_id', row['heritage_site_id']),
+                        ('country_area_id', country_area_id),
+                    ])
+                    for country_area_id in self.jurisdictions.get(row['heritage_site_id'], ())
+                ]
             else:
-                HeritageSiteJurisdiction.objects \
-                    .create(heritage_site_id=site_id, country_area_id=new_id)
+                value = row[name]
+                if value is not None:
+                    value = self.converters[name](value)
+            representation[name] = value
+        return representation
+
+    @staticmethod
+    def _category(category_id):
+        if category_id is None:
+            return None
+        category = get_reference_data().get(HeritageSiteCategory, category_id)
+        return OrderedDict([
+            ('category_id', category_id),
+            ('category_name', category.category_name if category is not None else None),
+        ])
+
+    # Field name -> what the corresponding HeritageSiteSerializer field's
+    # to_representation() does to a non-null value.
+    converters = {
+        'heritage_site_id': int,
+        'site_name': str,
+        'description': str,
+        'justification': str,
+        'date_inscribed': int,
+        'longitude': _decimal_representation(HeritageSiteSerializer._declared_fields['longitude']),
+        'latitude': _decimal_representation(HeritageSiteSerializer._declared_fields['latitude']),
+        'area_hectares': float,
+        'transboundary': int,
+    }
+
+
+class SiteChangeSerializer(serializers.ModelSerializer):
 
-        # Delete old unmatched country entries
-        for old_id in old_ids:
-            if old_id in new_ids:
-                continue
-            else:
-                HeritageSiteJurisdiction.objects \
-                    .filter(heritage_site_id=site_id, country_area_id=old_id) \
-                    .delete()
+    class Meta:
+        model = SiteChange
+        fields = ('change_id', 'object_type', 'object_id', 'action', 'changed_at')
 
-        return instance
+
+class ChangeFeedQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the change feed.
+    """
+    since = serializers.CharField(required=False, allow_blank=True, default='')
+    limit = serializers.IntegerField(min_value=1, max_value=MAX_CHANGES, default=100)
+
+
+class SiteIdsSerializer(serializers.Serializer):
+    """
+    Ids of the sites to fetch in one request, in the order they should be returned.
+    """
+    max_ids = 500
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=max_ids
+    )
+
+
+class NearbyQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the k-nearest-neighbour endpoint.
+    """
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lon = serializers.FloatField(min_value=-180, max_value=180)
+    k = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class BoundingBoxQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the bounding-box endpoint: bbox=west,south,east,north (degrees).
+    A west edge greater than the east edge denotes a box crossing the antimeridian.
+    """
+    bbox = serializers.CharField()
+
+    def validate_bbox(self, value):
+        try:
+            west, south, east, north = [float(edge) for edge in value.split(',')]
+        except ValueError:
+            raise serializers.ValidationError('Expected four numbers: west,south,east,north.')
+        if not (-180 <= west <= 180 and -180 <= east <= 180):
+            raise serializers.ValidationError('Longitudes must be between -180 and 180.')
+        if not (-90 <= south <= north <= 90):
+            raise serializers.ValidationError(
+                'Latitudes must be between -90 and 90 with south <= north.')
+        return west, south, east, north
@@ -1,3 +1,584 @@
+import gzip
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from heritagesites.models import CountryArea, HeritageSite, HeritageSiteCategory, \
+    HeritageSiteJurisdiction
+from heritagesites.refdata import get_reference_data
+from heritagesites.search import search
+from heritagesites.signals import sites_changed
+from heritagesites.tests import create_site_fixture, settle_changes
+from api.throttling import TokenBucketThrottle, get_rejection_stats
+from api.views import SiteViewSet
+
+
+class HierarchyViewTest(TestCase):
+
+    def setUp(self):
+        create_site_fixture()
+
+    def test_tree(self):
+        response = self.client.get('/heritagesites/api/hierarchy/')
+        self.assertEqual(response.status_code, 200)
+        [earth] = response.json()
+        self.assertEqual(earth['name'], 'Earth')
+        self.assertEqual([region['name'] for region in earth['children']], ['Asia', 'Europe'])
+        poland = earth['children'][1]['children'][0]['children'][0]
+        self.assertEqual(poland['iso_alpha3_code'], 'POL')
+
+
+class SiteSearchTest(TestCase):
+
+    def setUp(self):
+        create_site_fixture()
+
+    def test_search(self):
+        response = self.client.get('/heritagesites/api/sites/search/', {'q': 'forts'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [site['site_name'] for site in response.json()['results']], ['Frontier Forts'])
+
+
+class SiteFacetsTest(TestCase):
+
+    def setUp(self):
+        create_site_fixture()
+
+    def test_facets(self):
+        response = self.client.get('/heritagesites/api/sites/facets/', {'q': 'forts'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(facet['name'], facet['count']) for facet in response.json()['region']],
+            [('Asia', 1), ('Europe', 1)])
+
+
+class SiteSpatialTest(TestCase):
+
+    def setUp(self):
+        create_site_fixture()
+
+    def test_nearby(self):
+        response = self.client.get(
+            '/heritagesites/api/sites/nearby/', {'lat': 35, 'lon': 68, 'k': 1})
+        self.assertEqual(response.status_code, 200)
+        [site] = response.json()
+        self.assertEqual(site['site_name'], 'Bamiyan Valley')
+        self.assertLess(site['distance_km'], 50)
+
+    def test_nearby_validation(self):
+        response = self.client.get('/heritagesites/api/sites/nearby/', {'lat': 95, 'lon': 0})
+        self.assertEqual(response.status_code, 400)
+
+    def test_within(self):
+        response = self.client.get('/heritagesites/api/sites/within/', {'bbox': '10,40,30,60'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [site['site_name'] for site in response.json()['results']], ['Frontier Forts'])
+
+
+class ClusterViewTest(TestCase):
+
+    def setUp(self):
+        create_site_fixture()
+
+    def test_tile(self):
+        response = self.client.get('/heritagesites/api/clusters/0/0/0/')
+        self.assertEqual(response.status_code, 200)
+        clusters = response.json()['clusters']
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), 2)
+        self.assertEqual({cluster['heritage_site_category'] for cluster in clusters}, {'Cultural'})
+
+    def test_tile_out_of_range(self):
+        response = self.client.get('/heritagesites/api/clusters/1/2/0/')
+        self.assertEqual(response.status_code, 404)
+
+
+class SiteCursorPaginationTest(TestCase):
+
+    def setUp(self):
+        create_site_fixture()
+
+    def test_cursor_mode(self):
+        response = self.client.get('/heritagesites/api/sites/', {'cursor': '', 'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertNotIn('count', data)
+        self.assertIsNone(data['previous'])
+        self.assertEqual([site['site_name'] for site in data['results']], ['Bamiyan Valley'])
+
+        data = self.client.get(data['next']).json()
+        self.assertEqual([site['site_name'] for site in data['results']], ['Frontier Forts'])
+        self.assertIsNone(data['next'])
+        self.assertIsNotNone(data['previous'])
+
+    def test_page_number_mode_is_default(self):
+        data = self.client.get('/heritagesites/api/sites/').json()
+        self.assertEqual(data['count'], 2)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/heritagesites/api/sites/', {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_count_cached(self):
+        self.client.get('/heritagesites/api/sites/', {'page': 1, 'page_size': 1})
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/heritagesites/api/sites/', {'page': 2, 'page_size': 1}).json()
+        self.assertEqual(data['count'], 2)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+
+class SiteSparseFieldsTest(TestCase):
+
+    def setUp(self):
+        create_site_fixture()
+
+    def test_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/heritagesites/api/sites/', {'fields': 'site_name,latitude'})
+        [site, _] = response.json()['results']
+        self.assertEqual(set(site), {'heritage_site_id', 'site_name', 'latitude'})
+        self.assertEqual(site['latitude'], '34.84694000')
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('description', sql)
+        self.assertNotIn('heritage_site_jurisdiction', sql)
+        self.assertNotIn('heritage_site_category', sql)
+
+    def test_expand(self):
+        response = self.client.get(
+            '/heritagesites/api/sites/',
+            {'fields': 'site_name', 'expand': 'heritage_site_jurisdiction'})
+        [bamiyan, frontier] = response.json()['results']
+        self.assertEqual(
+            set(frontier), {'heritage_site_id', 'site_name', 'heritage_site_jurisdiction'})
+        self.assertEqual(len(frontier['heritage_site_jurisdiction']), 2)
+
+        response = self.client.get(
+            '/heritagesites/api/sites/', {'expand': 'heritage_site_category'})
+        site = response.json()['results'][0]
+        self.assertEqual(site['heritage_site_category']['category_name'], 'Cultural')
+        self.assertIn('description', site)
+        self.assertNotIn('heritage_site_jurisdiction', site)
+
+    def test_unknown_fields(self):
+        response = self.client.get('/heritagesites/api/sites/', {'fields': 'site_name,bogus'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/heritagesites/api/sites/', {'expand': 'site_name'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_full_representation_by_default(self):
+        site = self.client.get('/heritagesites/api/sites/').json()['results'][0]
+        self.assertIn('heritage_site_jurisdiction', site)
+        self.assertIn('description', site)
+
+
+class SiteBulkTest(TestCase):
+
+    url = '/heritagesites/api/sites/bulk/'
+
+    def setUp(self):
+        self.bamiyan, self.frontier = create_site_fixture()
+        self.afghanistan = CountryArea.objects.get(country_area_name='Afghanistan')
+        self.poland = CountryArea.objects.get(country_area_name='Poland')
+        self.client.force_login(User.objects.create_user('sync'))
+
+    def site(self, name, *countries):
+        return {
+            'site_name': name,
+            'description': 'Description of {}'.format(name),
+            'justification': '',
+            'date_inscribed': 2000,
+            'longitude': None,
+            'latitude': None,
+            'area_hectares': None,
+            'transboundary': int(len(countries) > 1),
+            'heritage_site_category_id': self.bamiyan.heritage_site_category_id,
+            'jurisdiction_ids': [country.pk for country in countries],
+        }
+
+    def test_create(self):
+        response = self.client.post(self.url, json.dumps([
+            self.site('Wieliczka Salt Mine', self.poland),
+            self.site('Minaret of Jam', self.afghanistan, self.poland),
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [len(site['heritage_site_jurisdiction']) for site in response.json()], [1, 2])
+        self.assertEqual(HeritageSiteJurisdiction.objects.count(), 6)
+        self.assertEqual(len(search('minaret')), 1)
+
+    def test_create_reports_errors_per_item(self):
+        invalid = self.site('Minaret of Jam', self.afghanistan)
+        invalid['heritage_site_category_id'] = 0
+        response = self.client.post(self.url, json.dumps([
+            self.site('Wieliczka Salt Mine', self.poland),
+            self.site('Bamiyan Valley', self.afghanistan),
+            invalid,
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertIn('site_name', errors[1])
+        self.assertIn('heritage_site_category_id', errors[2])
+        self.assertEqual(HeritageSite.objects.count(), 2)
+
+    def test_update(self):
+        response = self.client.patch(self.url, json.dumps([
+            {'heritage_site_id': self.bamiyan.pk, 'site_name': 'Bamiyan Valley Landscape'},
+            {'heritage_site_id': self.frontier.pk, 'jurisdiction_ids': [self.poland.pk]},
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['site_name'], 'Bamiyan Valley Landscape')
+        self.assertEqual(
+            list(self.frontier.heritagesitejurisdiction_set.values_list('country_area_id', flat=True)),
+            [self.poland.pk])
+
+    def test_update_unknown_site(self):
+        response = self.client.patch(self.url, json.dumps([
+            {'heritage_site_id': self.bamiyan.pk, 'site_name': 'Renamed'},
+            {'heritage_site_id': 0, 'site_name': 'Missing'},
+        ]), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0], {})
+        self.assertEqual(HeritageSite.objects.get(pk=self.bamiyan.pk).site_name, 'Bamiyan Valley')
+
+    def test_delete(self):
+        response = self.client.delete(
+            self.url, json.dumps([self.bamiyan.pk, self.frontier.pk]),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(HeritageSite.objects.exists())
+        self.assertEqual(search('bamiyan'), [])
+
+    def test_partial_update_single_site(self):
+        response = self.client.patch(
+            '/heritagesites/api/sites/{}/'.format(self.bamiyan.pk),
+            {'heritage_site_category_id': self.bamiyan.heritage_site_category_id, 'date_inscribed': 2003},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['heritage_site_jurisdiction']), 1)
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        response = self.client.delete(
+            self.url, json.dumps([self.bamiyan.pk]), content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+
+class ConditionalApiTest(TestCase):
+
+    def setUp(self):
+        self.bamiyan, self.frontier = create_site_fixture()
+
+    def test_site(self):
+        url = '/heritagesites/api/sites/{}/'.format(self.bamiyan.pk)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.force_login(User.objects.create_user('editor'))
+        response = self.client.patch(
+            url, {'date_inscribed': 2003}, content_type='application/json', HTTP_IF_MATCH='"stale"')
+        self.assertEqual(response.status_code, 412)
+
+    def test_list_and_hierarchy(self):
+        for url in ('/heritagesites/api/sites/', '/heritagesites/api/hierarchy/'):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+
+class SiteResponseCacheTest(TestCase):
+
+    def setUp(self):
+        self.bamiyan, self.frontier = create_site_fixture()
+        self.list_url = '/heritagesites/api/sites/'
+        self.site_url = '/heritagesites/api/sites/{}/'.format(self.bamiyan.pk)
+
+    def test_list_hit_after_miss(self):
+        first = self.client.get(self.list_url).json()
+        with self.assertNumQueries(0):
+            second = self.client.get(self.list_url).json()
+        self.assertEqual(first, second)
+        # Other query strings are cached separately.
+        self.assertEqual(len(self.client.get(self.list_url, {'page_size': 1}).json()['results']), 1)
+
+    def test_site_invalidated_by_its_own_changes_only(self):
+        self.assertIsNone(self.client.get(self.site_url).json()['date_inscribed'])
+        HeritageSite.objects.filter(pk=self.bamiyan.pk).update(date_inscribed=1999)
+        sites_changed.send(sender=HeritageSite, site_ids=[self.frontier.pk])
+        self.assertIsNone(self.client.get(self.site_url).json()['date_inscribed'])
+        sites_changed.send(sender=HeritageSite, site_ids=[self.bamiyan.pk])
+        self.assertEqual(self.client.get(self.site_url).json()['date_inscribed'], 1999)
+
+    def test_invalidated_by_category_rename(self):
+        self.client.get(self.site_url)
+        category = HeritageSiteCategory.objects.get(pk=self.bamiyan.heritage_site_category_id)
+        category.category_name = 'Cultural site'
+        category.save()
+        site = self.client.get(self.site_url).json()
+        self.assertEqual(site['heritage_site_category']['category_name'], 'Cultural site')
+
+    def test_stats(self):
+        self.client.get(self.list_url)
+        self.client.get(self.list_url)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        stats = self.client.get('/heritagesites/api/sites/cache-stats/').json()
+        self.assertEqual((stats['list']['hits'], stats['list']['misses']), (1, 1))
+        # Not conditional: the counters change without any site changing.
+        response = self.client.get('/heritagesites/api/sites/cache-stats/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.client.force_login(User.objects.create_user('visitor'))
+        self.assertEqual(self.client.get('/heritagesites/api/sites/cache-stats/').status_code, 403)
+
+
+class SiteExportTest(TestCase):
+
+    def setUp(self):
+        self.bamiyan, self.frontier = create_site_fixture()
+
+    def test_ndjson(self):
+        response = self.client.get('/heritagesites/api/sites/export/ndjson/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+
+    def test_csv_gzip(self):
+        response = self.client.get('/heritagesites/api/sites/export/csv/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8')
+        self.assertEqual(len(content.splitlines()), 3)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/heritagesites/api/sites/export/xml/').status_code, 404)
+
+
+class SiteRowSerializerTest(TestCase):
+
+    def setUp(self):
+        self.bamiyan, self.frontier = create_site_fixture()
+        HeritageSite.objects.filter(pk=self.frontier.pk).update(
+            longitude='-1.5', latitude=None, date_inscribed=1987, area_hectares=12.5)
+
+    def get_both(self, url, params=None):
+        cache.clear()
+        fast = self.client.get(url, params)
+        cache.clear()
+        with mock.patch.object(SiteViewSet, 'row_serializer_class', None):
+            generic = self.client.get(url, params)
+        return fast, generic
+
+    def test_same_json(self):
+        detail = '/heritagesites/api/sites/{}/'.format(self.frontier.pk)
+        for url, params in (
+                ('/heritagesites/api/sites/', None),
+                ('/heritagesites/api/sites/', {'cursor': '', 'page_size': 1}),
+                ('/heritagesites/api/sites/', {'fields': 'site_name,longitude'}),
+                ('/heritagesites/api/sites/', {'expand': 'heritage_site_jurisdiction'}),
+                (detail, None),
+                (detail, {'format': 'json'})):
+            fast, generic = self.get_both(url, params)
+            self.assertEqual(fast.status_code, 200)
+            self.assertEqual(fast.content, generic.content)
+
+    def test_queries(self):
+        cache.clear()
+        get_reference_data()
+        # Sites (page-number pagination: COUNT and page) and their jurisdictions, no joins.
+        with self.assertNumQueries(3):
+            self.client.get('/heritagesites/api/sites/')
+
+
+class ReferenceApiTest(TestCase):
+
+    def setUp(self):
+        create_site_fixture()
+
+    def test_lists(self):
+        for prefix, count in (
+                ('countries', 2), ('regions', 2), ('sub-regions', 2), ('intermediate-regions', 1),
+                ('categories', 1), ('dev-statuses', 0)):
+            response = self.client.get('/heritagesites/api/{}/'.format(prefix))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), count)
+
+    def test_countries_in_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            countries = self.client.get('/heritagesites/api/countries/').json()
+        self.assertEqual(countries[0]['location']['intermediate_region']['intermediate_region_name'],
+                         'Central Asia')
+        self.assertEqual(countries[1]['location']['region']['region_name'], 'Europe')
+        with self.assertNumQueries(0):
+            response = self.client.get('/heritagesites/api/countries/')
+        self.assertEqual(response.json(), countries)
+
+        poland = CountryArea.objects.get(country_area_name='Poland')
+        poland.country_area_name = 'Republic of Poland'
+        poland.save()
+        countries = self.client.get('/heritagesites/api/countries/').json()
+        self.assertEqual(countries[1]['country_area_name'], 'Republic of Poland')
+
+    def test_read_only(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        response = self.client.post('/heritagesites/api/categories/', {'category_name': 'Natural'})
+        self.assertEqual(response.status_code, 405)
+
+
+class ChangeFeedTest(TestCase):
+
+    url = '/heritagesites/api/changes/'
+
+    def setUp(self):
+        self.bamiyan, self.frontier = create_site_fixture()
+        settle_changes()
+        self.cursor = self.client.get(self.url).json()['cursor']
+        self.client.force_login(User.objects.create_user('editor'))
+
+    def test_feed(self):
+        self.client.patch(
+            '/heritagesites/api/sites/{}/'.format(self.bamiyan.pk), {'date_inscribed': 2003},
+            content_type='application/json')
+        self.client.delete('/heritagesites/api/sites/{}/'.format(self.frontier.pk))
+        settle_changes()
+
+        feed = self.client.get(self.url, {'since': self.cursor}).json()
+        self.assertFalse(feed['has_more'])
+        updated, deleted = feed['changes']
+        self.assertEqual((updated['object_id'], updated['action']), (self.bamiyan.pk, 'updated'))
+        self.assertEqual(updated['data']['date_inscribed'], 2003)
+        self.assertEqual((deleted['object_id'], deleted['action'], deleted['data']),
+                         (self.frontier.pk, 'deleted', None))
+
+        self.assertEqual(self.client.get(self.url, {'since': feed['cursor']}).json()['changes'], [])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'since': 'bogus'}).status_code, 400)
+
+    def test_delete_rolled_back_without_change_row(self):
+        with mock.patch('heritagesites.changes.record_changes', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.delete('/heritagesites/api/sites/{}/'.format(self.bamiyan.pk))
+        self.assertTrue(HeritageSite.objects.filter(pk=self.bamiyan.pk).exists())
+
+
+class SiteBatchFetchTest(TestCase):
+
+    url = '/heritagesites/api/sites/batch/'
+
+    def setUp(self):
+        self.bamiyan, self.frontier = create_site_fixture()
+        get_reference_data()
+
+    def test_get_preserves_order_and_reports_missing(self):
+        ids = '{},{},999,{}'.format(self.frontier.pk, self.bamiyan.pk, self.frontier.pk)
+        with self.assertNumQueries(2):
+            body = self.client.get(self.url, {'ids': ids, 'expand': 'heritage_site_jurisdiction'}).json()
+        self.assertEqual(
+            [site['heritage_site_id'] for site in body['results']], [self.frontier.pk, self.bamiyan.pk])
+        self.assertEqual(len(body['results'][0]['heritage_site_jurisdiction']), 2)
+        self.assertEqual(body['missing'], [999])
+
+    def test_post(self):
+        response = self.client.post(
+            self.url + '?fields=site_name', {'ids': [self.bamiyan.pk, self.frontier.pk]},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][1], {
+            'heritage_site_id': self.frontier.pk, 'site_name': 'Frontier Forts'})
+
+    def test_invalid(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'ids': '1,0'}).status_code, 400)
+        response = self.client.post(self.url, {'ids': list(range(1, 502))}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CachedTokenAuthenticationTest(TestCase):
+
+    url = '/heritagesites/api/sites/'
+
+    def setUp(self):
+        create_site_fixture()
+        self.user = User.objects.create_user('mirror')
+        self.token = Token.objects.create(user=self.user)
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Token {}'.format(self.token.key)
+
+    def test_cached(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_token_deleted(self):
+        self.client.get(self.url)
+        self.token.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_user_deactivated(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+@mock.patch.object(TokenBucketThrottle, 'THROTTLE_RATES', {
+    'sites_list': '2/min', 'sites_search': '1/min', 'sites_search_all': '100/min'})
+class TokenBucketThrottleTest(TestCase):
+
+    def setUp(self):
+        create_site_fixture()
+        self.now = 1000.0
+        patcher = mock.patch.object(TokenBucketThrottle, 'timer', lambda throttle: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_refills(self):
+        url = '/heritagesites/api/sites/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+
+        self.now += 30
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 429)
+
+    def test_scopes_and_clients(self):
+        search = '/heritagesites/api/sites/search/'
+        self.assertEqual(self.client.get(search, {'q': 'bamiyan'}).status_code, 200)
+        self.assertEqual(self.client.get(search, {'q': 'bamiyan'}).status_code, 429)
+        # Separate budgets per endpoint class and per client.
+        self.assertEqual(self.client.get('/heritagesites/api/sites/').status_code, 200)
+        response = self.client.get(search, {'q': 'bamiyan'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        stats = self.client.get('/heritagesites/api/sites/throttle-stats/').json()
+        self.assertEqual(stats['sites_search'], {'client': 1, 'all': 0})
+
+    def test_shared_bucket(self):
+        search = '/heritagesites/api/sites/search/'
+        patcher = mock.patch.dict(TokenBucketThrottle.THROTTLE_RATES, {'sites_search_all': '2/min'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.assertEqual(self.client.get(search, {'q': 'bamiyan'}).status_code, 200)
+        # Rejected by its own bucket: takes nothing from the shared one.
+        self.assertEqual(self.client.get(search, {'q': 'bamiyan'}).status_code, 429)
+        response = self.client.get(search, {'q': 'bamiyan'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(search, {'q': 'bamiyan'}, REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
 
-# Create your tests here.
+        self.now += 20
+        response = self.client.get(search, {'q': 'bamiyan'}, REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_rejection_stats()['sites_search'], {'client': 1, 'all': 1})
@@ -0,0 +1,127 @@
+from django.core.cache import cache
+from rest_framework.throttling import SimpleRateThrottle
+
+
+STATS_PREFIX = 'api:throttle:stats:'
+
+# Suffix of the scope whose rate, if configured, caps all clients together (load shedding).
+ALL_CLIENTS = 'all'
+
+
+def _count_rejection(scope, bucket):
+    key = '{}{}:{}'.format(STATS_PREFIX, scope, bucket)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_rejection_stats():
+    """
+    Returns the number of requests rejected per throttle scope, by the client's own bucket
+    ('client') or the bucket shared by all clients ('all'), counted by all workers.
+    :return: dict of scope -> {'client': n, 'all': n}
+    """
+    scopes = sorted(set(
+        scope[:-len(ALL_CLIENTS) - 1] if scope.endswith('_' + ALL_CLIENTS) else scope
+        for scope, rate in TokenBucketThrottle.THROTTLE_RATES.items() if rate
+    ))
+    return {
+        scope: {
+            bucket: cache.get('{}{}:{}'.format(STATS_PREFIX, scope, bucket), 0)
+            for bucket in ('client', ALL_CLIENTS)
+        }
+        for scope in scopes
+    }
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle. The scope of a request comes from the view's get_throttle_scope()
+    (or throttle_scope) and its rate from DEFAULT_THROTTLE_RATES: a rate of 'n/period' lets a
+    client burst n requests and refills n tokens per period. Clients are told apart by user
+    (token or session) or, when anonymous, by IP address.
+
+    Each client bucket is one cache entry (tokens, time of last update) read and written once
+    per request, so a request costs the same whatever the rate; SimpleRateThrottle keeps a
+    list of request times instead. Updates are not atomic, so concurrent requests of one
+    client may occasionally get one request more than their budget.
+
+    If a '<scope>_all' rate of 'n/period' is set, the requests of all clients together are
+    also capped at n per fixed period window, counted with an atomic cache.incr() so that
+    concurrent workers cannot overwrite each other's counts: this sheds load once the
+    endpoint class as a whole is saturated (up to 2n requests may pass around a window
+    boundary). Rejected requests get a 429 with a Retry-After header and are counted per
+    scope (see get_rejection_stats).
+    """
+    cache_format = 'api:throttle:%(scope)s:%(ident)s'
+
+    def __init__(self):
+        # The scope depends on the request; see allow_request().
+        self.wait_seconds = None
+
+    def get_scope(self, request, view):
+        get_throttle_scope = getattr(view, 'get_throttle_scope', None)
+        if get_throttle_scope is not None:
+            return get_throttle_scope()
+        return getattr(view, 'throttle_scope', None)
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = 'user:{}'.format(request.user.pk)
+        else:
+            ident = 'ip:{}'.format(self.get_ident(request))
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        self.scope = self.get_scope(request, view)
+        if self.scope is None:
+            return True
+        now = self.timer()
+
+        rate = self.THROTTLE_RATES.get(self.scope)
+        if rate:
+            key = self.get_cache_key(request, view)
+            capacity, period = self.parse_rate(rate)
+            refill = capacity / period
+            available, updated = self.cache.get(key, (capacity, now))
+            tokens = min(capacity, available + max(0, now - updated) * refill)
+            if tokens < 1:
+                self.wait_seconds = (1 - tokens) / refill
+                _count_rejection(self.scope, 'client')
+                return False
+
+        all_rate = self.THROTTLE_RATES.get('{}_{}'.format(self.scope, ALL_CLIENTS))
+        if all_rate and not self.allow_all_clients(all_rate, now):
+            _count_rejection(self.scope, ALL_CLIENTS)
+            return False
+
+        if rate:
+            # The entry expires once the bucket would be full again anyway.
+            self.cache.set(key, (tokens - 1, now), period)
+        return True
+
+    def allow_all_clients(self, rate, now):
+        """
+        Counts the request in the current window of the bucket shared by all clients.
+        :return: whether the window still had room for it
+        """
+        capacity, period = self.parse_rate(rate)
+        window = int(now // period)
+        key = self.cache_format % {
+            'scope': self.scope, 'ident': '{}:{}'.format(ALL_CLIENTS, window)}
+        self.cache.add(key, 0, period)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr().
+            self.cache.add(key, 1, period)
+            count = 1
+        if count > capacity:
+            self.wait_seconds = (window + 1) * period - now
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
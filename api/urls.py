@@ -2,7 +2,9 @@ from django.urls import include, path
 from rest_framework.documentation import include_docs_urls
 from rest_framework.routers import SimpleRouter
 from rest_framework_swagger.views import get_swagger_view
-from api.views import SiteViewSet
+from api.views import ChangeFeedView, ClusterView, CountryAreaViewSet, DevStatusViewSet, \
+    HeritageSiteCategoryViewSet, HierarchyView, IntermediateRegionViewSet, RegionViewSet, \
+    SiteViewSet, SubRegionViewSet
 
 API_TITLE = 'heritagesites API'
 API_DESC = 'A web API for creating, modifying and deleting Heritage Sites.'
@@ -17,10 +19,19 @@ schema_view = get_swagger_view(title = API_TITLE)
 
 router = SimpleRouter()
 router.register(r'sites', SiteViewSet, base_name='sites')
+router.register(r'countries', CountryAreaViewSet, base_name='countries')
+router.register(r'regions', RegionViewSet, base_name='regions')
+router.register(r'sub-regions', SubRegionViewSet, base_name='sub-regions')
+router.register(r'intermediate-regions', IntermediateRegionViewSet, base_name='intermediate-regions')
+router.register(r'categories', HeritageSiteCategoryViewSet, base_name='categories')
+router.register(r'dev-statuses', DevStatusViewSet, base_name='dev-statuses')
 # urlpatterns = router.urls
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('changes/', ChangeFeedView.as_view(), name='changes'),
+    path('hierarchy/', HierarchyView.as_view(), name='hierarchy'),
+    path('clusters/<int:zoom>/<int:x>/<int:y>/', ClusterView.as_view(), name='clusters'),
     path('docs/', docs_view),
     path('swagger-docs/', schema_view)
     # path('schema/', schema_view)
@@ -1,16 +1,328 @@
-from heritagesites.models import HeritageSite, HeritageSiteJurisdiction
-from api.serializers import HeritageSiteSerializer
+import re
+from collections import OrderedDict
+
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control, never_cache
+from django.utils.text import compress_sequence
+from heritagesites.changes import get_changes
+from heritagesites.clusters import NAMESPACE as CLUSTERS, get_tile, is_valid_tile
+from heritagesites.conditional import sites_condition, versions_condition
+from heritagesites.export import FORMATS as EXPORT_FORMATS, export_sites
+from heritagesites.facets import get_facets
+from heritagesites.filters import HeritageSiteFilter
+from heritagesites.hierarchy import get_location_tree
+from heritagesites.models import CountryArea, DevStatus, HeritageSite, HeritageSiteCategory, \
+    HeritageSiteJurisdiction, IntermediateRegion, Region, SiteChange, SubRegion
+from heritagesites.refdata import NAMESPACE as REFDATA, get_reference_data
+from heritagesites.search import search as search_sites
+from heritagesites.spatial import get_spatial_index
+from heritagesites.signals import sites_changed
+from heritagesites.versions import SITES, site_namespace
+from api.caching import CachedResponseMixin, get_stats
+from api.pagination import SitePagination
+from api.throttling import TokenBucketThrottle, get_rejection_stats
+from api.serializers import BoundingBoxQuerySerializer, ChangeFeedQuerySerializer, \
+    CountryAreaSerializer, DevStatusSerializer, HeritageSiteCategorySerializer, \
+    HeritageSiteRowSerializer, HeritageSiteSerializer, IntermediateRegionSerializer, \
+    NearbyQuerySerializer, RegionSerializer, SiteChangeSerializer, SiteIdsSerializer, \
+    SubRegionSerializer
 from rest_framework import generics, permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+re_accepts_gzip = re.compile(r'\bgzip\b')
 
 
-class SiteViewSet(viewsets.ModelViewSet):
+class SiteViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
-    This ViewSet provides both 'list' and 'detail' views.
+    This ViewSet provides both 'list' and 'detail' views. List responses are cached until
+    any site changes, detail responses until that site changes (see api.caching). On a
+    miss they are built by row_serializer_class from values() rows; set it to None to
+    serialize model instances with serializer_class instead. Responses carry ETags derived
+    from the site data (sites_condition), except those of the statistics actions.
     """
-    queryset = HeritageSite.objects.select_related('heritage_site_category').order_by('site_name')
+    queryset = HeritageSite.objects \
+        .select_related('heritage_site_category') \
+        .with_jurisdictions() \
+        .order_by('site_name')
     serializer_class = HeritageSiteSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    pagination_class = SitePagination
+    throttle_classes = (TokenBucketThrottle,)
+    row_serializer_class = HeritageSiteRowSerializer
+    row_serializer_actions = ('list', 'retrieve', 'batch')
+    # Category and country names (?expand=) come from the reference data.
+    cache_namespaces = (SITES, REFDATA)
+    bulk_max_items = 1000
+    # Their responses do not derive from the site data: no ETag, no conditional GET.
+    unconditional_actions = ('cache_stats', 'throttle_stats')
+
+    def dispatch(self, request, *args, **kwargs):
+        dispatch = super().dispatch
+        if self.action_map.get(request.method.lower()) not in self.unconditional_actions:
+            dispatch = sites_condition(dispatch)
+        return dispatch(request, *args, **kwargs)
+
+    def get_throttle_scope(self):
+        """
+        Budget of the current request (see api.throttling): writes, searches (full-text,
+        facets and spatial queries) or plain reads. The batch fetch is a read.
+        """
+        if self.request.method not in permissions.SAFE_METHODS and self.action != 'batch':
+            return 'sites_write'
+        if self.action in ('search', 'facets', 'nearby', 'within'):
+            return 'sites_search'
+        return 'sites_list'
+
+    def get_cache_namespaces(self):
+        if self.action != 'retrieve':
+            return self.cache_namespaces
+        try:
+            site_id = int(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except (KeyError, TypeError, ValueError):
+            return None
+        return (site_namespace(site_id), REFDATA)
+
+    def get_field_selection(self):
+        """
+        The sparse fieldset requested by a read through ?fields=<names> and/or
+        ?expand=<nested names> (comma-separated), or None for the full representation.
+        :return: set of field names or None
+        """
+        if not hasattr(self, '_field_selection'):
+            self._field_selection = None
+            params = self.request.query_params
+            if (self.request.method in permissions.SAFE_METHODS or self.action == 'batch') \
+                    and ('fields' in params or 'expand' in params):
+                self._field_selection = HeritageSiteSerializer.select_fields(
+                    self._split(params['fields']) if 'fields' in params else None,
+                    self._split(params.get('expand', '')))
+        return self._field_selection
+
+    @staticmethod
+    def _split(value):
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    def uses_row_serializer(self):
+        return self.row_serializer_class is not None \
+            and self.action in self.row_serializer_actions
+
+    def get_serializer_class(self):
+        if self.uses_row_serializer():
+            return self.row_serializer_class
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        selection = self.get_field_selection()
+        if self.uses_row_serializer():
+            queryset = self.row_serializer_class.project_queryset(queryset, selection)
+        elif selection is not None:
+            queryset = HeritageSiteSerializer.project_queryset(queryset, selection)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        selection = self.get_field_selection()
+        if selection is not None:
+            kwargs.setdefault('fields', selection)
+        return super().get_serializer(*args, **kwargs)
+
+    @action(detail=False)
+    def search(self, request):
+        """
+        Ranked full-text search over site name, description and justification:
+        GET sites/search/?q=<terms>. Results are paginated in relevance order.
+        """
+        ranking = [site_id for site_id, score in search_sites(request.query_params.get('q', ''))]
+        page = self.paginate_queryset(ranking)
+        site_ids = page if page is not None else ranking
+
+        sites = self.get_queryset().in_bulk(site_ids)
+        serializer = self.get_serializer(
+            [sites[site_id] for site_id in site_ids if site_id in sites], many=True)
+
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    @action(detail=False, url_path='cache-stats', permission_classes=(permissions.IsAdminUser,))
+    @method_decorator(never_cache)
+    def cache_stats(self, request):
+        """
+        Hit and miss counts of the list/detail response cache: GET sites/cache-stats/
+        """
+        return Response(get_stats(self.basename))
+
+    @action(detail=False, url_path='export/(?P<export_format>{})'.format('|'.join(EXPORT_FORMATS)))
+    def export(self, request, export_format):
+        """
+        Streams every site with its category and jurisdictions: GET sites/export/ndjson/ or
+        sites/export/csv/. The body is produced chunk by chunk and compressed on the fly for
+        clients that accept gzip.
+        """
+        _, content_type, extension = EXPORT_FORMATS[export_format]
+        content = (line.encode('utf-8') for line in export_sites(export_format))
+        gzip = bool(re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+        response = StreamingHttpResponse(
+            compress_sequence(content) if gzip else content, content_type=content_type)
+        if gzip:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['Content-Disposition'] = 'attachment; filename="heritage_sites.{}"'.format(extension)
+        return response
+
+    @action(detail=False, url_path='throttle-stats', permission_classes=(permissions.IsAdminUser,))
+    @method_decorator(never_cache)
+    def throttle_stats(self, request):
+        """
+        Requests rejected by the throttle per scope: GET sites/throttle-stats/
+        """
+        return Response(get_rejection_stats())
+
+    @action(detail=False)
+    def facets(self, request):
+        """
+        Per-category, per-region and per-year site counts for the HeritageSiteFilter
+        parameters given in the query string: GET sites/facets/?region=<id>&...
+        """
+        filterset = HeritageSiteFilter(
+            request.query_params, queryset=HeritageSite.objects.all(), request=request)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(get_facets(filterset))
+
+    @action(detail=False)
+    def nearby(self, request):
+        """
+        The k sites closest to a point, closest first, each with its great-circle distance:
+        GET sites/nearby/?lat=<degrees>&lon=<degrees>&k=<1-100, default 10>
+        """
+        query = NearbyQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        nearest = get_spatial_index().nearest(params['lat'], params['lon'], params['k'])
+        sites = self.get_queryset().in_bulk([site_id for site_id, distance in nearest])
+
+        data = []
+        for site_id, distance in nearest:
+            if site_id not in sites:
+                continue
+            site = self.get_serializer(sites[site_id]).data
+            site['distance_km'] = round(distance, 3)
+            data.append(site)
+        return Response(data)
+
+    @action(detail=False)
+    def within(self, request):
+        """
+        The sites inside a bounding box, paginated:
+        GET sites/within/?bbox=<west>,<south>,<east>,<north>
+        """
+        query = BoundingBoxQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        west, south, east, north = query.validated_data['bbox']
+
+        site_ids = get_spatial_index().within(south, west, north, east)
+        queryset = self.get_queryset().filter(heritage_site_id__in=site_ids)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset, many=True).data)
+
+    @action(detail=False, methods=['post', 'patch', 'delete'])
+    def bulk(self, request):
+        """
+        Applies a list of changes in one transaction:
+        POST sites/bulk/ with a list of sites creates them,
+        PATCH sites/bulk/ with a list of partial sites (each with its heritage_site_id)
+        updates them, DELETE sites/bulk/ with a list of heritage_site_ids deletes them.
+        Nothing is written unless every item is valid; a 400 response lists the errors of
+        each item in input order ({} for valid items).
+        """
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'non_field_errors': ['Expected a non-empty list of items.']},
+                status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.bulk_max_items:
+            return Response(
+                {'non_field_errors': ['At most {} items per request.'.format(self.bulk_max_items)]},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        if request.method == 'POST':
+            serializer = self.get_serializer(data=items, many=True)
+            serializer.is_valid(raise_exception=True)
+            sites = serializer.save()
+            return Response(
+                self._bulk_representation([site.pk for site in sites]),
+                status=status.HTTP_201_CREATED)
+
+        site_ids = [
+            item.get('heritage_site_id') if isinstance(item, dict) else item for item in items
+        ]
+        with transaction.atomic():
+            sites = HeritageSite.objects.select_for_update().in_bulk(
+                [site_id for site_id in site_ids if isinstance(site_id, int)])
+            errors = [{} for site_id in site_ids]
+            seen = set()
+            for index, site_id in enumerate(site_ids):
+                if site_id not in sites:
+                    errors[index] = {'heritage_site_id': ['Site not found.']}
+                elif site_id in seen:
+                    errors[index] = {'heritage_site_id': ['Duplicate heritage_site_id.']}
+                seen.add(site_id)
+            if any(errors):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+            if request.method == 'DELETE':
+                HeritageSite.objects.filter(pk__in=sites).delete()
+                sites_changed.send(sender=HeritageSite, site_ids=list(sites), deleted=True)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
+            serializer = self.get_serializer(
+                [sites[site_id] for site_id in site_ids], data=items, many=True, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        return Response(self._bulk_representation(site_ids))
+
+    @action(detail=False, methods=['get', 'post'], permission_classes=(permissions.AllowAny,))
+    def batch(self, request):
+        """
+        Fetches many sites in one request: GET sites/batch/?ids=1,5,9 or, for long lists,
+        POST sites/batch/ with {"ids": [1, 5, 9]}. ?fields= and ?expand= apply as on the
+        list. Sites, categories and jurisdictions are read with a constant number of queries
+        whatever the number of ids; results follow the requested order (repeated ids once)
+        and unknown ids are listed in `missing`.
+        """
+        if request.method == 'GET':
+            data = {'ids': self._split(request.query_params.get('ids', ''))}
+        else:
+            data = request.data
+        query = SiteIdsSerializer(data=data)
+        query.is_valid(raise_exception=True)
+        site_ids = list(OrderedDict.fromkeys(query.validated_data['ids']))
+
+        queryset = self.get_queryset().filter(heritage_site_id__in=site_ids)
+        sites = {
+            site['heritage_site_id']: site
+            for site in self.get_serializer(queryset, many=True).data
+        }
+        return Response(OrderedDict([
+            ('results', [sites[site_id] for site_id in site_ids if site_id in sites]),
+            ('missing', [site_id for site_id in site_ids if site_id not in sites]),
+        ]))
+
+    def _bulk_representation(self, site_ids):
+        sites = self.get_queryset().in_bulk(site_ids)
+        return self.get_serializer([sites[site_id] for site_id in site_ids], many=True).data
 
     def delete(self, request, pk, format=None):
         site = self.get_object(pk)
@@ -19,7 +331,145 @@ class SiteViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def perform_destroy(self, instance):
-        instance.delete()
+        site_id = instance.heritage_site_id
+        with transaction.atomic():
+            instance.delete()
+            sites_changed.send(sender=HeritageSite, site_ids=[site_id], deleted=True)
+
+
+@method_decorator([cache_control(max_age=60 * 60), versions_condition(REFDATA)], name='dispatch')
+class ReferenceViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Base of the read-only reference data endpoints. Lists are unpaginated (the tables hold
+    at most a few hundred rows) and each is one query, with every nested relation joined by
+    select_related. Reference data changes a few times a year, so responses are cached for a
+    day, keyed on the reference data version, and carry an ETag and a one hour max-age.
+    """
+    permission_classes = (permissions.AllowAny,)
+    pagination_class = None
+    cache_namespaces = (REFDATA,)
+    cache_timeout = 60 * 60 * 24
+
+
+class CountryAreaViewSet(ReferenceViewSet):
+    """
+    Countries/areas with their development status and UNSD location.
+    """
+    queryset = CountryArea.objects.select_related(
+        'dev_status',
+        'location__planet',
+        'location__region',
+        'location__sub_region',
+        'location__intermediate_region')
+    serializer_class = CountryAreaSerializer
+
+
+class RegionViewSet(ReferenceViewSet):
+    queryset = Region.objects.all()
+    serializer_class = RegionSerializer
+
+
+class SubRegionViewSet(ReferenceViewSet):
+    queryset = SubRegion.objects.all()
+    serializer_class = SubRegionSerializer
+
+
+class IntermediateRegionViewSet(ReferenceViewSet):
+    queryset = IntermediateRegion.objects.all()
+    serializer_class = IntermediateRegionSerializer
+
+
+class HeritageSiteCategoryViewSet(ReferenceViewSet):
+    queryset = HeritageSiteCategory.objects.all()
+    serializer_class = HeritageSiteCategorySerializer
+
+
+class DevStatusViewSet(ReferenceViewSet):
+    queryset = DevStatus.objects.all()
+    serializer_class = DevStatusSerializer
+
+
+class ChangeFeedView(APIView):
+    """
+    Incremental change feed for mirrors: GET changes/?since=<cursor>&limit=<n> lists the
+    sites and categories created, updated or deleted after the cursor (from the start of the
+    log without one), each once, with the current representation of those that still exist.
+    Resume from the returned cursor; while has_more is true, more changes are waiting.
+    Changes appear once they are SETTLE_SECONDS old (see heritagesites.changes), so that none
+    is skipped by a cursor. Each request costs a few queries proportional to the changes
+    returned, not to the dataset.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, format=None):
+        query = ChangeFeedQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        try:
+            batch = get_changes(query.validated_data['since'], query.validated_data['limit'])
+        except ValueError:
+            raise ValidationError({'since': 'Invalid cursor.'})
+
+        site_ids = [
+            change.object_id for change in batch.changes
+            if change.object_type == SiteChange.SITE and change.action == SiteChange.UPDATED
+        ]
+        sites = {}
+        if site_ids:
+            rows = HeritageSiteRowSerializer.project_queryset(
+                HeritageSite.objects.filter(heritage_site_id__in=site_ids))
+            sites = {
+                site['heritage_site_id']: site
+                for site in HeritageSiteRowSerializer(rows, many=True).data
+            }
+        refdata = get_reference_data()
+
+        changes = []
+        for change in batch.changes:
+            representation = SiteChangeSerializer(change).data
+            data = None
+            if change.action == SiteChange.UPDATED:
+                if change.object_type == SiteChange.SITE:
+                    data = sites.get(change.object_id)
+                else:
+                    category = refdata.get(HeritageSiteCategory, change.object_id)
+                    if category is not None:
+                        data = HeritageSiteCategorySerializer(category).data
+            representation['data'] = data
+            changes.append(representation)
+
+        return Response({
+            'cursor': batch.cursor,
+            'has_more': batch.has_more,
+            'changes': changes,
+        })
+
+
+@method_decorator(versions_condition(REFDATA), name='dispatch')
+class HierarchyView(APIView):
+    """
+    Returns the whole UNSD location hierarchy (planet -> region -> sub-region ->
+    intermediate region -> country/area) as one nested document. The tree is built once per
+    worker from the reference data cache and rebuilt only when reference data changes.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, format=None):
+        return Response(get_location_tree().roots)
+
+
+@method_decorator(versions_condition(CLUSTERS, REFDATA), name='dispatch')
+class ClusterView(APIView):
+    """
+    Returns the site clusters of one Web Mercator map tile (zoom/x/y, as used by slippy map
+    tile URLs): per cluster its site count, centroid and dominant heritage site category. All
+    zoom levels are precomputed per worker and each tile response is cached.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, zoom, x, y, format=None):
+        if not is_valid_tile(zoom, x, y):
+            raise Http404
+        return Response(get_tile(zoom, x, y))
 
 
 '''
@@ -1,6 +1,10 @@
 from django.contrib import admin
+from django.db import transaction
 
 import heritagesites.models as models
+from heritagesites.forms import HeritageSiteAdminForm
+from heritagesites.jurisdictions import set_jurisdictions
+from heritagesites.signals import sites_changed
 
 
 # registering newly created models Planet and Location
@@ -68,6 +72,8 @@ class DevStatusAdmin(admin.ModelAdmin):
 
 @admin.register(models.HeritageSite)
 class HeritageSiteAdmin(admin.ModelAdmin):
+	form = HeritageSiteAdminForm
+
 	fieldsets = (
 		(None, {
 			'fields': (
@@ -85,7 +91,8 @@ class HeritageSiteAdmin(admin.ModelAdmin):
 					'latitude'
 				),
 				'area_hectares',
-				'transboundary'
+				'transboundary',
+				'jurisdictions'
 			]
 		})
 	)
@@ -103,6 +110,23 @@ class HeritageSiteAdmin(admin.ModelAdmin):
 		'date_inscribed'
 	)
 
+	def save_related(self, request, form, formsets, change):
+		super().save_related(request, form, formsets, change)
+		set_jurisdictions(form.instance, form.cleaned_data['jurisdictions'])
+		sites_changed.send(sender=models.HeritageSite, site_ids=[form.instance.heritage_site_id])
+
+	def delete_model(self, request, obj):
+		site_id = obj.heritage_site_id
+		with transaction.atomic():
+			super().delete_model(request, obj)
+			sites_changed.send(sender=models.HeritageSite, site_ids=[site_id], deleted=True)
+
+	def delete_queryset(self, request, queryset):
+		with transaction.atomic():
+			site_ids = list(queryset.values_list('heritage_site_id', flat=True))
+			super().delete_queryset(request, queryset)
+			sites_changed.send(sender=models.HeritageSite, site_ids=site_ids, deleted=True)
+
 # admin.site.register(models.HeritageSite)
 
 
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class HeritagesitesConfig(AppConfig):
     name = 'heritagesites'
+
+    def ready(self):
+        # Connect signal receivers that maintain derived data and caches.
+        from . import versions, refdata, geography, search, spatial, clusters, \
+            conditional, changes, auth
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, \
+	get_user_model, load_backend, user_logged_out
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+
+KEY_PREFIX = 'heritagesites:auth:user:'
+
+# Short, so that changes made outside the ORM signals (raw SQL, another project sharing the
+# database) are picked up quickly; saves and deletes invalidate at once.
+TIMEOUT = 60 * 5
+
+
+def get_cached_user(user_id, load):
+	"""
+	Returns the user with the given primary key from the cache, or calls `load` and caches
+	its result (None is not cached).
+	:param load: function returning the user or None
+	"""
+	key = '{}{}'.format(KEY_PREFIX, user_id)
+	user = cache.get(key)
+	if user is None:
+		user = load()
+		if user is not None:
+			cache.set(key, user, TIMEOUT)
+	return user
+
+
+def invalidate_user(user_id):
+	cache.delete('{}{}'.format(KEY_PREFIX, user_id))
+
+
+def get_user(request):
+	"""
+	django.contrib.auth.get_user() with the user looked up in the cache instead of through
+	the authentication backend, so an authenticated request whose session is cached too
+	(SESSION_ENGINE cached_db) needs no query to identify the user. The session hash is
+	still verified on every request, so a password change still logs out other sessions.
+	"""
+	try:
+		user_id = get_user_model()._meta.pk.to_python(request.session[SESSION_KEY])
+		backend_path = request.session[BACKEND_SESSION_KEY]
+	except KeyError:
+		return AnonymousUser()
+	if backend_path not in settings.AUTHENTICATION_BACKENDS:
+		return AnonymousUser()
+
+	user = get_cached_user(user_id, lambda: load_backend(backend_path).get_user(user_id))
+	if hasattr(user, 'get_session_auth_hash'):
+		session_hash = request.session.get(HASH_SESSION_KEY)
+		if not (session_hash and constant_time_compare(session_hash, user.get_session_auth_hash())):
+			request.session.flush()
+			user = None
+	return user or AnonymousUser()
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+	"""
+	AuthenticationMiddleware that resolves request.user with the cached get_user() above.
+	"""
+
+	def process_request(self, request):
+		super().process_request(request)
+		request.user = SimpleLazyObject(lambda: get_user(request))
+
+
+def user_changed_handler(sender, instance, **kwargs):
+	invalidate_user(instance.pk)
+
+
+def user_permissions_changed_handler(sender, instance, action, reverse, pk_set, **kwargs):
+	if not action.startswith('post_'):
+		return
+	if reverse:
+		# A group or permission gained or lost users: pk_set holds their ids (all of them on
+		# clear, which Django does not report).
+		for user_id in pk_set or ():
+			invalidate_user(user_id)
+	else:
+		invalidate_user(instance.pk)
+
+
+def user_logged_out_handler(sender, request, user, **kwargs):
+	if user is not None:
+		invalidate_user(user.pk)
+
+
+User = get_user_model()
+post_save.connect(user_changed_handler, sender=User)
+post_delete.connect(user_changed_handler, sender=User)
+m2m_changed.connect(user_permissions_changed_handler, sender=User.groups.through)
+m2m_changed.connect(user_permissions_changed_handler, sender=User.user_permissions.through)
+user_logged_out.connect(user_logged_out_handler)
@@ -0,0 +1,35 @@
+from django.db.models import Case, Value, When
+
+
+def bulk_update(objs, fields, batch_size=None):
+	"""
+	Saves `fields` of already saved instances of one model with a single
+	UPDATE ... SET field = CASE pk WHEN ... END ... WHERE pk IN (...) per batch, like
+	QuerySet.bulk_update() in Django 2.2 (not available in the Django 2.1 this project runs).
+	:param objs: list of model instances
+	:param fields: names of the concrete fields to save
+	:return: number of rows matched
+	"""
+	if not objs:
+		return 0
+	meta = objs[0]._meta
+	fields = [meta.get_field(name) for name in fields]
+	batch_size = batch_size or len(objs)
+
+	rows = 0
+	for start in range(0, len(objs), batch_size):
+		batch = objs[start:start + batch_size]
+		updates = {
+			field.attname: Case(
+				*[
+					When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field))
+					for obj in batch
+				],
+				output_field=field
+			)
+			for field in fields
+		}
+		rows += meta.model._default_manager \
+			.filter(pk__in=[obj.pk for obj in batch]) \
+			.update(**updates)
+	return rows
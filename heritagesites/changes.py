@@ -0,0 +1,95 @@
+from datetime import timedelta
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import HeritageSiteCategory, SiteChange
+from .pagination import decode_cursor, encode_cursor
+from .signals import sites_changed
+
+
+KEYSET = ('change_id',)
+MAX_LIMIT = 1000
+
+# change_id is assigned at INSERT but becomes visible at COMMIT, and transactions commit in
+# any order: a reader may see id 11 while id 10 is still uncommitted. The feed therefore
+# only serves rows older than this, which must exceed the time any write transaction stays
+# open after recording its changes (by sites_changed, at the end of the write).
+SETTLE_SECONDS = 10
+
+
+def record_changes(object_type, object_ids, action):
+	"""
+	Appends one site_change row per object with a single INSERT.
+	"""
+	changed_at = timezone.now()
+	SiteChange.objects.bulk_create([
+		SiteChange(
+			object_type=object_type, object_id=object_id, action=action, changed_at=changed_at)
+		for object_id in sorted(set(object_ids))
+	])
+
+
+class ChangeBatch:
+	"""
+	The changes following a cursor: `changes` holds the latest SiteChange of each object
+	changed in the batch, in log order; `cursor` is where the next request should resume.
+	"""
+
+	def __init__(self, changes, cursor, has_more):
+		self.changes = changes
+		self.cursor = cursor
+		self.has_more = has_more
+
+
+def get_changes(cursor=None, limit=100):
+	"""
+	Reads up to `limit` change log rows after `cursor` (from the start of the log if empty)
+	with one primary key range query. Several changes to the same object collapse into the
+	latest one, so a client syncs each changed object once per batch whatever its churn.
+	The batch stops at the first row less than SETTLE_SECONDS old, so the cursor never moves
+	past a change id whose transaction may still be open.
+	:return: ChangeBatch
+	:raises ValueError: if the cursor is malformed
+	"""
+	last_id = 0
+	if cursor:
+		values, reverse = decode_cursor(cursor, KEYSET)
+		if reverse or not isinstance(values[0], int) or isinstance(values[0], bool):
+			raise ValueError('Invalid cursor.')
+		last_id = values[0]
+
+	settled_before = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+	rows = list(SiteChange.objects.filter(change_id__gt=last_id).order_by('change_id')[:limit + 1])
+	for index, row in enumerate(rows):
+		# changed_at is not monotonic in change_id (clocks, time taken before the INSERT),
+		# so test every row rather than filtering on it.
+		if row.changed_at >= settled_before:
+			rows = rows[:index]
+			break
+	has_more = len(rows) > limit
+	rows = rows[:limit]
+
+	latest = {}
+	for row in rows:
+		latest.pop((row.object_type, row.object_id), None)
+		latest[(row.object_type, row.object_id)] = row
+	if rows:
+		last_id = rows[-1].change_id
+	return ChangeBatch(list(latest.values()), encode_cursor([last_id]), has_more)
+
+
+@receiver(sites_changed)
+def sites_changed_handler(sender, site_ids, deleted=False, **kwargs):
+	record_changes(SiteChange.SITE, site_ids, SiteChange.DELETED if deleted else SiteChange.UPDATED)
+
+
+@receiver(post_save, sender=HeritageSiteCategory)
+def category_saved_handler(sender, instance, **kwargs):
+	record_changes(SiteChange.CATEGORY, [instance.pk], SiteChange.UPDATED)
+
+
+@receiver(post_delete, sender=HeritageSiteCategory)
+def category_deleted_handler(sender, instance, **kwargs):
+	record_changes(SiteChange.CATEGORY, [instance.pk], SiteChange.DELETED)
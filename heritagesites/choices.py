@@ -0,0 +1,192 @@
+from operator import attrgetter
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from .refdata import NAMESPACE as REFDATA, get_reference_data
+from .versions import VersionedSnapshot
+
+
+class ChoiceList:
+	"""
+	The (value, label) choices of a reference model in a fixed order, with the <option> HTML
+	of every choice rendered once, both unselected and selected. Instances are immutable and
+	shared by all requests of a worker.
+	"""
+
+	def __init__(self, choices):
+		self._choices = tuple(choices)
+		self._options = tuple(
+			(
+				str(value),
+				format_html('\n  <option value="{}">{}</option>', value, label),
+				format_html('\n  <option value="{}" selected>{}</option>', value, label),
+			)
+			for value, label in self._choices
+		)
+
+	def __iter__(self):
+		return iter(self._choices)
+
+	def __len__(self):
+		return len(self._choices)
+
+	def render(self, selected):
+		"""
+		:param selected: iterable of selected values as strings
+		:return: SafeText of <option> elements
+		"""
+		selected = set(selected)
+		return mark_safe(''.join(
+			selected_html if value in selected else html
+			for value, html, selected_html in self._options
+		))
+
+
+class ChoiceLists:
+	"""
+	ChoiceList per reference model, ordering and empty label, built on first use from a
+	ReferenceData snapshot.
+	"""
+
+	def __init__(self, refdata):
+		self._refdata = refdata
+		self._lists = {}
+
+	def get(self, model, ordering, empty_label=None):
+		key = (model, tuple(ordering), empty_label)
+		choice_list = self._lists.get(key)
+		if choice_list is None:
+			instances = self._refdata.all(model)
+			# Stable sorts from the last ordering field to the first.
+			for field in reversed(ordering):
+				instances.sort(key=attrgetter(field.lstrip('-')), reverse=field.startswith('-'))
+			choices = [] if empty_label is None else [('', empty_label)]
+			choices.extend((instance.pk, str(instance)) for instance in instances)
+			choice_list = self._lists[key] = ChoiceList(choices)
+		return choice_list
+
+
+_snapshot = VersionedSnapshot(REFDATA, lambda: ChoiceLists(get_reference_data()))
+
+
+def get_choice_list(queryset, empty_label=None):
+	"""
+	Returns the cached ChoiceList of a reference model. The queryset is never evaluated: only
+	its model and ordering (or the model's default ordering) are used.
+	:return: ChoiceList
+	"""
+	ordering = queryset.query.order_by or queryset.model._meta.ordering
+	return _snapshot.get().get(queryset.model, ordering, empty_label)
+
+
+class ReferenceChoices:
+	"""
+	Lazy choices of a reference field, resolved to the current ChoiceList on use (the way
+	ModelChoiceIterator defers its query), so fields built at import time stay current.
+	"""
+
+	def __init__(self, queryset, empty_label=None):
+		self.queryset = queryset
+		self.empty_label = empty_label
+
+	def _list(self):
+		return get_choice_list(self.queryset, self.empty_label)
+
+	def __iter__(self):
+		return iter(self._list())
+
+	def __len__(self):
+		return len(self._list())
+
+	def render(self, selected):
+		return self._list().render(selected)
+
+
+def _resolve(model, value):
+	if isinstance(value, model):
+		value = value.pk
+	try:
+		return get_reference_data().get(model, int(value))
+	except (TypeError, ValueError):
+		return None
+
+
+class CachedSelect(forms.Select):
+	"""
+	Select widget whose choices are ReferenceChoices: the pre-rendered options are joined
+	instead of rendering one template per option.
+	"""
+	template_name = 'heritagesites/widgets/cached_select.html'
+
+	def optgroups(self, name, value, attrs=None):
+		return []
+
+	def get_context(self, name, value, attrs):
+		context = super().get_context(name, value, attrs)
+		context['widget']['options'] = self.choices.render(context['widget']['value'])
+		return context
+
+
+class CachedSelectMultiple(CachedSelect, forms.SelectMultiple):
+	pass
+
+
+class ReferenceChoiceField(forms.ModelChoiceField):
+	"""
+	ModelChoiceField over a reference model whose choices come from the reference data cache
+	and whose value is resolved against it, so neither rendering nor cleaning the field
+	queries the database. Cleaned values are the shared cached instances.
+	"""
+	widget = CachedSelect
+
+	def _get_choices(self):
+		return ReferenceChoices(self.queryset, self.empty_label)
+
+	choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+	def to_python(self, value):
+		if value in self.empty_values:
+			return None
+		instance = _resolve(self.queryset.model, value)
+		if instance is None:
+			raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+		return instance
+
+
+class ReferenceMultipleChoiceField(forms.ModelMultipleChoiceField):
+	"""
+	ModelMultipleChoiceField counterpart of ReferenceChoiceField. Cleans to a list of cached
+	instances in the submitted order.
+	"""
+	widget = CachedSelectMultiple
+
+	def _get_choices(self):
+		return ReferenceChoices(self.queryset)
+
+	choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+	def clean(self, value):
+		value = self.prepare_value(value)
+		if self.required and not value:
+			raise ValidationError(self.error_messages['required'], code='required')
+		if not value:
+			return []
+		if not isinstance(value, (list, tuple)):
+			raise ValidationError(self.error_messages['list'], code='list')
+
+		instances = []
+		for pk in value:
+			instance = _resolve(self.queryset.model, pk)
+			if instance is None:
+				raise ValidationError(
+					self.error_messages['invalid_choice'],
+					code='invalid_choice',
+					params={'value': pk},
+				)
+			if instance not in instances:
+				instances.append(instance)
+		self.run_validators(value)
+		return instances
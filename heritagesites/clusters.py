@@ -0,0 +1,213 @@
+import math
+
+from django.core.cache import cache
+from django.dispatch import receiver
+
+from .models import HeritageSite, HeritageSiteCategory
+from .refdata import NAMESPACE as REFDATA, get_reference_data
+from .signals import sites_changed
+from .versions import VersionedSnapshot, get_version
+
+
+NAMESPACE = 'clusters'
+
+KEY_PREFIX = 'heritagesites:clusters:'
+TIMEOUT = 60 * 60
+
+# Zoom levels are precomputed up to MAX_ZOOM; beyond it a viewport holds few enough sites to
+# be fetched individually (sites/within/).
+MAX_ZOOM = 10
+
+# Clusters per tile edge: a 256 pixel map tile is split into 8 x 8 cells of 32 pixels.
+CLUSTER_GRID = 8
+
+# Web Mercator is undefined at the poles; coordinates are clamped to the usual square extent.
+MAX_LATITUDE = 85.0511287798
+
+_BELOW_ONE = 1.0 - 1e-12
+
+
+def project(lat, lon):
+	"""
+	Web Mercator projection of a point onto the unit square, x growing eastwards and y
+	southwards from the north-west corner.
+	:return: (x, y) with 0 <= x, y < 1
+	"""
+	lat = math.radians(min(max(lat, -MAX_LATITUDE), MAX_LATITUDE))
+	x = (lon + 180.0) / 360.0
+	y = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2
+	return min(max(x, 0.0), _BELOW_ONE), min(max(y, 0.0), _BELOW_ONE)
+
+
+def _cell(x, y, zoom):
+	cells = CLUSTER_GRID << zoom
+	return int(x * cells), int(y * cells)
+
+
+class ClusterIndex:
+	"""
+	Site clusters for every zoom level up to MAX_ZOOM. At each zoom the Web Mercator plane is
+	cut into CLUSTER_GRID x CLUSTER_GRID cells per tile and every non-empty cell holds one
+	cluster: its site count, centroid and dominant heritage site category. Instances are
+	immutable: with_sites() returns a copy in which only the cells the given sites left or
+	entered are recomputed.
+	"""
+
+	def __init__(self, sites, members, clusters):
+		# sites: heritage_site_id -> (latitude, longitude, heritage_site_category_id, x, y)
+		# members: per zoom, cell -> frozenset of heritage_site_id
+		# clusters: per zoom, cell -> cluster dict
+		self._sites = sites
+		self._members = members
+		self._clusters = clusters
+
+	@staticmethod
+	def _load(queryset):
+		sites = {}
+		rows = queryset.filter(latitude__isnull=False, longitude__isnull=False) \
+			.order_by() \
+			.values_list('heritage_site_id', 'latitude', 'longitude', 'heritage_site_category_id')
+		for site_id, lat, lon, category_id in rows:
+			lat, lon = float(lat), float(lon)
+			sites[site_id] = (lat, lon, category_id) + project(lat, lon)
+		return sites
+
+	@classmethod
+	def build(cls):
+		sites = cls._load(HeritageSite.objects.all())
+		members = []
+		for zoom in range(MAX_ZOOM + 1):
+			cells = {}
+			for site_id, (lat, lon, category_id, x, y) in sites.items():
+				cells.setdefault(_cell(x, y, zoom), set()).add(site_id)
+			members.append({cell: frozenset(site_ids) for cell, site_ids in cells.items()})
+		clusters = [
+			{cell: cls._aggregate(sites, site_ids) for cell, site_ids in cells.items()}
+			for cells in members
+		]
+		return cls(sites, members, clusters)
+
+	@staticmethod
+	def _aggregate(sites, site_ids):
+		categories = {}
+		lat_sum = lon_sum = 0.0
+		for site_id in site_ids:
+			lat, lon, category_id = sites[site_id][:3]
+			lat_sum += lat
+			lon_sum += lon
+			categories[category_id] = categories.get(category_id, 0) + 1
+		count = len(site_ids)
+		return {
+			'count': count,
+			'latitude': round(lat_sum / count, 6),
+			'longitude': round(lon_sum / count, 6),
+			'heritage_site_category_id': min(
+				categories, key=lambda category_id: (-categories[category_id], category_id)),
+			'heritage_site_id': next(iter(site_ids)) if count == 1 else None,
+		}
+
+	def with_sites(self, site_ids):
+		"""
+		Returns a copy of the index with the coordinates and category of the given sites
+		re-read from the database (sites deleted or without coordinates are dropped).
+		"""
+		site_ids = set(site_ids)
+		loaded = self._load(HeritageSite.objects.filter(heritage_site_id__in=site_ids))
+
+		sites = dict(self._sites)
+		changed = set()
+		for site_id in site_ids:
+			if sites.get(site_id) != loaded.get(site_id):
+				changed.add(site_id)
+				sites.pop(site_id, None)
+				if site_id in loaded:
+					sites[site_id] = loaded[site_id]
+		if not changed:
+			return self
+
+		members = []
+		clusters = []
+		for zoom in range(MAX_ZOOM + 1):
+			zoom_members = dict(self._members[zoom])
+			affected = set()
+			for site_id in changed:
+				for point in (self._sites.get(site_id), sites.get(site_id)):
+					if point is not None:
+						affected.add(_cell(point[3], point[4], zoom))
+
+			zoom_clusters = dict(self._clusters[zoom])
+			for cell in affected:
+				cell_sites = frozenset(
+					site_id for site_id in zoom_members.get(cell, ()) if site_id not in changed
+				).union(
+					site_id for site_id in changed
+					if site_id in sites and _cell(sites[site_id][3], sites[site_id][4], zoom) == cell
+				)
+				if cell_sites:
+					zoom_members[cell] = cell_sites
+					zoom_clusters[cell] = self._aggregate(sites, cell_sites)
+				else:
+					zoom_members.pop(cell, None)
+					zoom_clusters.pop(cell, None)
+			members.append(zoom_members)
+			clusters.append(zoom_clusters)
+
+		return ClusterIndex(sites, members, clusters)
+
+	def tile(self, zoom, x, y):
+		"""
+		Returns the clusters of one map tile, north-west first.
+		:return: list of cluster dicts ('count', 'latitude', 'longitude',
+			'heritage_site_category_id', and 'heritage_site_id' for single-site clusters)
+		"""
+		clusters = self._clusters[zoom]
+		found = []
+		for cell_y in range(y * CLUSTER_GRID, (y + 1) * CLUSTER_GRID):
+			for cell_x in range(x * CLUSTER_GRID, (x + 1) * CLUSTER_GRID):
+				cluster = clusters.get((cell_x, cell_y))
+				if cluster is not None:
+					found.append(cluster)
+		return found
+
+
+_snapshot = VersionedSnapshot(NAMESPACE, ClusterIndex.build)
+
+
+def get_cluster_index():
+	"""
+	Returns this worker's ClusterIndex, (re)building it if needed.
+	:return: ClusterIndex
+	"""
+	return _snapshot.get()
+
+
+def is_valid_tile(zoom, x, y):
+	return 0 <= zoom <= MAX_ZOOM and 0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom
+
+
+def get_tile(zoom, x, y):
+	"""
+	Returns the clusters of a map tile with their category names, cached per tile. The key
+	carries the cluster and reference data versions, so any write starts a new generation of
+	entries.
+	:return: dict with 'zoom', 'x', 'y' and 'clusters'
+	"""
+	key = '{}{}:{}:{}:{}:{}'.format(
+		KEY_PREFIX, get_version(NAMESPACE), get_version(REFDATA), zoom, x, y)
+	tile = cache.get(key)
+	if tile is None:
+		refdata = get_reference_data()
+		clusters = []
+		for cluster in get_cluster_index().tile(zoom, x, y):
+			category = refdata.get(HeritageSiteCategory, cluster['heritage_site_category_id'])
+			clusters.append(dict(
+				cluster, heritage_site_category=category.category_name if category else None))
+		tile = {'zoom': zoom, 'x': x, 'y': y, 'clusters': clusters}
+		cache.set(key, tile, TIMEOUT)
+	return tile
+
+
+@receiver(sites_changed)
+def sites_changed_handler(sender, site_ids, deleted=False, **kwargs):
+	site_ids = list(site_ids)
+	_snapshot.update(lambda index: index.with_sites(site_ids))
@@ -0,0 +1,91 @@
+import hashlib
+
+from django.dispatch import receiver
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import HeritageSite
+from .refdata import NAMESPACE as REFDATA
+from .signals import sites_changed
+from .versions import SITES, get_version
+
+
+def _variant(request):
+	"""
+	What a response depends on besides the data: the full path (query string included), the
+	negotiated format and the logged-in user, whom HTML pages and the browsable API show.
+	"""
+	user = getattr(request, 'user', None)
+	user_id = user.pk if user is not None and user.is_authenticated else None
+	return request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), user_id
+
+
+def _etag(*parts):
+	return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _site_updated_at(request, pk):
+	"""
+	Looks up a site's updated_at once per request (condition() asks for the ETag and the
+	Last-Modified time separately).
+	:return: (site exists, updated_at or None)
+	"""
+	lookups = request.__dict__.setdefault('_site_updated_at', {})
+	if pk not in lookups:
+		try:
+			rows = list(
+				HeritageSite.objects.filter(pk=int(pk)).values_list('updated_at', flat=True)[:1])
+		except (TypeError, ValueError):
+			rows = []
+		lookups[pk] = (bool(rows), rows[0] if rows else None)
+	return lookups[pk]
+
+
+def sites_etag(request, pk=None, *args, **kwargs):
+	"""
+	ETag of a view showing one site (`pk` given: derived from its updated_at, one primary key
+	lookup) or any number of sites (derived from the dataset versions, no query). Both include
+	the reference data version for the country, region and category names shown.
+	:return: string, or None for an unknown site
+	"""
+	if pk is None:
+		return _etag(get_version(SITES), get_version(REFDATA), _variant(request))
+
+	found, updated_at = _site_updated_at(request, pk)
+	if not found:
+		return None
+	# Rows inserted outside the app have no updated_at yet; fall back to the dataset version.
+	modified = updated_at.isoformat() if updated_at is not None else get_version(SITES)
+	return _etag(pk, modified, get_version(REFDATA), _variant(request))
+
+
+def sites_last_modified(request, pk=None, *args, **kwargs):
+	"""
+	Last-Modified time of a view showing one site. Reference data renames do not change it;
+	clients sending If-None-Match (which takes precedence) are not affected.
+	:return: datetime or None
+	"""
+	if pk is None:
+		return None
+	return _site_updated_at(request, pk)[1]
+
+
+# Conditional GET (304 Not Modified) and If-Match/If-Unmodified-Since (412) for views of
+# sites: decorate function views, or dispatch() with method_decorator.
+sites_condition = condition(etag_func=sites_etag, last_modified_func=sites_last_modified)
+
+
+def versions_condition(*namespaces):
+	"""
+	condition() decorator for views derived only from the data of the given version
+	namespaces (e.g. the reference data): the ETag costs one cache lookup per namespace.
+	"""
+	def etag(request, *args, **kwargs):
+		return _etag([get_version(namespace) for namespace in namespaces], _variant(request))
+	return condition(etag_func=etag)
+
+
+@receiver(sites_changed)
+def sites_changed_handler(sender, site_ids, deleted=False, **kwargs):
+	if not deleted:
+		HeritageSite.objects.filter(pk__in=list(site_ids)).update(updated_at=timezone.now())
@@ -0,0 +1,153 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import CountryArea, HeritageSite, HeritageSiteCategory, HeritageSiteJurisdiction
+from .refdata import get_reference_data
+
+
+CHUNK_SIZE = 500
+
+SITE_FIELDS = (
+	'heritage_site_id',
+	'site_name',
+	'description',
+	'justification',
+	'date_inscribed',
+	'longitude',
+	'latitude',
+	'area_hectares',
+	'transboundary',
+	'heritage_site_category_id',
+)
+
+CSV_COLUMNS = SITE_FIELDS + (
+	'category_name',
+	'country_area_ids',
+	'country_area_names',
+	'iso_alpha3_codes',
+)
+
+# Separator of the jurisdiction lists in CSV cells.
+CSV_LIST_SEPARATOR = '|'
+
+
+def iter_site_rows(chunk_size=CHUNK_SIZE):
+	"""
+	Yields every site as a dict of SITE_FIELDS plus `jurisdictions`, a list of its
+	country/area ids ordered by country/area name, in primary key order. Sites are read in
+	keyset chunks (WHERE heritage_site_id > last ORDER BY heritage_site_id LIMIT chunk_size,
+	a primary key range scan) with one jurisdiction query per chunk, so memory stays bounded
+	by chunk_size whatever the size of the table; a plain iterator() would not do that on
+	MySQL, whose driver buffers the whole result set client side.
+	"""
+	refdata = get_reference_data()
+
+	def country_name(country_area_id):
+		country = refdata.get(CountryArea, country_area_id)
+		return country.country_area_name if country is not None else ''
+
+	last_id = None
+	while True:
+		sites = HeritageSite.objects.order_by('heritage_site_id')
+		if last_id is not None:
+			sites = sites.filter(heritage_site_id__gt=last_id)
+		rows = list(sites.values(*SITE_FIELDS)[:chunk_size])
+		if not rows:
+			return
+
+		jurisdictions = {row['heritage_site_id']: [] for row in rows}
+		pairs = HeritageSiteJurisdiction.objects \
+			.filter(heritage_site_id__in=list(jurisdictions)) \
+			.order_by() \
+			.values_list('heritage_site_id', 'country_area_id')
+		for site_id, country_area_id in pairs:
+			jurisdictions[site_id].append(country_area_id)
+
+		for row in rows:
+			row['jurisdictions'] = sorted(
+				jurisdictions[row['heritage_site_id']], key=lambda pk: (country_name(pk), pk))
+			yield row
+
+		if len(rows) < chunk_size:
+			return
+		last_id = rows[-1]['heritage_site_id']
+
+
+def _countries(refdata, country_area_ids):
+	countries = []
+	for country_area_id in country_area_ids:
+		country = refdata.get(CountryArea, country_area_id)
+		countries.append({
+			'country_area_id': country_area_id,
+			'country_area_name': country.country_area_name if country is not None else None,
+			'iso_alpha3_code': country.iso_alpha3_code if country is not None else None,
+		})
+	return countries
+
+
+def _category_name(refdata, category_id):
+	category = refdata.get(HeritageSiteCategory, category_id)
+	return category.category_name if category is not None else None
+
+
+def ndjson_lines(rows):
+	"""
+	Yields one JSON document per site, newline terminated. Decimal coordinates are written
+	as strings, as in the API.
+	"""
+	refdata = get_reference_data()
+	encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+	for row in rows:
+		record = {field: row[field] for field in SITE_FIELDS}
+		record['heritage_site_category'] = {
+			'category_id': row['heritage_site_category_id'],
+			'category_name': _category_name(refdata, row['heritage_site_category_id']),
+		}
+		record['jurisdictions'] = _countries(refdata, row['jurisdictions'])
+		yield encoder.encode(record) + '\n'
+
+
+class _Echo:
+	"""
+	File-like object handing back what csv.writer writes, so rows can be streamed.
+	"""
+
+	def write(self, value):
+		return value
+
+
+def csv_lines(rows):
+	"""
+	Yields a header line, then one line per site, with the jurisdiction ids, names and ISO
+	codes joined by CSV_LIST_SEPARATOR.
+	"""
+	refdata = get_reference_data()
+	writer = csv.writer(_Echo())
+	yield writer.writerow(CSV_COLUMNS)
+	for row in rows:
+		countries = _countries(refdata, row['jurisdictions'])
+		yield writer.writerow([row[field] for field in SITE_FIELDS] + [
+			_category_name(refdata, row['heritage_site_category_id']),
+			CSV_LIST_SEPARATOR.join(str(country['country_area_id']) for country in countries),
+			CSV_LIST_SEPARATOR.join(country['country_area_name'] or '' for country in countries),
+			CSV_LIST_SEPARATOR.join(country['iso_alpha3_code'] or '' for country in countries),
+		])
+
+
+# Export format -> (line generator, content type, file extension)
+FORMATS = {
+	'ndjson': (ndjson_lines, 'application/x-ndjson; charset=utf-8', 'ndjson'),
+	'csv': (csv_lines, 'text/csv; charset=utf-8', 'csv'),
+}
+
+
+def export_sites(export_format, chunk_size=CHUNK_SIZE):
+	"""
+	Lazily renders the whole heritage_site dataset, with categories and jurisdictions, in
+	one of FORMATS. Nothing is queried until the first line is requested.
+	:return: iterator of str
+	:raises KeyError: for an unknown format
+	"""
+	lines, _, _ = FORMATS[export_format]
+	return lines(iter_site_rows(chunk_size))
@@ -0,0 +1,90 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Model
+
+from .models import CountryArea, HeritageSiteCategory, Region
+from .refdata import NAMESPACE as REFDATA, get_reference_data
+from .versions import SITES, get_version
+
+
+KEY_PREFIX = 'heritagesites:facets:'
+TIMEOUT = 60 * 60
+
+
+def filter_signature(filterset):
+	"""
+	Returns a stable hash of the filter state: the non-empty cleaned values of a bound
+	filterset (model instances reduced to their primary keys), sorted by name. These are the
+	values filterset.qs applies; fields that fail validation are left out of both.
+	:return: string
+	"""
+	state = {}
+	if filterset.is_bound:
+		filterset.form.is_valid()
+		for name, value in filterset.form.cleaned_data.items():
+			if value in (None, ''):
+				continue
+			if isinstance(value, Model):
+				value = value.pk
+			state[name] = value
+	payload = json.dumps(sorted(state.items()), default=str)
+	return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def count_facets(queryset):
+	"""
+	Counts the sites of a (filtered) HeritageSite QuerySet per heritage site category, per
+	region and per year inscribed in a single query: one row per site and jurisdiction is
+	read and regions are resolved through the reference data cache.
+	:return: dict of facet name -> list of {'id', 'name', 'count'} (categories, regions) or
+		{'value', 'count'} (years)
+	"""
+	rows = queryset.prefetch_related(None).order_by().values_list(
+		'heritage_site_id',
+		'heritage_site_category_id',
+		'date_inscribed',
+		'heritagesitejurisdiction__country_area_id')
+
+	refdata = get_reference_data()
+	categories = {}
+	regions = {}
+	years = {}
+	for site_id, category_id, year, country_area_id in rows:
+		categories.setdefault(category_id, set()).add(site_id)
+		if year is not None:
+			years.setdefault(year, set()).add(site_id)
+		country = refdata.get(CountryArea, country_area_id)
+		if country is not None and country.location.region_id is not None:
+			regions.setdefault(country.location.region_id, set()).add(site_id)
+
+	return {
+		'heritage_site_category': [
+			{'id': category.pk, 'name': category.category_name, 'count': len(categories[category.pk])}
+			for category in refdata.all(HeritageSiteCategory) if category.pk in categories
+		],
+		'region': [
+			{'id': region.pk, 'name': region.region_name, 'count': len(regions[region.pk])}
+			for region in refdata.all(Region) if region.pk in regions
+		],
+		'date_inscribed': [
+			{'value': year, 'count': len(years[year])} for year in sorted(years)
+		],
+	}
+
+
+def get_facets(filterset):
+	"""
+	Returns the facet counts of a HeritageSiteFilter's result, cached per normalized filter
+	signature. The key carries the site and reference data versions, so any write starts
+	a new generation of entries.
+	:return: dict (see count_facets)
+	"""
+	key = '{0}{1}:{2}:{3}'.format(
+		KEY_PREFIX, get_version(SITES), get_version(REFDATA), filter_signature(filterset))
+	facets = cache.get(key)
+	if facets is None:
+		facets = count_facets(filterset.qs)
+		cache.set(key, facets, TIMEOUT)
+	return facets
@@ -1,9 +1,27 @@
 import django_filters
+from django.db.models import Case, IntegerField, When
+from heritagesites.choices import ReferenceChoiceField
+from heritagesites.hierarchy import get_location_tree
 from heritagesites.models import CountryArea, HeritageSite, HeritageSiteCategory, \
-	IntermediateRegion, SubRegion, Region
+	HeritageSiteJurisdiction, IntermediateRegion, SubRegion, Region
+from heritagesites.search import search
+
+
+class ReferenceChoiceFilter(django_filters.ModelChoiceFilter):
+	"""
+	ModelChoiceFilter whose choices and values come from the reference data cache (see
+	heritagesites.choices); the queryset only declares the model and option order.
+	"""
+	field_class = ReferenceChoiceField
 
 
 class HeritageSiteFilter(django_filters.FilterSet):
+	q = django_filters.CharFilter(
+		field_name='q',
+		method='filter_search',
+		label='Search'
+	)
+
 	site_name = django_filters.CharFilter(
 		field_name='site_name',
 		label='Heritage Site Name',
@@ -16,36 +34,40 @@ class HeritageSiteFilter(django_filters.FilterSet):
 		lookup_expr='icontains'
 	)
 
-	heritage_site_category = django_filters.ModelChoiceFilter(
+	heritage_site_category = ReferenceChoiceFilter(
 		field_name='heritage_site_category',
 		label='Heritage Site Category',
 		queryset=HeritageSiteCategory.objects.all().order_by('category_name'),
 		lookup_expr='exact'
 	)
 
-	region = django_filters.ModelChoiceFilter(
-		field_name='country_area__location__region__region_name',
+	region = ReferenceChoiceFilter(
+		field_name='region',
+		method='filter_location',
 		label='Region',
 		queryset=Region.objects.all().order_by('region_name'),
 		lookup_expr='exact'
 	)
 
-	sub_region = django_filters.ModelChoiceFilter(
-		field_name='country_area__location__sub_region__sub_region_name',
+	sub_region = ReferenceChoiceFilter(
+		field_name='sub_region',
+		method='filter_location',
 		label='Sub Region',
 		queryset=SubRegion.objects.all().order_by('sub_region_name'),
 		lookup_expr='exact'
 	)
 
-	intermediate_region = django_filters.ModelChoiceFilter(
-		field_name='country_area__location__intermediate_region__intermediate_region_name',
+	intermediate_region = ReferenceChoiceFilter(
+		field_name='intermediate_region',
+		method='filter_location',
 		label='Intermediate Region',
 		queryset=IntermediateRegion.objects.all().order_by('intermediate_region_name'),
 		lookup_expr='exact'
 	)
 
-	country_area = django_filters.ModelChoiceFilter(
+	country_area = ReferenceChoiceFilter(
 		field_name='country_area',
+		method='filter_location',
 		label='Country/Area',
 		queryset=CountryArea.objects.all().order_by('country_area_name'),
 		lookup_expr='exact'
@@ -58,6 +80,44 @@ class HeritageSiteFilter(django_filters.FilterSet):
 		lookup_expr='exact'
 	)
 
+	def filter_search(self, queryset, name, value):
+		"""
+		Keeps the sites matching every search term (site name, description, justification)
+		according to the in-process search index and orders them by relevance.
+		"""
+		if not value:
+			return queryset
+		ranking = [site_id for site_id, score in search(value)]
+		if not ranking:
+			return queryset.none()
+
+		relevance = Case(
+			*[When(heritage_site_id=site_id, then=rank) for rank, site_id in enumerate(ranking)],
+			output_field=IntegerField()
+		)
+		return queryset.filter(heritage_site_id__in=ranking).order_by(relevance)
+
+	def filter_location(self, queryset, name, value):
+		"""
+		Expands the selected region/sub-region/intermediate region/country area into the
+		country_area_ids below it (precomputed in the location tree) and keeps the sites with
+		at least one jurisdiction among them. The test is a semi-join
+		(heritage_site_id IN (SELECT ... FROM heritage_site_jurisdiction)) rather than a join,
+		so transboundary sites are returned once and combining several location filters never
+		multiplies rows (no DISTINCT needed).
+		"""
+		if not value:
+			return queryset
+		country_area_ids = get_location_tree().country_area_ids(name, value.pk)
+		if not country_area_ids:
+			return queryset.none()
+
+		site_ids = HeritageSiteJurisdiction.objects \
+			.filter(country_area_id__in=country_area_ids) \
+			.order_by() \
+			.values('heritage_site_id')
+		return queryset.filter(heritage_site_id__in=site_ids)
+
 	class Meta:
 		model = HeritageSite
 		# form = SearchForm
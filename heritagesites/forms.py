@@ -1,16 +1,49 @@
 from django import forms
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit
-from .models import HeritageSite
+from .choices import ReferenceChoiceField, ReferenceMultipleChoiceField
+from .models import CountryArea, HeritageSite
 
 
 class HeritageSiteForm(forms.ModelForm):
 	class Meta:
 		model = HeritageSite
 		fields = '__all__'
+		# Choices are served from the reference data cache instead of querying
+		# heritage_site_category and country_area on every render.
+		field_classes = {
+			'heritage_site_category': ReferenceChoiceField,
+			'country_area': ReferenceMultipleChoiceField,
+		}
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 		self.helper = FormHelper()
 		self.helper.form_method = 'post'
 		self.helper.add_input(Submit('submit', 'submit'))
+
+
+class HeritageSiteAdminForm(forms.ModelForm):
+	"""
+	Admin form for HeritageSite. The admin cannot edit country_area directly (it goes through
+	HeritageSiteJurisdiction), so the countries/areas are offered as a separate field that
+	HeritageSiteAdmin.save_related syncs.
+	"""
+	jurisdictions = ReferenceMultipleChoiceField(
+		queryset=CountryArea.objects.all(),
+		required=False,
+		label='Countries/Areas'
+	)
+
+	class Meta:
+		model = HeritageSite
+		fields = '__all__'
+		field_classes = {
+			'heritage_site_category': ReferenceChoiceField,
+		}
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		if self.instance.pk is not None:
+			self.fields['jurisdictions'].initial = list(
+				self.instance.heritagesitejurisdiction_set.values_list('country_area_id', flat=True))
@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import CountryArea, HeritageSiteJurisdiction, IntermediateRegion, Location, \
+	Region, SiteGeography, SubRegion
+from .signals import sites_changed
+
+
+def build_rows(jurisdictions):
+	"""
+	Converts heritage_site_jurisdiction rows into unsaved SiteGeography rows by walking the
+	country_area -> location -> region/sub_region/intermediate_region chain once.
+	Duplicate (site, country/area) pairs are skipped.
+	:param jurisdictions: HeritageSiteJurisdiction QuerySet
+	:return: list of SiteGeography
+	"""
+	jurisdictions = jurisdictions.select_related(
+		'country_area__location__region',
+		'country_area__location__sub_region',
+		'country_area__location__intermediate_region'
+	).order_by('heritage_site_id', 'country_area_id')
+
+	rows = []
+	seen = set()
+	for jurisdiction in jurisdictions:
+		key = (jurisdiction.heritage_site_id, jurisdiction.country_area_id)
+		if key in seen:
+			continue
+		seen.add(key)
+
+		country = jurisdiction.country_area
+		location = country.location
+		rows.append(SiteGeography(
+			heritage_site_id=jurisdiction.heritage_site_id,
+			country_area_id=country.country_area_id,
+			region_id=location.region_id,
+			sub_region_id=location.sub_region_id,
+			intermediate_region_id=location.intermediate_region_id,
+			country_area_name=country.country_area_name,
+			iso_alpha3_code=country.iso_alpha3_code,
+			region_name=location.region.region_name if location.region else None,
+			sub_region_name=location.sub_region.sub_region_name if location.sub_region else None,
+			intermediate_region_name=location.intermediate_region.intermediate_region_name
+				if location.intermediate_region else None
+		))
+	return rows
+
+
+def refresh_site_geography(site_ids):
+	"""
+	Replaces the site_geography rows of the given Heritage Sites with rows rebuilt from
+	heritage_site_jurisdiction. Sites that no longer exist simply lose their rows.
+	:param site_ids: iterable of heritage_site_id values
+	"""
+	site_ids = list(set(site_ids))
+	if not site_ids:
+		return
+
+	with transaction.atomic():
+		SiteGeography.objects.filter(heritage_site_id__in=site_ids).delete()
+		SiteGeography.objects.bulk_create(build_rows(
+			HeritageSiteJurisdiction.objects.filter(heritage_site_id__in=site_ids)))
+
+
+def rebuild_site_geography(batch_size=500):
+	"""
+	Truncates and repopulates the whole site_geography table.
+	:return: number of rows written
+	"""
+	with transaction.atomic():
+		SiteGeography.objects.all().delete()
+		rows = build_rows(HeritageSiteJurisdiction.objects.all())
+		SiteGeography.objects.bulk_create(rows, batch_size=batch_size)
+	return len(rows)
+
+
+def _refresh_jurisdictions(jurisdictions):
+	refresh_site_geography(jurisdictions.values_list('heritage_site_id', flat=True).distinct())
+
+
+@receiver(sites_changed)
+def sites_changed_handler(sender, site_ids, deleted=False, **kwargs):
+	if deleted:
+		SiteGeography.objects.filter(heritage_site_id__in=site_ids).delete()
+	else:
+		refresh_site_geography(site_ids)
+
+
+# Renaming a country/area or region, or moving a country/area to another location, changes
+# the pre-joined names of every site located there.
+
+@receiver(post_save, sender=CountryArea)
+def country_area_saved_handler(sender, instance, created, **kwargs):
+	if not created:
+		_refresh_jurisdictions(HeritageSiteJurisdiction.objects.filter(country_area=instance))
+
+
+@receiver(post_save, sender=Location)
+def location_saved_handler(sender, instance, created, **kwargs):
+	if not created:
+		_refresh_jurisdictions(
+			HeritageSiteJurisdiction.objects.filter(country_area__location=instance))
+
+
+@receiver(post_save, sender=Region)
+def region_saved_handler(sender, instance, created, **kwargs):
+	if not created:
+		_refresh_jurisdictions(
+			HeritageSiteJurisdiction.objects.filter(country_area__location__region=instance))
+
+
+@receiver(post_save, sender=SubRegion)
+def sub_region_saved_handler(sender, instance, created, **kwargs):
+	if not created:
+		_refresh_jurisdictions(
+			HeritageSiteJurisdiction.objects.filter(country_area__location__sub_region=instance))
+
+
+@receiver(post_save, sender=IntermediateRegion)
+def intermediate_region_saved_handler(sender, instance, created, **kwargs):
+	if not created:
+		_refresh_jurisdictions(HeritageSiteJurisdiction.objects.filter(
+			country_area__location__intermediate_region=instance))
@@ -0,0 +1,98 @@
+from .models import CountryArea, IntermediateRegion, Planet, Region, SubRegion
+from .refdata import NAMESPACE, get_reference_data
+from .versions import VersionedSnapshot
+
+
+# Levels of the UNSD location hierarchy, top to bottom, with the name field of each.
+LEVELS = (
+	('planet', Planet, 'planet_name'),
+	('region', Region, 'region_name'),
+	('sub_region', SubRegion, 'sub_region_name'),
+	('intermediate_region', IntermediateRegion, 'intermediate_region_name'),
+	('country_area', CountryArea, 'country_area_name'),
+)
+
+
+class LocationTree:
+	"""
+	The UNSD location hierarchy (planet -> region -> sub-region -> intermediate region ->
+	country/area) built from the reference data cache. Every node's set of descendant
+	country_area_ids is precomputed, so expanding a node is a single dict lookup. Countries/areas
+	whose location skips a level (e.g. no intermediate region) hang off their nearest ancestor.
+	"""
+
+	def __init__(self, refdata):
+		self._country_area_ids = {}
+		nodes = {}
+
+		for level, model, name_field in LEVELS:
+			for instance in refdata.all(model):
+				node = {
+					'level': level,
+					'id': instance.pk,
+					'name': getattr(instance, name_field),
+				}
+				if level == 'country_area':
+					node['iso_alpha3_code'] = instance.iso_alpha3_code
+				else:
+					node['children'] = []
+				nodes[(level, instance.pk)] = node
+				self._country_area_ids[(level, instance.pk)] = set()
+
+		for region in refdata.all(Region):
+			self._attach(nodes, ('region', region.pk), [('planet', region.planet_id)])
+		for sub_region in refdata.all(SubRegion):
+			self._attach(nodes, ('sub_region', sub_region.pk), [('region', sub_region.region_id)])
+		for intermediate_region in refdata.all(IntermediateRegion):
+			self._attach(
+				nodes,
+				('intermediate_region', intermediate_region.pk),
+				[('sub_region', intermediate_region.sub_region_id)])
+
+		for country in refdata.all(CountryArea):
+			location = country.location
+			ancestors = [
+				('intermediate_region', location.intermediate_region_id),
+				('sub_region', location.sub_region_id),
+				('region', location.region_id),
+				('planet', location.planet_id),
+			]
+			ancestors = [key for key in ancestors if key[1] is not None]
+			self._attach(nodes, ('country_area', country.pk), ancestors)
+
+			self._country_area_ids[('country_area', country.pk)].add(country.pk)
+			for key in ancestors:
+				self._country_area_ids[key].add(country.pk)
+
+		self._country_area_ids = {
+			key: frozenset(ids) for key, ids in self._country_area_ids.items()
+		}
+		self.roots = [nodes[('planet', planet.pk)] for planet in refdata.all(Planet)]
+
+	@staticmethod
+	def _attach(nodes, key, ancestors):
+		# Attach to the nearest existing ancestor; orphans are left out of the tree.
+		for ancestor in ancestors:
+			parent = nodes.get(ancestor)
+			if parent is not None:
+				parent['children'].append(nodes[key])
+				return
+
+	def country_area_ids(self, level, pk):
+		"""
+		Returns the ids of every country/area at or below a node of the hierarchy.
+		:param level: 'planet', 'region', 'sub_region', 'intermediate_region' or 'country_area'
+		:return: frozenset
+		"""
+		return self._country_area_ids.get((level, pk), frozenset())
+
+
+_snapshot = VersionedSnapshot(NAMESPACE, lambda: LocationTree(get_reference_data()))
+
+
+def get_location_tree():
+	"""
+	Returns this worker's LocationTree; it is rebuilt together with the reference data.
+	:return: LocationTree
+	"""
+	return _snapshot.get()
@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models import Q
+
+from .models import HeritageSiteJurisdiction
+
+
+def _country_area_id(country):
+	return getattr(country, 'country_area_id', country)
+
+
+def sync_jurisdictions(jurisdictions):
+	"""
+	Makes heritage_site_jurisdiction hold exactly the given countries/areas for each given
+	site. The current rows are read with one query, the difference is computed with sets and
+	applied with one bulk INSERT and one DELETE ... IN, all in one transaction. Sites not in
+	`jurisdictions` are left alone. Callers still send sites_changed for the sites they saved.
+	:param jurisdictions: dict of heritage_site_id -> iterable of CountryArea instances or
+		country_area_ids
+	:return: (number of rows added, number of rows removed)
+	"""
+	if not jurisdictions:
+		return 0, 0
+	wanted = set(
+		(site_id, _country_area_id(country))
+		for site_id, countries in jurisdictions.items()
+		for country in countries
+	)
+
+	with transaction.atomic():
+		existing = set(
+			HeritageSiteJurisdiction.objects
+				.filter(heritage_site_id__in=list(jurisdictions))
+				.order_by()
+				.values_list('heritage_site_id', 'country_area_id')
+		)
+
+		added = sorted(wanted - existing)
+		HeritageSiteJurisdiction.objects.bulk_create([
+			HeritageSiteJurisdiction(heritage_site_id=site_id, country_area_id=country_area_id)
+			for site_id, country_area_id in added
+		])
+
+		removed = {}
+		for site_id, country_area_id in existing - wanted:
+			removed.setdefault(site_id, []).append(country_area_id)
+		condition = Q()
+		for site_id, country_area_ids in removed.items():
+			condition |= Q(heritage_site_id=site_id, country_area_id__in=country_area_ids)
+		if removed:
+			HeritageSiteJurisdiction.objects.filter(condition).delete()
+
+	return len(added), sum(len(country_area_ids) for country_area_ids in removed.values())
+
+
+def set_jurisdictions(site, countries):
+	"""
+	sync_jurisdictions() for a single site.
+	:param site: HeritageSite or heritage_site_id
+	:return: (number of rows added, number of rows removed)
+	"""
+	site_id = getattr(site, 'heritage_site_id', site)
+	return sync_jurisdictions({site_id: countries})
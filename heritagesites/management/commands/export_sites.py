@@ -0,0 +1,63 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from heritagesites.export import CHUNK_SIZE, FORMATS, export_sites
+
+
+class Command(BaseCommand):
+	help = 'Writes every heritage site, with its category and jurisdictions, as NDJSON or CSV.'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--format',
+			choices=sorted(FORMATS),
+			default='ndjson',
+			help='Output format (default ndjson).')
+		parser.add_argument(
+			'-o', '--output',
+			help='File to write (default: standard output).')
+		parser.add_argument(
+			'--gzip',
+			action='store_true',
+			help='Compress the output with gzip.')
+		parser.add_argument(
+			'--chunk-size',
+			type=int,
+			default=CHUNK_SIZE,
+			help='Number of sites read per query (default {0}).'.format(CHUNK_SIZE))
+
+	def handle(self, *args, **options):
+		if options['output']:
+			stream = open(options['output'], 'wb')
+		elif options['gzip']:
+			# Compressed output is binary: write to the byte stream under self.stdout.
+			stream = getattr(self.stdout._out, 'buffer', None)
+			if stream is None:
+				raise CommandError('--gzip needs --output when standard output is not binary.')
+		else:
+			stream = None
+		if options['gzip']:
+			output = gzip.GzipFile(fileobj=stream, mode='wb')
+		else:
+			output = stream
+
+		count = 0
+		try:
+			for line in export_sites(options['format'], chunk_size=options['chunk_size']):
+				if output is None:
+					self.stdout.write(line, ending='')
+				else:
+					output.write(line.encode('utf-8'))
+				count += 1
+		finally:
+			if output is not stream:
+				output.close()
+			if options['output']:
+				stream.close()
+			elif stream is not None:
+				stream.flush()
+
+		if options['output']:
+			self.stdout.write(self.style.SUCCESS('Exported {0} lines to {1}'.format(
+				count, options['output'])))
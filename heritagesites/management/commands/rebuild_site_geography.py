@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from heritagesites.geography import rebuild_site_geography
+
+
+class Command(BaseCommand):
+	help = 'Rebuilds the denormalized site_geography table from heritage_site_jurisdiction.'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--batch-size',
+			type=int,
+			default=500,
+			help='Number of rows per INSERT statement (default 500).')
+
+	def handle(self, *args, **options):
+		count = rebuild_site_geography(batch_size=options['batch_size'])
+		self.stdout.write(self.style.SUCCESS('site_geography rebuilt: {0} rows'.format(count)))
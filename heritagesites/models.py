@@ -1,6 +1,5 @@
 from django.db import models
 from django.urls import reverse
-from django.db.models import F
 
 # Create your models here.
 
@@ -110,6 +109,37 @@ class DevStatus(models.Model):
     def __str__(self):
         return self.dev_status_name
 
+class HeritageSiteQuerySet(models.QuerySet):
+
+    def with_geography(self):
+        """
+        Prefetches the denormalized site_geography rows (country/area, region, sub-region and
+        intermediate region names) of every Heritage Site in the QuerySet in one additional
+        query. country_area_names, region_names, sub_region_names and
+        intermediate_region_names then read from the prefetched rows instead of issuing a
+        query per site and per property.
+        :return: QuerySet
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'site_geography',
+                queryset=SiteGeography.objects.order_by('country_area_name')))
+
+    def with_jurisdictions(self):
+        """
+        Prefetches the heritage_site_jurisdiction rows (and their countries/areas) of every
+        Heritage Site in the QuerySet in one additional query, ordered as the default
+        HeritageSiteJurisdiction ordering would return them for a single site.
+        :return: QuerySet
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'heritagesitejurisdiction_set',
+                queryset=HeritageSiteJurisdiction.objects
+                    .select_related('country_area')
+                    .order_by('country_area__country_area_name')))
+
+
 # This part has been manually created
 class HeritageSite(models.Model):
     heritage_site_id = models.AutoField(primary_key=True)
@@ -123,6 +153,11 @@ class HeritageSite(models.Model):
     heritage_site_category = models.ForeignKey('HeritageSiteCategory', on_delete=models.PROTECT)
     transboundary = models.IntegerField()
     country_area = models.ManyToManyField(CountryArea, through='HeritageSiteJurisdiction')
+    # Set on save() and touched on every sites_changed (which also covers bulk updates and
+    # jurisdiction-only changes); drives ETag/Last-Modified (see heritagesites.conditional).
+    updated_at = models.DateTimeField(auto_now=True, blank=True, null=True)
+
+    objects = HeritageSiteQuerySet.as_manager()
 
     class Meta:
         managed = False
@@ -137,24 +172,52 @@ class HeritageSite(models.Model):
     def __str__(self):
         return self.site_name
 
+    @property
+    def geography(self):
+        """
+        Returns the site_geography rows (one per country/area, with region, sub-region and
+        intermediate region names pre-joined) associated with a Heritage Site, ordered by
+        country/area name. Rows prefetched by HeritageSite.objects.with_geography() are used
+        when available; otherwise a single query is issued and memoized on the instance so the
+        *_names properties below share it.
+        :return: list of SiteGeography
+        """
+        if not hasattr(self, '_geography'):
+            prefetched = getattr(self, '_prefetched_objects_cache', {})
+            if 'site_geography' in prefetched:
+                self._geography = list(self.site_geography.all())
+            else:
+                self._geography = list(self.site_geography.order_by('country_area_name'))
+        return self._geography
+
+    def _location_names(self, name_attr):
+        """
+        Collects the distinct, non-null names found in one site_geography name column.
+        :return: string
+        """
+        names = []
+        for row in self.geography:
+            name = getattr(row, name_attr)
+            if name is None:
+                continue
+            if name not in names:
+                names.append(name)
+        return ', '.join(names)
+
     @property
     def country_area_names(self):
         """
         Returns a list of UNSD countries/areas (names only) associated with a Heritage Site.
         Note that not all Heritage Sites are associated with a country/area (e.g., Old City
-        Walls of Jerusalem). In such cases the Queryset will return as <QuerySet [None]> and the
-        list will need to be checked for None or a TypeError (sequence item 0: expected str
-        instance, NoneType found) runtime error will be thrown.
+        Walls of Jerusalem). In such cases the list is empty and an empty string is returned.
         :return: string
         """
-        countries = self.country_area.select_related('location').order_by('country_area_name')
-
         names = []
-        for country in countries:
-            name = country.country_area_name
+        for row in self.geography:
+            name = row.country_area_name
             if name is None:
                 continue
-            iso_code = country.iso_alpha3_code
+            iso_code = row.iso_alpha3_code
 
             name_and_code = ''.join([name, ' (', iso_code, ')'])
             if name_and_code not in names:
@@ -166,73 +229,31 @@ class HeritageSite(models.Model):
     def region_names(self):
         """
         Returns a list of UNSD regions (names only) associated with a Heritage Site.
-        Note that not all Heritage Sites are associated with a region. In such cases the
-        Queryset will return as <QuerySet [None]> and the list will need to be checked for
-        None or a TypeError (sequence item 0: expected str instance, NoneType found) runtime
-        error will be thrown.
+        Note that not all Heritage Sites are associated with a region. In such cases an
+        empty string is returned.
         :return: string
         """
-
-        # Add code that uses self to retrieve a QuerySet composed of regions, then loops over it
-        # building a list of region names, before returning a comma-delimited string of names.
-        regions = self.country_area.select_related('location').values(name=F('location__region__region_name'))
-        names = []
-        for region in regions:
-            name = region['name'] # using .values() turns it to dictionary
-            if name is None:
-                continue
-            if name not in names:
-                names.append(name)
-        return ', '.join(names)
+        return self._location_names('region_name')
 
     @property
     def sub_region_names(self):
         """
-		Returns a list of UNSD subregions (names only) associated with a Heritage Site.
-		Note that not all Heritage Sites are associated with a subregion. In such cases the
-		Queryset will return as <QuerySet [None]> and the list will need to be checked for
-		None or a TypeError (sequence item 0: expected str instance, NoneType found) runtime
-		error will be thrown.
-		:return: string
-		"""
-
-		# Add code that uses self to retrieve a QuerySet, then loops over it building a list of
-		# sub region names, before returning a comma-delimited string of names using the string
-		# join method.
-        sub_regions = self.country_area.select_related('location').values(name=F('location__sub_region__sub_region_name'))
-        names = []
-        for sub_region in sub_regions:
-            name = sub_region['name'] # using .values() turns it to dictionary
-            if name is None:
-                continue
-            if name not in names:
-                names.append(name)
-        return ', '.join(names)
+        Returns a list of UNSD subregions (names only) associated with a Heritage Site.
+        Note that not all Heritage Sites are associated with a subregion. In such cases an
+        empty string is returned.
+        :return: string
+        """
+        return self._location_names('sub_region_name')
 
     @property
     def intermediate_region_names(self):
         """
-        Returns a list of UNSD intermediate regions (names only) associated with a Heritage Site.
-        Note that not all Heritage Sites are associated with an intermediate region. In such
-        cases the Queryset will return as <QuerySet [None]> and the list will need to be
-        checked for None or a TypeError (sequence item 0: expected str instance, NoneType found)
-        runtime error will be thrown.
+        Returns a list of UNSD intermediate regions (names only) associated with a Heritage
+        Site. Note that not all Heritage Sites are associated with an intermediate region.
+        In such cases an empty string is returned.
         :return: string
         """
-
-		# Add code that uses self to retrieve a QuerySet, then loops over it building a list of
-		# intermediate region names, before returning a comma-delimited string of names using the
-		# string join method.
-        intermediate_regions = self.country_area.select_related('location').values(name=F('location__intermediate_region__intermediate_region_name'))
-
-        names=[]
-        for intermediate_region in intermediate_regions:
-            name = intermediate_region['name'] # using .values() turns it to dictionary
-            if name is None:
-                continue
-            if name not in names:
-                names.append(name)
-        return ', '.join(names)
+        return self._location_names('intermediate_region_name')
 
 class HeritageSiteJurisdiction(models.Model):
     heritage_site_jurisdiction_id = models.AutoField(primary_key=True)
@@ -246,6 +267,70 @@ class HeritageSiteJurisdiction(models.Model):
         verbose_name = 'UNESCO Heritage Site Jurisdiction'
         verbose_name_plural = 'UNESCO Heritage Site Jurisdictions'
 
+class SiteGeography(models.Model):
+    """
+    New model: unesco_heritage_sites.site_geography
+
+    Denormalized copy of heritage_site_jurisdiction joined to country_area, location and the
+    UNSD region tables: one row per site and country/area with the hierarchy ids and names
+    pre-joined. Kept current by heritagesites.geography whenever a site, its jurisdictions or
+    the UNSD hierarchy is written; rebuild with `manage.py rebuild_site_geography`.
+    """
+    site_geography_id = models.AutoField(primary_key=True)
+    heritage_site = models.ForeignKey(
+        HeritageSite, on_delete=models.CASCADE, related_name='site_geography')
+    country_area = models.ForeignKey(
+        CountryArea, on_delete=models.CASCADE, related_name='+')
+    region = models.ForeignKey(
+        'Region', on_delete=models.PROTECT, blank=True, null=True, related_name='+')
+    sub_region = models.ForeignKey(
+        'SubRegion', on_delete=models.PROTECT, blank=True, null=True, related_name='+')
+    intermediate_region = models.ForeignKey(
+        'IntermediateRegion', on_delete=models.PROTECT, blank=True, null=True, related_name='+')
+    country_area_name = models.CharField(max_length=100)
+    iso_alpha3_code = models.CharField(max_length=3)
+    region_name = models.CharField(max_length=100, blank=True, null=True)
+    sub_region_name = models.CharField(max_length=100, blank=True, null=True)
+    intermediate_region_name = models.CharField(max_length=100, blank=True, null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'site_geography'
+        ordering = ['country_area_name']
+        unique_together = (('heritage_site', 'country_area'),)
+        verbose_name = 'Heritage Site Geography'
+        verbose_name_plural = 'Heritage Site Geographies'
+
+class SiteChange(models.Model):
+    """
+    New model: unesco_heritage_sites.site_change
+
+    Append-only log of writes to Heritage Sites (their jurisdictions included) and Heritage
+    Site Categories, one row per changed object, written in the same transaction as the
+    change by heritagesites.changes. change_id orders the log and is the cursor of the change
+    feed (api/changes/). No foreign keys: rows outlive the objects they describe.
+    """
+    SITE = 'site'
+    CATEGORY = 'category'
+    OBJECT_TYPES = ((SITE, 'Heritage Site'), (CATEGORY, 'Heritage Site Category'))
+
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTIONS = ((UPDATED, 'Created or updated'), (DELETED, 'Deleted'))
+
+    change_id = models.BigAutoField(primary_key=True)
+    object_type = models.CharField(max_length=10, choices=OBJECT_TYPES)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'site_change'
+        ordering = ['change_id']
+        verbose_name = 'Heritage Site Change'
+        verbose_name_plural = 'Heritage Site Changes'
+
 # This part has been manually created
 class HeritageSiteCategory(models.Model):
     category_id = models.AutoField(primary_key=True)
@@ -0,0 +1,189 @@
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+from .refdata import NAMESPACE as REFDATA
+from .versions import SITES, get_versions
+
+
+# HeritageSite keyset: site_name is UNIQUE in heritage_site, and InnoDB secondary indexes
+# carry the primary key, so the site_name index alone serves both the ordering and the
+# range seek below. heritage_site_id keeps the order total should site_name ever repeat.
+SITE_KEYSET = ('site_name', 'heritage_site_id')
+
+
+def encode_cursor(values, reverse=False):
+	"""
+	Encodes a keyset position (the key values of a row) and direction as an opaque, URL-safe
+	token.
+	:return: string
+	"""
+	payload = json.dumps(['p' if reverse else 'n'] + list(values), separators=(',', ':'))
+	return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, keyset):
+	"""
+	Decodes a token made by encode_cursor().
+	:return: (values, reverse)
+	:raises ValueError: if the token is malformed
+	"""
+	try:
+		payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+		data = json.loads(payload.decode('utf-8'))
+	except (TypeError, ValueError, UnicodeDecodeError):
+		raise ValueError('Invalid cursor.')
+	if not isinstance(data, list) or len(data) != len(keyset) + 1 or data[0] not in ('n', 'p'):
+		raise ValueError('Invalid cursor.')
+	return data[1:], data[0] == 'p'
+
+
+def _after(keyset, values, reverse):
+	"""
+	Q object selecting the rows strictly after (or, reversed, before) a position in keyset
+	order. The leading column is repeated as a plain range (site_name >= x) so the database
+	can seek the index instead of evaluating the OR over every row.
+	"""
+	op = 'lt' if reverse else 'gt'
+	condition = Q()
+	for position in range(len(keyset) - 1, -1, -1):
+		step = Q(**{'{}__{}'.format(keyset[position], op): values[position]})
+		if position < len(keyset) - 1:
+			step |= Q(**{keyset[position]: values[position]}) & condition
+		condition = step
+	return Q(**{'{}__{}e'.format(keyset[0], op): values[0]}) & condition
+
+
+class KeysetPage:
+	"""
+	One page of a keyset-paginated QuerySet. Iterating it yields the page's objects;
+	next_cursor and previous_cursor are None at the ends of the result.
+	"""
+
+	def __init__(self, object_list, next_cursor, previous_cursor):
+		self.object_list = object_list
+		self.next_cursor = next_cursor
+		self.previous_cursor = previous_cursor
+
+	@property
+	def has_next(self):
+		return self.next_cursor is not None
+
+	@property
+	def has_previous(self):
+		return self.previous_cursor is not None
+
+	def has_other_pages(self):
+		return self.has_next or self.has_previous
+
+	def __iter__(self):
+		return iter(self.object_list)
+
+	def __len__(self):
+		return len(self.object_list)
+
+
+def paginate_keyset(queryset, cursor, page_size, keyset=SITE_KEYSET):
+	"""
+	Returns the page of `queryset`, ordered by `keyset`, that follows (or precedes) the
+	position encoded in `cursor`; an empty cursor selects the first page. Each page is one
+	range query of page_size + 1 rows whatever its depth, with no COUNT(*) and no OFFSET.
+	The QuerySet may yield model instances or values() dicts.
+	:return: KeysetPage
+	:raises ValueError: if the cursor is malformed
+	"""
+	values, reverse = decode_cursor(cursor, keyset) if cursor else (None, False)
+
+	ordering = ['-' + field if reverse else field for field in keyset]
+	queryset = queryset.order_by(*ordering)
+	if values is not None:
+		queryset = queryset.filter(_after(keyset, values, reverse))
+
+	rows = list(queryset[:page_size + 1])
+	has_more = len(rows) > page_size
+	rows = rows[:page_size]
+	if reverse:
+		rows.reverse()
+
+	def position(row):
+		if isinstance(row, dict):
+			return [row[field] for field in keyset]
+		return [getattr(row, field) for field in keyset]
+
+	next_cursor = previous_cursor = None
+	if rows:
+		if has_more or reverse:
+			next_cursor = encode_cursor(position(rows[-1]))
+		if (has_more and reverse) or (values is not None and not reverse):
+			previous_cursor = encode_cursor(position(rows[0]), reverse=True)
+	elif values is not None:
+		# Past either end: offer the way back.
+		if reverse:
+			next_cursor = encode_cursor(values)
+		else:
+			previous_cursor = encode_cursor(values, reverse=True)
+	return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+class CachedCountPaginator(Paginator):
+	"""
+	Paginator that caches the COUNT(*) of QuerySets in the shared cache, keyed by a
+	normalized signature of the query (its SQL and parameters, without ordering or selected
+	columns) and by the site and reference data versions, so every page of a filtered list
+	after the first costs no count and any write invalidates the counts at once. Usable by
+	ListView (paginator_class) and by DRF pagination (django_paginator_class).
+
+	With estimate_above set, counting stops after that many rows: larger results report
+	estimate_above as their count (count_is_estimate is then True), which keeps the count
+	of a huge result cheap at the price of the pages beyond it.
+	"""
+	key_prefix = 'heritagesites:count:'
+	timeout = 60 * 30
+	namespaces = (SITES, REFDATA)
+	estimate_above = None
+
+	def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True,
+			estimate_above=None):
+		super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+		if estimate_above is not None:
+			self.estimate_above = estimate_above
+		self.count_is_estimate = False
+
+	def count_signature(self, queryset):
+		"""
+		:return: string identifying the rows of `queryset`, whatever their order and columns
+		"""
+		queryset = queryset.order_by()
+		if not queryset.query.distinct and queryset.query.group_by is None:
+			queryset = queryset.values('pk')
+		sql, params = queryset.query.sql_with_params()
+		signature = repr((queryset.db, sql, params, self.estimate_above))
+		return hashlib.md5(signature.encode('utf-8')).hexdigest()
+
+	@cached_property
+	def count(self):
+		if not isinstance(self.object_list, QuerySet):
+			return super().count
+
+		versions = get_versions(self.namespaces)
+		key = '{}{}:{}'.format(
+			self.key_prefix,
+			':'.join(str(versions[namespace]) for namespace in self.namespaces),
+			self.count_signature(self.object_list))
+		count = cache.get(key)
+		if count is None:
+			if self.estimate_above is None:
+				count = self.object_list.count()
+			else:
+				count = self.object_list.order_by()[:self.estimate_above + 1].count()
+			cache.set(key, count, self.timeout)
+
+		if self.estimate_above is not None and count > self.estimate_above:
+			self.count_is_estimate = True
+			count = self.estimate_above
+		return count
@@ -0,0 +1,105 @@
+from django.db.models.signals import post_delete, post_save
+
+from .models import CountryArea, DevStatus, HeritageSiteCategory, IntermediateRegion, \
+	Location, Planet, Region, SubRegion
+from .versions import VersionedSnapshot
+
+
+NAMESPACE = 'refdata'
+
+# Reference models and the field each one is looked up by name with (None: id only).
+MODELS = (
+	(Planet, 'planet_name'),
+	(Region, 'region_name'),
+	(SubRegion, 'sub_region_name'),
+	(IntermediateRegion, 'intermediate_region_name'),
+	(Location, None),
+	(DevStatus, 'dev_status_name'),
+	(HeritageSiteCategory, 'category_name'),
+	(CountryArea, 'country_area_name'),
+)
+
+
+class ReferenceData:
+	"""
+	Snapshot of the UNSD hierarchy (planet, region, sub-region, intermediate region,
+	location, country/area) and the development status and heritage site category lookup
+	tables. Every model is loaded with one query and foreign keys between them are wired to
+	the cached instances, so e.g. country.location.region never touches the database.
+	Instances are shared by all requests of a worker and must be treated as read-only.
+	"""
+
+	def __init__(self):
+		self._by_id = {}
+		self._by_name = {}
+		for model, name_field in MODELS:
+			instances = list(model.objects.all())
+			self._by_id[model] = {instance.pk: instance for instance in instances}
+			if name_field is not None:
+				self._by_name[model] = {
+					getattr(instance, name_field): instance for instance in instances
+				}
+
+		self._link(Region, 'planet', Planet)
+		self._link(SubRegion, 'region', Region)
+		self._link(IntermediateRegion, 'sub_region', SubRegion)
+		self._link(Location, 'planet', Planet)
+		self._link(Location, 'region', Region)
+		self._link(Location, 'sub_region', SubRegion)
+		self._link(Location, 'intermediate_region', IntermediateRegion)
+		self._link(CountryArea, 'location', Location)
+		self._link(CountryArea, 'dev_status', DevStatus)
+
+	def _link(self, model, field, target):
+		targets = self._by_id[target]
+		attname = model._meta.get_field(field).attname
+		for instance in self._by_id[model].values():
+			target_id = getattr(instance, attname)
+			if target_id is not None:
+				setattr(instance, field, targets[target_id])
+
+	def get(self, model, pk):
+		"""
+		:return: cached instance or None
+		"""
+		return self._by_id[model].get(pk)
+
+	def get_by_name(self, model, name):
+		"""
+		:return: cached instance or None
+		"""
+		return self._by_name[model].get(name)
+
+	def all(self, model):
+		"""
+		:return: list of cached instances in the model's default ordering
+		"""
+		return list(self._by_id[model].values())
+
+
+_snapshot = VersionedSnapshot(NAMESPACE, ReferenceData)
+
+
+def get_reference_data():
+	"""
+	Returns this worker's ReferenceData, reloading it first if another worker (or this one)
+	has written to a reference model since it was loaded.
+	:return: ReferenceData
+	"""
+	return _snapshot.get()
+
+
+def invalidate():
+	"""
+	Discards the ReferenceData of every worker.
+	"""
+	return _snapshot.invalidate()
+
+
+def reference_data_changed_handler(sender, **kwargs):
+	invalidate()
+
+
+for model, name_field in MODELS:
+	post_save.connect(reference_data_changed_handler, sender=model)
+	post_delete.connect(reference_data_changed_handler, sender=model)
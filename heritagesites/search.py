@@ -0,0 +1,190 @@
+import bisect
+import html
+import math
+import re
+import unicodedata
+
+from django.dispatch import receiver
+
+from .models import HeritageSite
+from .signals import sites_changed
+from .versions import VersionedSnapshot
+
+
+NAMESPACE = 'search'
+
+# Indexed fields and the weight of a term occurrence in each.
+FIELDS = (
+	('site_name', 5.0),
+	('description', 1.0),
+	('justification', 1.0),
+)
+
+STOP_WORDS = frozenset([
+	'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it', 'its',
+	'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'which', 'with',
+])
+
+TAG_RE = re.compile(r'<[^>]*>')
+WORD_RE = re.compile(r'\w+')
+
+# Maximum number of vocabulary terms a trailing query prefix expands to.
+PREFIX_EXPANSION = 50
+
+
+def tokenize(text):
+	"""
+	Splits text (site names, descriptions and justifications contain raw HTML) into
+	lower-case, accent-folded word tokens, dropping stop words and single characters.
+	:return: list of strings
+	"""
+	if not text:
+		return []
+	text = html.unescape(TAG_RE.sub(' ', text))
+	text = unicodedata.normalize('NFKD', text.lower())
+	text = ''.join(char for char in text if not unicodedata.combining(char))
+	return [
+		token for token in WORD_RE.findall(text)
+		if len(token) > 1 and token not in STOP_WORDS
+	]
+
+
+def term_weights(document):
+	"""
+	:param document: dict of field name -> text
+	:return: dict of token -> weight (sublinear term frequency times field weight)
+	"""
+	counts = {}
+	for field, weight in FIELDS:
+		for token in tokenize(document.get(field)):
+			counts.setdefault(token, {}).setdefault(field, 0)
+			counts[token][field] += 1
+
+	weights = {}
+	field_weights = dict(FIELDS)
+	for token, fields in counts.items():
+		weights[token] = sum(
+			(1 + math.log(count)) * field_weights[field] for field, count in fields.items())
+	return weights
+
+
+class SearchIndex:
+	"""
+	Inverted index over HeritageSite.site_name, description and justification. Ranking is
+	TF-IDF (sublinear term frequency, site_name weighted above the text fields); all query
+	terms must match and the last one also matches as a prefix so results follow the user
+	while typing. Instances are immutable: with_sites() returns an updated copy.
+	"""
+
+	def __init__(self, postings, documents):
+		# postings: token -> {heritage_site_id: weight}
+		# documents: heritage_site_id -> {token: weight}
+		self._postings = postings
+		self._documents = documents
+		self._vocabulary = sorted(postings)
+
+	@classmethod
+	def build(cls):
+		postings = {}
+		documents = {}
+		rows = HeritageSite.objects.order_by().values(
+			'heritage_site_id', *[field for field, weight in FIELDS])
+		for row in rows:
+			weights = term_weights(row)
+			documents[row['heritage_site_id']] = weights
+			for token, weight in weights.items():
+				postings.setdefault(token, {})[row['heritage_site_id']] = weight
+		return cls(postings, documents)
+
+	def with_sites(self, site_ids):
+		"""
+		Returns a copy of the index with the given sites re-read from the database (or dropped
+		if they no longer exist). Only the posting lists of affected tokens are copied.
+		"""
+		site_ids = set(site_ids)
+		rows = HeritageSite.objects.filter(heritage_site_id__in=site_ids).order_by().values(
+			'heritage_site_id', *[field for field, weight in FIELDS])
+		updated = {row['heritage_site_id']: term_weights(row) for row in rows}
+
+		postings = dict(self._postings)
+		documents = dict(self._documents)
+		copied = set()
+
+		def posting(token):
+			if token not in copied:
+				postings[token] = dict(postings.get(token, {}))
+				copied.add(token)
+			return postings[token]
+
+		for site_id in site_ids:
+			for token in documents.pop(site_id, {}):
+				posting(token).pop(site_id, None)
+				if not postings[token]:
+					del postings[token]
+					copied.discard(token)
+			if site_id in updated:
+				documents[site_id] = updated[site_id]
+				for token, weight in updated[site_id].items():
+					posting(token)[site_id] = weight
+
+		return SearchIndex(postings, documents)
+
+	def _expand(self, token):
+		start = bisect.bisect_left(self._vocabulary, token)
+		terms = []
+		for term in self._vocabulary[start:start + PREFIX_EXPANSION]:
+			if not term.startswith(token):
+				break
+			terms.append(term)
+		return terms
+
+	def search(self, query):
+		"""
+		:return: list of (heritage_site_id, score), best match first
+		"""
+		tokens = tokenize(query)
+		if not tokens:
+			return []
+
+		total = len(self._documents)
+		scores = None
+		for position, token in enumerate(tokens):
+			terms = [token] if token in self._postings else []
+			if position == len(tokens) - 1:
+				terms = self._expand(token)
+
+			matches = {}
+			for term in terms:
+				postings = self._postings[term]
+				idf = math.log(1 + total / len(postings))
+				for site_id, weight in postings.items():
+					matches[site_id] = matches.get(site_id, 0) + weight * idf
+
+			if scores is None:
+				scores = matches
+			else:
+				scores = {
+					site_id: score + matches[site_id]
+					for site_id, score in scores.items() if site_id in matches
+				}
+			if not scores:
+				return []
+
+		return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+_snapshot = VersionedSnapshot(NAMESPACE, SearchIndex.build)
+
+
+def search(query):
+	"""
+	Searches this worker's index, (re)building it if needed.
+	:return: list of (heritage_site_id, score), best match first
+	"""
+	return _snapshot.get().search(query)
+
+
+@receiver(sites_changed)
+def sites_changed_handler(sender, site_ids, deleted=False, **kwargs):
+	site_ids = list(site_ids)
+	_snapshot.update(lambda index: index.with_sites(site_ids))
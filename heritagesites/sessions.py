@@ -0,0 +1,35 @@
+from django.contrib.sessions.backends import cached_db
+
+from .auth import TIMEOUT
+
+
+class _ShortLivedCache:
+	"""
+	The session cache, with every entry kept at most TIMEOUT seconds.
+	"""
+
+	def __init__(self, cache):
+		self._cache = cache
+
+	def __getattr__(self, name):
+		return getattr(self._cache, name)
+
+	def __contains__(self, key):
+		return key in self._cache
+
+	def set(self, key, value, timeout):
+		self._cache.set(key, value, min(timeout, TIMEOUT))
+
+
+class SessionStore(cached_db.SessionStore):
+	"""
+	cached_db sessions whose cache entries expire after TIMEOUT seconds instead of with the
+	session (SESSION_COOKIE_AGE, two weeks by default), so a session deleted or changed in
+	the database directly (a cleared session table, another project sharing the database)
+	stops being served from the cache as quickly as a changed user (see heritagesites.auth).
+	Changes made through Django update the cache at once.
+	"""
+
+	def __init__(self, session_key=None):
+		super().__init__(session_key)
+		self._cache = _ShortLivedCache(self._cache)
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+
+# Sent by every write path (HTML views, API serializer/viewset and admin) once a Heritage Site
+# and its heritage_site_jurisdiction rows have been written, or after the site was deleted.
+# Receivers use it to keep data derived from heritage_site current.
+sites_changed = Signal(providing_args=['site_ids', 'deleted'])
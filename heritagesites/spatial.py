@@ -0,0 +1,188 @@
+import heapq
+import math
+
+from django.dispatch import receiver
+
+from .models import HeritageSite
+from .signals import sites_changed
+from .versions import VersionedSnapshot
+
+
+NAMESPACE = 'spatial'
+
+# Grid cell size in degrees. ~1,100 sites spread over the globe leave most 2 degree cells
+# empty or holding a handful of points.
+CELL_SIZE = 2.0
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+	"""
+	Great-circle distance between two points in kilometres.
+	"""
+	lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+	a = math.sin((lat2 - lat1) / 2) ** 2 \
+		+ math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+	return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+ROWS = int(math.ceil(180 / CELL_SIZE))
+COLUMNS = int(math.ceil(360 / CELL_SIZE))
+
+
+def _row(lat):
+	return min(max(int(math.floor((lat + 90) / CELL_SIZE)), 0), ROWS - 1)
+
+
+def _column(lon):
+	return min(max(int(math.floor((lon + 180) / CELL_SIZE)), 0), COLUMNS - 1)
+
+
+def _cell(lat, lon):
+	return _row(lat), _column(lon)
+
+
+class SpatialIndex:
+	"""
+	Uniform latitude/longitude grid over site coordinates. Bounding-box queries scan only the
+	cells overlapping the box; k-nearest-neighbour queries search rings of cells outwards from
+	the query point until the k-th best distance is closer than anything an unvisited ring could
+	hold. Sites without coordinates are not indexed. Instances are immutable: with_sites()
+	returns an updated copy.
+	"""
+
+	def __init__(self, points):
+		# points: heritage_site_id -> (latitude, longitude)
+		self._points = points
+		self._cells = {}
+		for site_id, (lat, lon) in points.items():
+			self._cells.setdefault(_cell(lat, lon), []).append((site_id, lat, lon))
+
+	@staticmethod
+	def _load(queryset):
+		points = {}
+		rows = queryset.filter(latitude__isnull=False, longitude__isnull=False) \
+			.order_by() \
+			.values_list('heritage_site_id', 'latitude', 'longitude')
+		for site_id, lat, lon in rows:
+			points[site_id] = (float(lat), float(lon))
+		return points
+
+	@classmethod
+	def build(cls):
+		return cls(cls._load(HeritageSite.objects.all()))
+
+	def with_sites(self, site_ids):
+		"""
+		Returns a copy of the index with the coordinates of the given sites re-read from the
+		database (sites deleted or without coordinates are dropped).
+		"""
+		site_ids = set(site_ids)
+		points = {
+			site_id: point for site_id, point in self._points.items() if site_id not in site_ids
+		}
+		points.update(self._load(HeritageSite.objects.filter(heritage_site_id__in=site_ids)))
+		return SpatialIndex(points)
+
+	def __len__(self):
+		return len(self._points)
+
+	def within(self, south, west, north, east):
+		"""
+		Returns the ids of the sites inside a bounding box. A box whose west edge is greater
+		than its east edge crosses the antimeridian.
+		:return: list of heritage_site_id
+		"""
+		if west <= east:
+			spans = [(west, east)]
+		else:
+			spans = [(west, 180.0), (-180.0, east)]
+
+		south, north = max(south, -90.0), min(north, 90.0)
+		if south > north:
+			return []
+
+		found = []
+		for span_west, span_east in spans:
+			for row in range(_row(south), _row(north) + 1):
+				for column in range(_column(span_west), _column(span_east) + 1):
+					for site_id, lat, lon in self._cells.get((row, column), ()):
+						if south <= lat <= north and span_west <= lon <= span_east:
+							found.append(site_id)
+		return found
+
+	def nearest(self, lat, lon, k):
+		"""
+		Returns the k sites closest to a point.
+		:return: list of (heritage_site_id, distance_km), closest first
+		"""
+		if k <= 0 or not self._points:
+			return []
+
+		origin_row, origin_column = _cell(lat, lon)
+		best = []  # max-heap of (-distance, site_id)
+		visited = set()  # wide rings wrap around onto cells already searched
+		for ring in range(max(ROWS, COLUMNS)):
+			for cell in self._ring(origin_row, origin_column, ring):
+				if cell in visited:
+					continue
+				visited.add(cell)
+				for site_id, site_lat, site_lon in self._cells.get(cell, ()):
+					distance = haversine_km(lat, lon, site_lat, site_lon)
+					if len(best) < k:
+						heapq.heappush(best, (-distance, site_id))
+					elif distance < -best[0][0]:
+						heapq.heapreplace(best, (-distance, site_id))
+
+			if len(best) == k and -best[0][0] <= self._ring_distance_km(lat, ring):
+				break
+
+		return sorted(((site_id, -distance) for distance, site_id in best), key=lambda item: item[1])
+
+	@staticmethod
+	def _ring(origin_row, origin_column, ring):
+		# Cells at Chebyshev distance `ring`; columns wrap around the antimeridian.
+		columns = set(
+			(origin_column + offset) % COLUMNS for offset in range(-ring, ring + 1))
+		for row in range(origin_row - ring, origin_row + ring + 1):
+			if row < 0 or row >= ROWS:
+				continue
+			if abs(row - origin_row) == ring:
+				ring_columns = columns
+			else:
+				ring_columns = set(
+					[(origin_column - ring) % COLUMNS, (origin_column + ring) % COLUMNS])
+			for column in ring_columns:
+				yield row, column
+
+	@staticmethod
+	def _ring_distance_km(lat, ring):
+		"""
+		Lower bound of the great-circle distance from a point to any cell beyond the first
+		`ring` rings around its own cell: such a cell is at least ring * CELL_SIZE degrees away
+		in latitude, or in longitude, and the distance from a point at latitude lat to the
+		meridian d degrees away is asin(cos(lat) * sin(d)).
+		"""
+		degrees = ring * CELL_SIZE
+		north_south = math.radians(min(degrees, 180.0))
+		east_west = math.asin(
+			math.cos(math.radians(lat)) * math.sin(math.radians(min(degrees, 90.0))))
+		return EARTH_RADIUS_KM * min(north_south, east_west)
+
+
+_snapshot = VersionedSnapshot(NAMESPACE, SpatialIndex.build)
+
+
+def get_spatial_index():
+	"""
+	Returns this worker's SpatialIndex, (re)building it if needed.
+	:return: SpatialIndex
+	"""
+	return _snapshot.get()
+
+
+@receiver(sites_changed)
+def sites_changed_handler(sender, site_ids, deleted=False, **kwargs):
+	site_ids = list(site_ids)
+	_snapshot.update(lambda index: index.with_sites(site_ids))
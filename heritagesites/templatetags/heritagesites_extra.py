@@ -1,6 +1,13 @@
 from django import template
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models import Prefetch, prefetch_related_objects
 from django.template.defaultfilters import stringfilter
 
+from ..models import HeritageSite, SiteGeography
+from ..refdata import NAMESPACE as REFDATA
+from ..versions import get_versions, site_namespace
+
 register = template.Library()
 
 
@@ -20,3 +27,52 @@ def add_trailing_comma(value):
 @stringfilter
 def add_parentheses(value):
 	return ''.join(['(', value, ')'])
+
+
+@register.simple_tag(takes_context=True)
+def query_with(context, name, value):
+	"""
+	Returns the current query string with one parameter set (or replaced), e.g. for facet
+	links that narrow the current filter.
+	"""
+	query = context['request'].GET.copy()
+	query[name] = value
+	return '?' + query.urlencode()
+
+
+def _fragment_cache():
+	# The cache {% cache %} stores fragments in.
+	try:
+		return caches['template_fragments']
+	except InvalidCacheBackendError:
+		return caches['default']
+
+
+@register.simple_tag
+def site_fragment_versions(sites, fragment_name=None):
+	"""
+	Sets fragment_version on each site (a HeritageSite or an iterable of them) for use in
+	{% cache %} keys, e.g. {% cache 86400 site_item site.pk site.fragment_version %}. It
+	combines the site's own version, bumped by every write path through sites_changed, with
+	the reference data version (category, country and region names), and is read for all
+	the sites with one cache round trip. Given the fragment name, the site_geography rows of
+	the sites whose fragment is not cached are prefetched with one query, so that rendering
+	the misses does not query per site.
+	:return: ''
+	"""
+	sites = [sites] if isinstance(sites, HeritageSite) else list(sites)
+	versions = get_versions([REFDATA] + [site_namespace(site.pk) for site in sites])
+	for site in sites:
+		site.fragment_version = '{}.{}'.format(versions[site_namespace(site.pk)], versions[REFDATA])
+
+	if fragment_name is not None and sites:
+		keys = {
+			make_template_fragment_key(fragment_name, [site.pk, site.fragment_version]): site
+			for site in sites
+		}
+		cached = _fragment_cache().get_many(list(keys))
+		missing = [site for key, site in keys.items() if key not in cached]
+		prefetch_related_objects(
+			missing,
+			Prefetch('site_geography', queryset=SiteGeography.objects.order_by('country_area_name')))
+	return ''
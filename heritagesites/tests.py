@@ -1,6 +1,98 @@
-from django.test import SimpleTestCase, TestCase
+import gzip
+import json
+import os
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from .models import HeritageSite, HeritageSiteCategory
+from django.utils import timezone
+from .auth import TIMEOUT as AUTH_TIMEOUT
+from .changes import SETTLE_SECONDS, get_changes
+from .clusters import MAX_ZOOM, ClusterIndex, get_cluster_index, _snapshot as cluster_snapshot
+from .export import export_sites
+from .facets import get_facets
+from .filters import HeritageSiteFilter
+from .forms import HeritageSiteForm
+from .geography import refresh_site_geography
+from .hierarchy import get_location_tree
+from .jurisdictions import set_jurisdictions, sync_jurisdictions
+from .pagination import CachedCountPaginator, paginate_keyset
+from .refdata import get_reference_data
+from .search import search, tokenize, _snapshot as search_snapshot
+from .spatial import get_spatial_index, _snapshot as spatial_snapshot
+from .models import CountryArea, HeritageSite, HeritageSiteCategory, HeritageSiteJurisdiction, \
+	IntermediateRegion, Location, Planet, Region, SiteChange, SiteGeography, SubRegion
+from .signals import sites_changed
+
+
+def create_site_fixture():
+	"""
+	Creates a minimal UNSD hierarchy (one planet, two regions) and two Heritage Sites, one of
+	which is transboundary, and populates site_geography for them. The cache is cleared first
+	so that no per-worker index built in an earlier (rolled back) test is reused.
+	"""
+	cache.clear()
+	planet = Planet.objects.create(planet_name='Earth', unsd_name='World')
+	asia = Region.objects.create(region_name='Asia', planet=planet)
+	europe = Region.objects.create(region_name='Europe', planet=planet)
+	south_asia = SubRegion.objects.create(sub_region_name='Southern Asia', region=asia)
+	east_europe = SubRegion.objects.create(sub_region_name='Eastern Europe', region=europe)
+	central_asia = IntermediateRegion.objects.create(
+		intermediate_region_name='Central Asia', sub_region=south_asia)
+
+	afghanistan = CountryArea.objects.create(
+		country_area_name='Afghanistan',
+		m49_code=4,
+		iso_alpha3_code='AFG',
+		location=Location.objects.create(
+			planet=planet, region=asia, sub_region=south_asia, intermediate_region=central_asia))
+	poland = CountryArea.objects.create(
+		country_area_name='Poland',
+		m49_code=616,
+		iso_alpha3_code='POL',
+		location=Location.objects.create(planet=planet, region=europe, sub_region=east_europe))
+
+	category = HeritageSiteCategory.objects.create(category_name='Cultural')
+	bamiyan = HeritageSite.objects.create(
+		site_name='Bamiyan Valley',
+		heritage_site_category=category,
+		description='The cultural landscape ...',
+		latitude='34.84694000',
+		longitude='67.82525000',
+		transboundary=0)
+	HeritageSiteJurisdiction.objects.create(heritage_site=bamiyan, country_area=afghanistan)
+
+	frontier = HeritageSite.objects.create(
+		site_name='Frontier Forts',
+		heritage_site_category=category,
+		description='A transboundary site ...',
+		latitude='50.06143000',
+		longitude='19.93658000',
+		transboundary=1)
+	HeritageSiteJurisdiction.objects.create(heritage_site=frontier, country_area=poland)
+	HeritageSiteJurisdiction.objects.create(heritage_site=frontier, country_area=afghanistan)
+
+	refresh_site_geography([bamiyan.heritage_site_id, frontier.heritage_site_id])
+	return bamiyan, frontier
+
+
+def settle_changes():
+	"""
+	Ages the change log past the settle window, so that get_changes() serves every row.
+	"""
+	SiteChange.objects.update(changed_at=F('changed_at') - timedelta(seconds=SETTLE_SECONDS))
 
 
 class IndexViewTest(TestCase):
@@ -87,4 +179,720 @@ class SiteListViewTest(TestCase):
 	def test_view_template(self):
 		response = self.client.get(reverse('sites'))
 		self.assertEqual(response.status_code, 200)
-		self.assertTemplateUsed(response, 'heritagesites/site.html')
\ No newline at end of file
+		self.assertTemplateUsed(response, 'heritagesites/site.html')
+
+
+class SiteGeographyTest(TestCase):
+
+	def setUp(self):
+		create_site_fixture()
+
+	def test_names(self):
+		site = HeritageSite.objects.get(site_name='Frontier Forts')
+		self.assertEqual(site.country_area_names, 'Afghanistan (AFG), Poland (POL)')
+		self.assertEqual(site.region_names, 'Asia, Europe')
+		self.assertEqual(site.sub_region_names, 'Southern Asia, Eastern Europe')
+		self.assertEqual(site.intermediate_region_names, 'Central Asia')
+
+	def test_standalone_names_are_memoized(self):
+		site = HeritageSite.objects.get(site_name='Frontier Forts')
+		with self.assertNumQueries(1):
+			site.country_area_names
+			site.region_names
+			site.sub_region_names
+			site.intermediate_region_names
+
+	def test_with_geography_batches_queries(self):
+		with self.assertNumQueries(2):
+			for site in HeritageSite.objects.with_geography():
+				site.country_area_names
+				site.region_names
+				site.sub_region_names
+				site.intermediate_region_names
+
+	def test_region_rename_refreshes_names(self):
+		region = Region.objects.get(region_name='Europe')
+		region.region_name = 'Europa'
+		region.save()
+		site = HeritageSite.objects.get(site_name='Frontier Forts')
+		self.assertEqual(site.region_names, 'Asia, Europa')
+
+	def test_sites_changed_refreshes_rows(self):
+		bamiyan = HeritageSite.objects.get(site_name='Bamiyan Valley')
+		poland = CountryArea.objects.get(country_area_name='Poland')
+		HeritageSiteJurisdiction.objects.create(heritage_site=bamiyan, country_area=poland)
+		sites_changed.send(sender=HeritageSite, site_ids=[bamiyan.heritage_site_id])
+		self.assertEqual(
+			HeritageSite.objects.get(pk=bamiyan.pk).country_area_names,
+			'Afghanistan (AFG), Poland (POL)')
+
+	def test_rebuild_command(self):
+		SiteGeography.objects.all().delete()
+		call_command('rebuild_site_geography', stdout=StringIO())
+		self.assertEqual(SiteGeography.objects.count(), 3)
+
+	def test_region_filter(self):
+		response = self.client.get(reverse('site_filter'), {
+			'region': Region.objects.get(region_name='Europe').pk})
+		self.assertEqual(
+			[site.site_name for site in response.context['object_list']], ['Frontier Forts'])
+
+
+class ReferenceDataTest(TestCase):
+
+	def setUp(self):
+		create_site_fixture()
+
+	def test_lookups_do_not_query(self):
+		get_reference_data()
+		with self.assertNumQueries(0):
+			refdata = get_reference_data()
+			poland = refdata.get_by_name(CountryArea, 'Poland')
+			self.assertEqual(poland.location.region.region_name, 'Europe')
+			self.assertEqual(poland.location.region.planet.planet_name, 'Earth')
+			self.assertEqual(refdata.get(Region, poland.location.region_id), poland.location.region)
+
+	def test_write_invalidates(self):
+		get_reference_data()
+		region = Region.objects.get(region_name='Europe')
+		region.region_name = 'Europa'
+		region.save()
+		self.assertIsNone(get_reference_data().get_by_name(Region, 'Europe'))
+		self.assertEqual(get_reference_data().get(Region, region.pk).region_name, 'Europa')
+
+
+class LocationTreeTest(TestCase):
+
+	def setUp(self):
+		create_site_fixture()
+
+	def test_country_area_ids(self):
+		tree = get_location_tree()
+		planet = Planet.objects.get()
+		asia = Region.objects.get(region_name='Asia')
+		afghanistan = CountryArea.objects.get(country_area_name='Afghanistan')
+		poland = CountryArea.objects.get(country_area_name='Poland')
+		self.assertEqual(
+			tree.country_area_ids('planet', planet.pk), {afghanistan.pk, poland.pk})
+		self.assertEqual(tree.country_area_ids('region', asia.pk), {afghanistan.pk})
+		self.assertEqual(tree.country_area_ids('region', 0), set())
+
+	def test_sub_region_filter(self):
+		response = self.client.get(reverse('site_filter'), {
+			'sub_region': SubRegion.objects.get(sub_region_name='Southern Asia').pk})
+		self.assertEqual(
+			sorted(site.site_name for site in response.context['object_list']),
+			['Bamiyan Valley', 'Frontier Forts'])
+
+	def test_combined_filters_return_site_once(self):
+		response = self.client.get(reverse('site_filter'), {
+			'region': Region.objects.get(region_name='Europe').pk,
+			'intermediate_region': IntermediateRegion.objects.get().pk,
+			'country_area': CountryArea.objects.get(country_area_name='Afghanistan').pk})
+		self.assertEqual(
+			[site.site_name for site in response.context['object_list']], ['Frontier Forts'])
+
+
+class SearchTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+
+	def test_tokenize(self):
+		self.assertEqual(tokenize('<p>The Old Town of São Paulo</p>'), ['old', 'town', 'sao', 'paulo'])
+
+	def test_ranking_and_prefix(self):
+		self.assertEqual(
+			[site_id for site_id, score in search('transboundary')], [self.frontier.pk])
+		self.assertEqual([site_id for site_id, score in search('bamiy')], [self.bamiyan.pk])
+		self.assertEqual(search('bamiyan transboundary'), [])
+
+	def test_index_follows_writes(self):
+		search('forts')
+		self.frontier.site_name = 'Frontier Castles'
+		self.frontier.save()
+		sites_changed.send(sender=HeritageSite, site_ids=[self.frontier.pk])
+		self.assertEqual(search('forts'), [])
+		self.assertEqual([site_id for site_id, score in search('castles')], [self.frontier.pk])
+
+	def test_filter(self):
+		response = self.client.get(reverse('site_filter'), {'q': 'valley'})
+		self.assertEqual(
+			[site.site_name for site in response.context['object_list']], ['Bamiyan Valley'])
+
+
+class FacetTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+		HeritageSite.objects.filter(pk=self.bamiyan.pk).update(date_inscribed=2003)
+
+	def test_counts(self):
+		facets = get_facets(HeritageSiteFilter({}, queryset=HeritageSite.objects.all()))
+		self.assertEqual(
+			[(facet['name'], facet['count']) for facet in facets['heritage_site_category']],
+			[('Cultural', 2)])
+		self.assertEqual(
+			[(facet['name'], facet['count']) for facet in facets['region']],
+			[('Asia', 2), ('Europe', 1)])
+		self.assertEqual(facets['date_inscribed'], [{'value': 2003, 'count': 1}])
+
+	def test_counts_follow_filter_and_are_cached(self):
+		data = {'region': Region.objects.get(region_name='Europe').pk}
+		facets = get_facets(HeritageSiteFilter(data, queryset=HeritageSite.objects.all()))
+		self.assertEqual(facets['date_inscribed'], [])
+		with self.assertNumQueries(0):
+			get_facets(HeritageSiteFilter(data, queryset=HeritageSite.objects.all()))
+
+	def test_invalid_filter_not_cached_as_unfiltered(self):
+		data = {'region': 'bogus', 'date_inscribed': 2003}
+		facets = get_facets(HeritageSiteFilter(data, queryset=HeritageSite.objects.all()))
+		self.assertEqual(
+			[(facet['name'], facet['count']) for facet in facets['region']], [('Asia', 1)])
+		facets = get_facets(HeritageSiteFilter({}, queryset=HeritageSite.objects.all()))
+		self.assertEqual(
+			[(facet['name'], facet['count']) for facet in facets['region']],
+			[('Asia', 2), ('Europe', 1)])
+
+	def test_filter_page(self):
+		response = self.client.get(reverse('site_filter'))
+		self.assertContains(response, '?region=')
+
+
+class SpatialIndexTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+
+	def test_nearest(self):
+		nearest = get_spatial_index().nearest(52.2297, 21.0122, 2)
+		self.assertEqual([site_id for site_id, distance in nearest], [self.frontier.pk, self.bamiyan.pk])
+		self.assertAlmostEqual(nearest[0][1], 252, delta=5)
+
+	def test_within(self):
+		index = get_spatial_index()
+		self.assertEqual(index.within(30, 60, 40, 70), [self.bamiyan.pk])
+		self.assertEqual(sorted(index.within(-90, 10, 90, -170)), [self.bamiyan.pk, self.frontier.pk])
+		self.assertEqual(index.within(-90, 170, 90, -170), [])
+
+	def test_index_follows_coordinate_edits(self):
+		get_spatial_index()
+		self.bamiyan.latitude = '-33.86000000'
+		self.bamiyan.longitude = '151.21000000'
+		self.bamiyan.save()
+		sites_changed.send(sender=HeritageSite, site_ids=[self.bamiyan.pk])
+		self.assertEqual(get_spatial_index().within(30, 60, 40, 70), [])
+		self.assertEqual(get_spatial_index().nearest(-34, 151, 1)[0][0], self.bamiyan.pk)
+
+
+class ClusterTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+
+	def test_world_tile(self):
+		clusters = get_cluster_index().tile(0, 0, 0)
+		self.assertEqual(
+			sorted(cluster['heritage_site_id'] for cluster in clusters),
+			[self.bamiyan.pk, self.frontier.pk])
+		self.assertEqual(get_cluster_index().tile(MAX_ZOOM, 0, 0), [])
+
+	def test_index_follows_coordinate_edits(self):
+		get_cluster_index()
+		self.bamiyan.latitude = '50.50000000'
+		self.bamiyan.longitude = '20.50000000'
+		self.bamiyan.save()
+		sites_changed.send(sender=HeritageSite, site_ids=[self.bamiyan.pk])
+
+		[cluster] = get_cluster_index().tile(0, 0, 0)
+		self.assertEqual(cluster['count'], 2)
+		self.assertIsNone(cluster['heritage_site_id'])
+		self.assertAlmostEqual(cluster['latitude'], (50.5 + 50.06143) / 2, places=5)
+		self.assertEqual(cluster['heritage_site_category_id'], self.bamiyan.heritage_site_category_id)
+		self.assertEqual(get_cluster_index().tile(0, 0, 0), ClusterIndex.build().tile(0, 0, 0))
+
+
+class IncrementalIndexTest(TransactionTestCase):
+	"""
+	The search, spatial and cluster indexes follow writes through with_sites(), applied on
+	commit (VersionedSnapshot.update), which TestCase never reaches: it never commits.
+	"""
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+		self.category_id = self.bamiyan.heritage_site_category_id
+		# Each index's complete state, in a comparable form.
+		self.snapshots = [
+			(search_snapshot, lambda index: (index._postings, index._documents, index._vocabulary)),
+			(spatial_snapshot, lambda index: (
+				index._points, {cell: sorted(sites) for cell, sites in index._cells.items()})),
+			(cluster_snapshot, lambda index: (index._sites, index._members, index._clusters)),
+		]
+
+	def assertFollows(self, write, atomic=True):
+		"""
+		Runs `write` (which returns the ids of the sites it changed) and checks that every
+		index is then updated in place, not rebuilt, and equal to a full rebuild.
+		"""
+		for snapshot, state in self.snapshots:
+			snapshot.get()
+		builds = [snapshot.build for snapshot, state in self.snapshots]
+		with ExitStack() as stack:
+			for snapshot, state in self.snapshots:
+				stack.enter_context(mock.patch.object(
+					snapshot, 'build', side_effect=AssertionError('index rebuilt')))
+			with transaction.atomic() if atomic else ExitStack():
+				site_ids, deleted = write()
+				sites_changed.send(sender=HeritageSite, site_ids=site_ids, deleted=deleted)
+			indexes = [snapshot.get() for snapshot, state in self.snapshots]
+		for (snapshot, state), index, build in zip(self.snapshots, indexes, builds):
+			self.assertEqual(state(index), state(build()))
+
+	def test_create(self):
+		def create():
+			site = HeritageSite.objects.create(
+				site_name='Wieliczka Salt Mine',
+				heritage_site_category_id=self.category_id,
+				description='Royal salt mine ...',
+				latitude='49.98389000',
+				longitude='20.05528000',
+				transboundary=0)
+			return [site.pk], False
+		self.assertFollows(create)
+		salt_mine = HeritageSite.objects.get(site_name='Wieliczka Salt Mine')
+		self.assertEqual([site_id for site_id, score in search('salt')], [salt_mine.pk])
+
+	def test_update(self):
+		def update():
+			HeritageSite.objects.filter(pk=self.frontier.pk).update(
+				site_name='Frontier Castles', latitude='35.00000000', longitude='68.00000000')
+			return [self.frontier.pk], False
+		self.assertFollows(update)
+		self.assertEqual(len(get_spatial_index().within(30, 60, 40, 70)), 2)
+
+	def test_update_outside_transaction(self):
+		def update():
+			HeritageSite.objects.filter(pk=self.bamiyan.pk).update(latitude=None, longitude=None)
+			return [self.bamiyan.pk], False
+		self.assertFollows(update, atomic=False)
+		self.assertEqual(len(get_spatial_index()), 1)
+
+	def test_delete(self):
+		def delete():
+			HeritageSiteJurisdiction.objects.filter(heritage_site_id=self.bamiyan.pk).delete()
+			HeritageSite.objects.filter(pk=self.bamiyan.pk).delete()
+			return [self.bamiyan.pk], True
+		self.assertFollows(delete)
+		self.assertEqual(search('bamiyan'), [])
+
+
+class ChoiceListTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+		self.poland = CountryArea.objects.get(country_area_name='Poland')
+
+	def test_filter_form_renders_without_queries(self):
+		HeritageSiteFilter({}).form.as_p()
+		with self.assertNumQueries(0):
+			html = HeritageSiteFilter({'country_area': self.poland.pk}).form.as_p()
+		self.assertInHTML(
+			'<option value="{}" selected>Poland</option>'.format(self.poland.pk), html)
+		self.assertLess(html.index('Afghanistan'), html.index('Poland'))
+
+	def test_site_form(self):
+		HeritageSiteForm().as_p()
+		with self.assertNumQueries(0):
+			HeritageSiteForm().as_p()
+
+		form = HeritageSiteForm({
+			'site_name': 'Wieliczka',
+			'heritage_site_category': self.bamiyan.heritage_site_category_id,
+			'country_area': [self.poland.pk, self.poland.pk],
+		})
+		self.assertEqual(form.errors.keys() & {'heritage_site_category', 'country_area'}, set())
+		self.assertEqual(form.cleaned_data['country_area'], [self.poland])
+
+		form = HeritageSiteForm({'country_area': ['0']})
+		self.assertIn('country_area', form.errors)
+
+	def test_reference_write_refreshes_options(self):
+		HeritageSiteFilter({}).form.as_p()
+		self.poland.country_area_name = 'Republic of Poland'
+		self.poland.save()
+		self.assertIn('Republic of Poland', HeritageSiteFilter({}).form.as_p())
+
+
+class KeysetPaginationTest(TestCase):
+
+	def setUp(self):
+		bamiyan, frontier = create_site_fixture()
+		for name in ('Abu Mena', 'Cologne Cathedral', 'Delos', 'Ephesus'):
+			HeritageSite.objects.create(
+				site_name=name,
+				heritage_site_category_id=bamiyan.heritage_site_category_id,
+				transboundary=0)
+		self.names = list(
+			HeritageSite.objects.order_by('site_name').values_list('site_name', flat=True))
+
+	def test_walk_forward_and_back(self):
+		queryset = HeritageSite.objects.all()
+		pages = [paginate_keyset(queryset, '', 4)]
+		self.assertFalse(pages[0].has_previous)
+		while pages[-1].has_next:
+			pages.append(paginate_keyset(queryset, pages[-1].next_cursor, 4))
+		self.assertEqual(
+			[site.site_name for page in pages for site in page], self.names)
+
+		previous = paginate_keyset(queryset, pages[-1].previous_cursor, 4)
+		self.assertEqual([site.site_name for site in previous], self.names[:4])
+		self.assertFalse(previous.has_previous)
+		self.assertTrue(previous.has_next)
+
+	def test_invalid_cursor(self):
+		with self.assertRaises(ValueError):
+			paginate_keyset(HeritageSite.objects.all(), 'not-a-cursor', 4)
+
+	def test_site_list(self):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('sites'))
+		self.assertEqual([site.site_name for site in response.context['sites']], self.names)
+		self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+		self.assertEqual(self.client.get(reverse('sites'), {'page': 1}).status_code, 200)
+		self.assertEqual(self.client.get(reverse('sites'), {'cursor': '%%%'}).status_code, 404)
+
+
+class CachedCountPaginatorTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+
+	def count_queries(self, queryset, **kwargs):
+		with CaptureQueriesContext(connection) as queries:
+			count = CachedCountPaginator(queryset, 1, **kwargs).count
+		return count, sum('COUNT(' in query['sql'] for query in queries)
+
+	def test_count_cached_per_query(self):
+		queryset = HeritageSiteFilter({'site_name': 'o'}, HeritageSite.objects.all()).qs
+		self.assertEqual(self.count_queries(queryset), (1, 1))
+		# Same rows in another order: same signature.
+		self.assertEqual(self.count_queries(queryset.order_by('-site_name')), (1, 0))
+		self.assertEqual(self.count_queries(HeritageSite.objects.all()), (2, 1))
+
+	def test_invalidated_by_writes(self):
+		self.assertEqual(self.count_queries(HeritageSite.objects.all()), (2, 1))
+		site_id = self.bamiyan.pk
+		self.bamiyan.delete()
+		sites_changed.send(sender=HeritageSite, site_ids=[site_id], deleted=True)
+		self.assertEqual(self.count_queries(HeritageSite.objects.all()), (1, 1))
+
+	def test_estimated_count(self):
+		paginator = CachedCountPaginator(HeritageSite.objects.all(), 1, estimate_above=1)
+		self.assertEqual(paginator.count, 1)
+		self.assertTrue(paginator.count_is_estimate)
+		paginator = CachedCountPaginator(HeritageSite.objects.all(), 1, estimate_above=5)
+		self.assertEqual(paginator.count, 2)
+		self.assertFalse(paginator.count_is_estimate)
+
+	def test_site_list_pages(self):
+		self.client.get(reverse('sites'), {'page': 1})
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('sites'), {'page': 1})
+		self.assertEqual(response.context['paginator'].count, 2)
+		self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+
+class JurisdictionSyncTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+		self.afghanistan = CountryArea.objects.get(country_area_name='Afghanistan')
+		self.poland = CountryArea.objects.get(country_area_name='Poland')
+
+	def country_area_ids(self, site):
+		return sorted(site.heritagesitejurisdiction_set.values_list('country_area_id', flat=True))
+
+	def test_sync_is_set_based(self):
+		with CaptureQueriesContext(connection) as queries:
+			added, removed = sync_jurisdictions({
+				self.bamiyan.pk: [self.poland],
+				self.frontier.pk: [self.poland.pk],
+			})
+		self.assertEqual((added, removed), (1, 2))
+		self.assertEqual(self.country_area_ids(self.bamiyan), [self.poland.pk])
+		self.assertEqual(self.country_area_ids(self.frontier), [self.poland.pk])
+
+		statements = [query['sql'].split()[0] for query in queries]
+		self.assertEqual(statements.count('SELECT'), 1)
+		self.assertEqual(statements.count('INSERT'), 1)
+		self.assertEqual(statements.count('DELETE'), 1)
+
+	def test_unchanged(self):
+		self.assertEqual(set_jurisdictions(self.frontier, [self.afghanistan, self.poland]), (0, 0))
+
+	def test_site_update_view(self):
+		self.client.force_login(User.objects.create_user('editor'))
+		response = self.client.post(reverse('site_update', args=[self.frontier.pk]), {
+			'site_name': 'Frontier Forts',
+			'heritage_site_category': self.frontier.heritage_site_category_id,
+			'description': 'A transboundary site ...',
+			'justification': 'Outstanding',
+			'transboundary': 0,
+			'country_area': [self.poland.pk],
+		})
+		self.assertEqual(response.status_code, 302)
+		self.assertEqual(self.country_area_ids(self.frontier), [self.poland.pk])
+
+	def test_admin(self):
+		self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+		url = reverse('admin:heritagesites_heritagesite_change', args=[self.bamiyan.pk])
+		self.assertContains(self.client.get(url), 'name="jurisdictions"')
+		response = self.client.post(url, {
+			'site_name': 'Bamiyan Valley',
+			'heritage_site_category': self.bamiyan.heritage_site_category_id,
+			'description': 'The cultural landscape ...',
+			'justification': 'Outstanding',
+			'transboundary': 1,
+			'jurisdictions': [self.afghanistan.pk, self.poland.pk],
+		})
+		self.assertEqual(response.status_code, 302)
+		self.assertEqual(
+			self.country_area_ids(self.bamiyan), sorted([self.afghanistan.pk, self.poland.pk]))
+
+
+class ConditionalGetTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+		self.url = reverse('site_detail', args=[self.bamiyan.pk])
+
+	def test_site_detail(self):
+		response = self.client.get(self.url)
+		self.assertTrue(response.has_header('Last-Modified'))
+		etag = response['ETag']
+
+		with self.assertNumQueries(1):
+			response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+
+		set_jurisdictions(self.bamiyan, [])
+		sites_changed.send(sender=HeritageSite, site_ids=[self.bamiyan.pk])
+		response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+
+	def test_site_list(self):
+		etag = self.client.get(reverse('sites'))['ETag']
+		with self.assertNumQueries(0):
+			response = self.client.get(reverse('sites'), HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(
+			self.client.get(reverse('sites'), {'page': 1}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+		sites_changed.send(sender=HeritageSite, site_ids=[self.frontier.pk])
+		self.assertEqual(
+			self.client.get(reverse('sites'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+	def test_unknown_site(self):
+		response = self.client.get(reverse('site_detail', args=[0]), HTTP_IF_NONE_MATCH='"x"')
+		self.assertEqual(response.status_code, 404)
+
+
+class ExportTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+
+	def test_ndjson_in_chunks(self):
+		with CaptureQueriesContext(connection) as queries:
+			records = [json.loads(line) for line in export_sites('ndjson', chunk_size=1)]
+		self.assertEqual(
+			[record['site_name'] for record in records], ['Bamiyan Valley', 'Frontier Forts'])
+		self.assertEqual(records[0]['longitude'], '67.82525000')
+		self.assertEqual(records[0]['heritage_site_category']['category_name'], 'Cultural')
+		self.assertEqual(
+			[country['iso_alpha3_code'] for country in records[1]['jurisdictions']], ['AFG', 'POL'])
+		# Two chunks of one site, an empty third: a site and a jurisdiction query per chunk.
+		site_queries = [query for query in queries if 'heritage_site_jurisdiction' not in query['sql']]
+		self.assertEqual(len(queries) - len(site_queries), 2)
+
+	def test_csv(self):
+		lines = list(export_sites('csv'))
+		self.assertEqual(len(lines), 3)
+		self.assertTrue(lines[0].startswith('heritage_site_id,site_name,'))
+		self.assertIn('Afghanistan|Poland', lines[2])
+
+	def test_command(self):
+		directory = tempfile.mkdtemp()
+		path = os.path.join(directory, 'sites.ndjson.gz')
+		try:
+			call_command('export_sites', '--gzip', '-o', path, stdout=StringIO())
+			with gzip.open(path, 'rt', encoding='utf-8') as export:
+				self.assertEqual(len(export.readlines()), 2)
+		finally:
+			os.remove(path)
+			os.rmdir(directory)
+
+	def test_command_stdout(self):
+		stdout = StringIO()
+		call_command('export_sites', '--format', 'csv', stdout=stdout)
+		self.assertEqual(len(stdout.getvalue().splitlines()), 3)
+
+
+class ChangeLogTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+		settle_changes()
+		self.cursor = get_changes().cursor
+
+	def test_changes_collapse_per_object(self):
+		sites_changed.send(sender=HeritageSite, site_ids=[self.bamiyan.pk, self.frontier.pk])
+		sites_changed.send(sender=HeritageSite, site_ids=[self.bamiyan.pk], deleted=True)
+		settle_changes()
+		batch = get_changes(self.cursor)
+		self.assertEqual(
+			[(change.object_id, change.action) for change in batch.changes],
+			[(self.frontier.pk, SiteChange.UPDATED), (self.bamiyan.pk, SiteChange.DELETED)])
+		self.assertFalse(batch.has_more)
+		self.assertEqual(get_changes(batch.cursor).changes, [])
+
+	def test_limit_and_categories(self):
+		HeritageSiteCategory.objects.create(category_name='Natural')
+		sites_changed.send(sender=HeritageSite, site_ids=[self.bamiyan.pk])
+		settle_changes()
+		batch = get_changes(self.cursor, limit=1)
+		self.assertEqual([change.object_type for change in batch.changes], [SiteChange.CATEGORY])
+		self.assertTrue(batch.has_more)
+		batch = get_changes(batch.cursor, limit=1)
+		self.assertEqual([change.object_type for change in batch.changes], [SiteChange.SITE])
+
+	def test_out_of_order_commits(self):
+		# Transaction A inserts change 1, transaction B change 2; B commits first.
+		first = SiteChange.objects.aggregate(Max('change_id'))['change_id__max'] or 0
+		now = timezone.now()
+		SiteChange.objects.create(
+			change_id=first + 2, object_type=SiteChange.SITE, object_id=self.frontier.pk,
+			action=SiteChange.UPDATED, changed_at=now)
+		batch = get_changes(self.cursor)
+		self.assertEqual(batch.changes, [])
+		self.assertEqual(batch.cursor, self.cursor)
+
+		SiteChange.objects.create(
+			change_id=first + 1, object_type=SiteChange.SITE, object_id=self.bamiyan.pk,
+			action=SiteChange.UPDATED, changed_at=now + timedelta(milliseconds=1))
+		settle_changes()
+		batch = get_changes(self.cursor)
+		self.assertEqual(
+			[change.object_id for change in batch.changes], [self.bamiyan.pk, self.frontier.pk])
+
+	def test_unsettled_change_stops_batch(self):
+		sites_changed.send(sender=HeritageSite, site_ids=[self.bamiyan.pk])
+		settle_changes()
+		sites_changed.send(sender=HeritageSite, site_ids=[self.frontier.pk])
+		batch = get_changes(self.cursor)
+		self.assertEqual([change.object_id for change in batch.changes], [self.bamiyan.pk])
+		self.assertFalse(batch.has_more)
+		self.assertEqual(get_changes(batch.cursor).changes, [])
+
+	def test_delete_rolled_back_without_change_row(self):
+		self.client.force_login(User.objects.create_user('editor'))
+		with mock.patch('heritagesites.changes.record_changes', side_effect=RuntimeError):
+			with self.assertRaises(RuntimeError):
+				self.client.post(reverse('site_delete', args=[self.bamiyan.pk]))
+		self.assertTrue(HeritageSite.objects.filter(pk=self.bamiyan.pk).exists())
+		self.assertTrue(HeritageSiteJurisdiction.objects.filter(heritage_site_id=self.bamiyan.pk).exists())
+
+	def test_admin_deletes_rolled_back_without_change_row(self):
+		self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+		with mock.patch('heritagesites.changes.record_changes', side_effect=RuntimeError):
+			with self.assertRaises(RuntimeError):
+				self.client.post(
+					reverse('admin:heritagesites_heritagesite_delete', args=[self.bamiyan.pk]),
+					{'post': 'yes'})
+			with self.assertRaises(RuntimeError):
+				self.client.post(reverse('admin:heritagesites_heritagesite_changelist'), {
+					'action': 'delete_selected',
+					'_selected_action': [self.bamiyan.pk, self.frontier.pk],
+					'post': 'yes',
+				})
+		self.assertEqual(HeritageSite.objects.count(), 2)
+
+	def test_invalid_cursor(self):
+		with self.assertRaises(ValueError):
+			get_changes('not a cursor')
+
+
+class CachedSessionAuthenticationTest(TestCase):
+
+	url = '/heritagesites/api/hierarchy/'
+
+	def setUp(self):
+		create_site_fixture()
+		self.user = User.objects.create_user('editor', password='first password')
+		self.client.force_login(self.user)
+
+	def test_cached(self):
+		self.client.get(self.url)
+		with self.assertNumQueries(0):
+			response = self.client.get(self.url)
+		self.assertEqual(response.wsgi_request.user, self.user)
+
+	def test_invalidated(self):
+		self.client.get(self.url)
+		self.user.is_active = False
+		self.user.save()
+		self.assertFalse(self.client.get(self.url).wsgi_request.user.is_active)
+
+		self.user.set_password('second password')
+		self.user.save()
+		self.assertFalse(self.client.get(self.url).wsgi_request.user.is_authenticated)
+
+	def test_session_cached_briefly(self):
+		self.client.get(self.url)
+		Session.objects.all().delete()
+		self.assertTrue(self.client.get(self.url).wsgi_request.user.is_authenticated)
+		with mock.patch('time.time', return_value=time.time() + AUTH_TIMEOUT + 1):
+			self.assertFalse(self.client.get(self.url).wsgi_request.user.is_authenticated)
+
+
+class FragmentCacheTest(TestCase):
+
+	def setUp(self):
+		self.bamiyan, self.frontier = create_site_fixture()
+
+	def rename_quietly(self, site, name):
+		# Written without sites_changed, so only a version bump makes the new name appear.
+		HeritageSite.objects.filter(pk=site.pk).update(site_name=name)
+
+	def test_list_item(self):
+		self.assertContains(self.client.get(reverse('sites')), 'Bamiyan Valley')
+		self.rename_quietly(self.bamiyan, 'Bamiyan Landscape')
+		self.rename_quietly(self.frontier, 'Frontier Fortresses')
+		sites_changed.send(sender=HeritageSite, site_ids=[self.bamiyan.pk])
+		response = self.client.get(reverse('sites'))
+		self.assertContains(response, 'Bamiyan Landscape')
+		self.assertContains(response, '>Frontier Forts<')
+
+	def test_detail_invalidated_by_reference_data(self):
+		url = reverse('site_detail', args=[self.frontier.pk])
+		self.assertContains(self.client.get(url), 'Poland (POL)')
+		# The ETag lookup and the site itself; no site_geography query.
+		with self.assertNumQueries(2):
+			self.client.get(url)
+
+		poland = CountryArea.objects.get(country_area_name='Poland')
+		poland.country_area_name = 'Republic of Poland'
+		poland.save()
+		self.assertContains(self.client.get(url), 'Republic of Poland (POL)')
+
+	def test_filter_cards_prefetch_misses_only(self):
+		url = reverse('site_filter')
+		self.client.get(url, {'site_name': 'o'})
+		sites_changed.send(sender=HeritageSite, site_ids=[self.frontier.pk])
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(url, {'site_name': 'o'})
+		self.assertContains(response, 'Afghanistan (AFG), Poland (POL)')
+		geography = [query for query in queries if 'site_geography' in query['sql']]
+		self.assertEqual(len(geography), 1)
+		self.assertIn('IN ({})'.format(self.frontier.pk), geography[0]['sql'])
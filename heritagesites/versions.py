@@ -0,0 +1,155 @@
+import random
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import receiver
+
+from .signals import sites_changed
+
+
+KEY_PREFIX = 'heritagesites:version:'
+
+# Dataset version of heritage_site (and its jurisdictions), bumped by every write path.
+SITES = 'sites'
+
+
+def site_namespace(site_id):
+	"""
+	Version namespace of a single site, bumped whenever the site or its jurisdictions change.
+	"""
+	return 'site:{}'.format(site_id)
+
+
+def _initial_version():
+	# A random starting point, so a key lost to eviction or a cache restart never comes back
+	# with a value some worker already holds.
+	return random.getrandbits(48)
+
+
+def get_version(namespace):
+	"""
+	Returns the current version of a namespace from the shared cache.
+	:return: int
+	"""
+	key = KEY_PREFIX + namespace
+	version = cache.get(key)
+	if version is None:
+		cache.add(key, _initial_version(), None)
+		version = cache.get(key)
+	return version
+
+
+def get_versions(namespaces):
+	"""
+	get_version() for several namespaces with one cache round trip (plus one per namespace
+	that has no version yet).
+	:return: dict of namespace -> int
+	"""
+	found = cache.get_many([KEY_PREFIX + namespace for namespace in namespaces])
+	return {
+		namespace: found[KEY_PREFIX + namespace]
+		if KEY_PREFIX + namespace in found else get_version(namespace)
+		for namespace in namespaces
+	}
+
+
+def increment_version(namespace):
+	"""
+	Atomically increments the version of a namespace and returns the new value.
+	:return: int
+	"""
+	key = KEY_PREFIX + namespace
+	try:
+		return cache.incr(key)
+	except ValueError:
+		cache.add(key, _initial_version(), None)
+		return cache.incr(key)
+
+
+def bump_version(namespace):
+	"""
+	Publishes a new version of a namespace so that every worker discards the data it built
+	under the previous one. When called inside a transaction the version is bumped again on
+	commit; otherwise another worker could rebuild from the not yet committed (i.e. old) rows
+	in between and keep them under the new version.
+	:return: int
+	"""
+	if transaction.get_connection().in_atomic_block:
+		transaction.on_commit(lambda: increment_version(namespace))
+	return increment_version(namespace)
+
+
+class VersionedSnapshot:
+	"""
+	A per-process object built by `build()` and rebuilt whenever the version of `namespace`
+	changes in the shared cache. An object built inside a transaction may contain rows that
+	are later rolled back, so it is only reused while a transaction is open and rebuilt on the
+	first use outside one.
+	"""
+
+	def __init__(self, namespace, build):
+		self.namespace = namespace
+		self.build = build
+		self._lock = threading.Lock()
+		# (version, object, built inside a transaction)
+		self._snapshot = None
+
+	def _is_current(self, snapshot, version, atomic):
+		return snapshot is not None and snapshot[0] == version and (atomic or not snapshot[2])
+
+	def get(self):
+		version = get_version(self.namespace)
+		atomic = transaction.get_connection().in_atomic_block
+		snapshot = self._snapshot
+		if not self._is_current(snapshot, version, atomic):
+			with self._lock:
+				snapshot = self._snapshot
+				if not self._is_current(snapshot, version, atomic):
+					# Read the version before building so a concurrent write is never
+					# hidden behind the version it published.
+					snapshot = (version, self.build(), atomic)
+					self._snapshot = snapshot
+		return snapshot[1]
+
+	def invalidate(self):
+		self._snapshot = None
+		return bump_version(self.namespace)
+
+	def update(self, apply):
+		"""
+		Replaces this worker's object with `apply(object)`, which must return a new object
+		rather than mutate the shared one, and publishes a new version so the other workers
+		rebuild theirs. Inside a transaction the version is published immediately (readers stop
+		using the old object) and `apply` runs on commit. The updated object is only kept if no
+		other worker published a version in between; otherwise it is dropped and rebuilt on
+		next use.
+		"""
+		if not transaction.get_connection().in_atomic_block:
+			self._apply(apply, self._snapshot)
+			return
+
+		with self._lock:
+			pending = self._snapshot
+			self._snapshot = None
+			version = increment_version(self.namespace)
+
+		if pending is not None and pending[0] + 1 == version:
+			transaction.on_commit(lambda: self._apply(apply, (version,) + pending[1:]))
+		else:
+			transaction.on_commit(lambda: increment_version(self.namespace))
+
+	def _apply(self, apply, snapshot):
+		with self._lock:
+			version = increment_version(self.namespace)
+			if snapshot is not None and snapshot[0] + 1 == version and not snapshot[2]:
+				self._snapshot = (version, apply(snapshot[1]), False)
+			else:
+				self._snapshot = None
+
+
+@receiver(sites_changed)
+def sites_changed_handler(sender, site_ids, **kwargs):
+	bump_version(SITES)
+	for site_id in site_ids:
+		bump_version(site_namespace(site_id))
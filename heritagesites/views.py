@@ -1,14 +1,20 @@
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.views import generic
 from django.shortcuts import redirect
 from django.urls import *
 
 from .models import *
 from .forms import *
+from .signals import sites_changed
 
 from django_filters.views import FilterView
+from .conditional import sites_condition
+from .facets import get_facets
 from .filters import HeritageSiteFilter
+from .jurisdictions import set_jurisdictions
+from .pagination import CachedCountPaginator, paginate_keyset
 
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
@@ -30,6 +36,7 @@ class CountryAreaListView(generic.ListView):
 	context_object_name = 'countries'
 	template_name = 'heritagesites/country_area.html'
 	paginate_by = 20
+	paginator_class = CachedCountPaginator
 
 	def dispatch(self, *args, **kwargs):
 		return super().dispatch(*args, **kwargs)
@@ -46,20 +53,40 @@ class CountryAreaDetailView(generic.DetailView):
 	def dispatch(self, *args, **kwargs):
 		return super().dispatch(*args, **kwargs)
 
+@method_decorator(sites_condition, name='dispatch')
 class SiteListView(generic.ListView):
 	model = HeritageSite
 	context_object_name = 'sites'
 	template_name = 'heritagesites/site.html'
 	paginate_by = 50
+	paginator_class = CachedCountPaginator
 
 	def get_queryset(self):
 		return HeritageSite.objects.all()
 
+	def paginate_queryset(self, queryset, page_size):
+		"""
+		Keyset pagination on (site_name, heritage_site_id) through an opaque ?cursor=, so deep
+		pages cost the same as the first; ?page=N keeps the legacy numbered pages.
+		"""
+		if self.page_kwarg in self.request.GET:
+			return super().paginate_queryset(queryset, page_size)
+		try:
+			page = paginate_keyset(queryset, self.request.GET.get('cursor', ''), page_size)
+		except ValueError:
+			raise Http404('Invalid cursor')
+		return (None, page, page.object_list, page.has_other_pages())
+
+@method_decorator(sites_condition, name='dispatch')
 class SiteDetailView(generic.DetailView):
 	model = HeritageSite
 	context_object_name = 'site'
 	template_name = 'heritagesites/site_detail.html'
 
+	def get_queryset(self):
+		# Geography names are only read when the cached detail fragment is stale.
+		return HeritageSite.objects.select_related('heritage_site_category')
+
 @method_decorator(login_required, name='dispatch')
 class SiteCreateView(generic.View):
 	model = HeritageSite
@@ -75,10 +102,11 @@ class SiteCreateView(generic.View):
 	def post(self, request):
 		form = HeritageSiteForm(request.POST)
 		if form.is_valid():
-			site = form.save(commit=False)
-			site.save()
-			for country in form.cleaned_data['country_area']:
-				HeritageSiteJurisdiction.objects.create(heritage_site=site, country_area=country)
+			with transaction.atomic():
+				site = form.save(commit=False)
+				site.save()
+				set_jurisdictions(site, form.cleaned_data['country_area'])
+				sites_changed.send(sender=HeritageSite, site_ids=[site.heritage_site_id])
 			return redirect(site) # shortcut to object's get_absolute_url()
 			# return HttpResponseRedirect(site.get_absolute_url())
 		return render(request, 'heritagesites/site_new.html', {'form': form})
@@ -101,42 +129,13 @@ class SiteUpdateView(generic.UpdateView):
 		return super().dispatch(*args, **kwargs)
 
 	def form_valid(self, form):
-		site = form.save(commit=False)
-		# site.updated_by = self.request.user
-		# site.date_updated = timezone.now()
-		site.save()
-
-		# Current country_area_id values linked to site
-		old_ids = HeritageSiteJurisdiction.objects\
-			.values_list('country_area_id', flat=True)\
-			.filter(heritage_site_id=site.heritage_site_id)
-
-		# New countries list
-		new_countries = form.cleaned_data['country_area']
-
-		# TODO can these loops be refactored?
-
-		# New ids
-		new_ids = []
-
-		# Insert new unmatched country entries
-		for country in new_countries:
-			new_id = country.country_area_id
-			new_ids.append(new_id)
-			if new_id in old_ids:
-				continue
-			else:
-				HeritageSiteJurisdiction.objects \
-					.create(heritage_site=site, country_area=country)
-
-		# Delete old unmatched country entries
-		for old_id in old_ids:
-			if old_id in new_ids:
-				continue
-			else:
-				HeritageSiteJurisdiction.objects \
-					.filter(heritage_site_id=site.heritage_site_id, country_area_id=old_id) \
-					.delete()
+		with transaction.atomic():
+			site = form.save(commit=False)
+			# site.updated_by = self.request.user
+			# site.date_updated = timezone.now()
+			site.save()
+			set_jurisdictions(site, form.cleaned_data['country_area'])
+			sites_changed.send(sender=HeritageSite, site_ids=[site.heritage_site_id])
 
 		return HttpResponseRedirect(site.get_absolute_url())
 		# return redirect('heritagesites/site_detail', pk=site.pk)
@@ -154,16 +153,29 @@ class SiteDeleteView(generic.DeleteView):
 
 	def delete(self, request, *args, **kwargs):
 		self.object = self.get_object()
+		site_id = self.object.heritage_site_id
 
-		# Delete HeritageSiteJurisdiction entries
-		HeritageSiteJurisdiction.objects \
-			.filter(heritage_site_id=self.object.heritage_site_id) \
-			.delete()
+		with transaction.atomic():
+			# Delete HeritageSiteJurisdiction entries
+			HeritageSiteJurisdiction.objects \
+				.filter(heritage_site_id=site_id) \
+				.delete()
 
-		self.object.delete()
+			self.object.delete()
+
+			sites_changed.send(sender=HeritageSite, site_ids=[site_id], deleted=True)
 
 		return HttpResponseRedirect(self.get_success_url())
 
 class SiteFilterView(FilterView):
 	filterset_class = HeritageSiteFilter
 	template_name = 'heritagesites/site_filter.html'
+
+	def get_queryset(self):
+		# The template prefetches site_geography for the sites whose cached card is stale.
+		return HeritageSite.objects.all()
+
+	def get_context_data(self, **kwargs):
+		context = super().get_context_data(**kwargs)
+		context['facets'] = get_facets(self.filterset)
+		return context
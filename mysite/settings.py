@@ -67,7 +67,7 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'heritagesites.auth.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',
@@ -111,6 +111,28 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# Per-worker caches (e.g. heritagesites.refdata) publish their version keys here, so in a
+# multi-process deployment this must be a shared backend (memcached, redis) for writes in one
+# worker to invalidate the others.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'heritagesites',
+    }
+}
+
+
+# Sessions are read from the cache and written through to the database, so authenticated
+# HTML requests need no session query (heritagesites.auth caches the user). Cache entries
+# last at most heritagesites.auth.TIMEOUT (5 minutes), not the session's lifetime, so
+# sessions deleted in the database stop authenticating soon after.
+
+SESSION_ENGINE = 'heritagesites.sessions'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -187,7 +209,7 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 # Default Auth: SessionAuth (required by browsable API)
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication'
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -196,7 +218,16 @@ REST_FRAMEWORK = {
         # 'rest_framework.permissions.AllowAny'
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    # Budgets of api.throttling.TokenBucketThrottle: token buckets per client (user or IP)
+    # and, for *_all, a fixed-window count of all clients together.
+    'DEFAULT_THROTTLE_RATES': {
+        'sites_list': '600/min',
+        'sites_search': '60/min',
+        'sites_search_all': '1200/min',
+        'sites_write': '120/min',
+        'sites_write_all': '600/min',
+    }
 }
 
 # A list of origin hostnames that are authorized to make cross-site HTTP requests.
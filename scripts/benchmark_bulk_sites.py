@@ -0,0 +1,163 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views import SiteViewSet
+from heritagesites.models import CountryArea, HeritageSiteCategory
+from heritagesites.refdata import get_reference_data
+
+
+class Rollback(Exception):
+	pass
+
+
+def main(args):
+	"""
+	Compares the throughput of the per-request SiteViewSet path (one POST, PATCH or DELETE per
+	site) with the bulk endpoint (sites/bulk/) for creating, updating and deleting --sites
+	synthetic sites. Each path runs inside a transaction that is rolled back, so the database
+	is left unchanged. For every operation the script reports the wall time, the sites per
+	second and the number of SQL statements issued.
+	"""
+
+	# Setting logging format and default level
+	logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+	args = parse_args(args)
+	refdata = get_reference_data()
+	categories = refdata.all(HeritageSiteCategory)
+	countries = refdata.all(CountryArea)
+	if not categories or len(countries) < 2:
+		logging.error('Reference data (heritage site categories, countries/areas) is missing.')
+		return
+
+	sites = [synthetic_site(index, categories, countries) for index in range(args.sites)]
+	factory = APIRequestFactory()
+	user = User(username='benchmark')
+
+	print('{0:<12} {1:<8} {2:>6} {3:>10} {4:>10} {5:>8}'.format(
+		'path', 'op', 'sites', 'ms', 'sites/s', 'queries'))
+	for path in (per_request, bulk):
+		try:
+			with transaction.atomic():
+				for op, ms, queries in path(factory, user, sites):
+					print('{0:<12} {1:<8} {2:>6} {3:>10.1f} {4:>10.1f} {5:>8}'.format(
+						path.__name__, op, len(sites), ms, len(sites) / ms * 1000, queries))
+				raise Rollback
+		except Rollback:
+			pass
+
+
+def synthetic_site(index, categories, countries):
+	return {
+		'site_name': 'Benchmark site {0:05d}'.format(index),
+		'description': 'Synthetic site created by benchmark_bulk_sites.py',
+		'justification': '',
+		'date_inscribed': 2000,
+		'longitude': None,
+		'latitude': None,
+		'area_hectares': None,
+		'transboundary': 1,
+		'heritage_site_category_id': categories[index % len(categories)].pk,
+		'jurisdiction_ids': [
+			countries[index % len(countries)].pk,
+			countries[(index + 1) % len(countries)].pk,
+		],
+	}
+
+
+def timed(function):
+	with CaptureQueriesContext(connection) as queries:
+		start = time.perf_counter()
+		result = function()
+		ms = (time.perf_counter() - start) * 1000
+	return result, ms, len(queries)
+
+
+def call(factory, user, method, url, data, actions, **kwargs):
+	request = getattr(factory, method)(url, data, format='json')
+	force_authenticate(request, user=user)
+	# Unthrottled: the per-request path would exceed the sites_write rate.
+	response = SiteViewSet.as_view(actions, throttle_classes=())(request, **kwargs)
+	if response.status_code >= 400:
+		raise RuntimeError('{0} {1}: {2} {3}'.format(
+			method.upper(), url, response.status_code, response.data))
+	return response
+
+
+def per_request(factory, user, sites):
+	def create():
+		return [
+			call(factory, user, 'post', '/sites/', site, {'post': 'create'}).data['heritage_site_id']
+			for site in sites
+		]
+	site_ids, ms, queries = timed(create)
+	yield 'create', ms, queries
+
+	def update():
+		for site_id in site_ids:
+			call(
+				factory, user, 'patch', '/sites/{0}/'.format(site_id),
+				{'date_inscribed': 2001, 'jurisdiction_ids': sites[0]['jurisdiction_ids'][:1]},
+				{'patch': 'partial_update'}, pk=site_id)
+	_, ms, queries = timed(update)
+	yield 'update', ms, queries
+
+	def delete():
+		for site_id in site_ids:
+			call(
+				factory, user, 'delete', '/sites/{0}/'.format(site_id), None,
+				{'delete': 'destroy'}, pk=site_id)
+	_, ms, queries = timed(delete)
+	yield 'delete', ms, queries
+
+
+def bulk(factory, user, sites):
+	actions = {'post': 'bulk', 'patch': 'bulk', 'delete': 'bulk'}
+
+	def create():
+		response = call(factory, user, 'post', '/sites/bulk/', sites, actions)
+		return [site['heritage_site_id'] for site in response.data]
+	site_ids, ms, queries = timed(create)
+	yield 'create', ms, queries
+
+	def update():
+		call(factory, user, 'patch', '/sites/bulk/', [
+			{
+				'heritage_site_id': site_id,
+				'date_inscribed': 2001,
+				'jurisdiction_ids': sites[0]['jurisdiction_ids'][:1],
+			}
+			for site_id in site_ids
+		], actions)
+	_, ms, queries = timed(update)
+	yield 'update', ms, queries
+
+	_, ms, queries = timed(lambda: call(factory, user, 'delete', '/sites/bulk/', site_ids, actions))
+	yield 'delete', ms, queries
+
+
+def parse_args(args):
+	parser = argparse.ArgumentParser(
+		description='''Benchmarks per-request and bulk SiteViewSet writes (create, update,
+		delete) inside rolled back transactions.'''
+	)
+	parser.add_argument("-s", "--sites", type=int, default=200, help="sites per operation")
+	return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
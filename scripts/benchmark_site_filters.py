@@ -0,0 +1,149 @@
+import argparse
+import itertools
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+import django
+django.setup()
+
+from heritagesites.filters import HeritageSiteFilter
+from heritagesites.models import HeritageSite, SiteGeography
+
+
+# Geography filters and the join-chain lookups HeritageSiteFilter used before the semi-join
+# rewrite.
+LEGACY_LOOKUPS = {
+	'region': 'country_area__location__region__region_name',
+	'sub_region': 'country_area__location__sub_region__sub_region_name',
+	'intermediate_region': 'country_area__location__intermediate_region__intermediate_region_name',
+	'country_area': 'country_area__country_area_name',
+}
+
+
+def main(args):
+	"""
+	Compares the legacy join-based geography filters of HeritageSiteFilter (region, sub-region,
+	intermediate region, country/area) with the current semi-join implementation for every
+	combination of those filters. Filter values are taken from a transboundary site so that
+	each combination matches something. For each combination the script reports the rows
+	returned (legacy rows include duplicates), the distinct sites, the median wall time of
+	fetching all matching ids and, with --explain, both query plans.
+	"""
+
+	# Setting logging format and default level
+	logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+	args = parse_args(args)
+	sample = pick_sample()
+	if sample is None:
+		logging.error('No site with two or more jurisdictions found in site_geography.')
+		return
+
+	logging.info('Sample values: %s', sample)
+	print('{0:<55} {1:>6} {2:>6} {3:>6} {4:>10} {5:>10}'.format(
+		'filters', 'rows', 'sites', 'new', 'legacy ms', 'new ms'))
+
+	for size in range(1, len(LEGACY_LOOKUPS) + 1):
+		for names in itertools.combinations(LEGACY_LOOKUPS, size):
+			params = {name: sample[name] for name in names if sample[name] is not None}
+			if len(params) != len(names):
+				continue
+
+			legacy = legacy_queryset(params).values_list('pk', flat=True)
+			current = current_queryset(params).values_list('pk', flat=True)
+
+			legacy_ids = list(legacy)
+			current_ids = list(current)
+			if set(legacy_ids) != set(current_ids):
+				logging.warning('Result mismatch for %s', ', '.join(names))
+
+			print('{0:<55} {1:>6} {2:>6} {3:>6} {4:>10.2f} {5:>10.2f}'.format(
+				'+'.join(names),
+				len(legacy_ids),
+				len(set(legacy_ids)),
+				len(current_ids),
+				time_query(legacy, args.repeat),
+				time_query(current, args.repeat)))
+
+			if args.explain:
+				print('-- legacy plan\n{0}'.format(explain(legacy)))
+				print('-- semi-join plan\n{0}\n'.format(explain(current)))
+
+
+def pick_sample():
+	"""
+	Returns filter values (model instances) taken from the site_geography rows of the
+	transboundary site with the most jurisdictions.
+	"""
+	rows = list(
+		SiteGeography.objects
+			.select_related('region', 'sub_region', 'intermediate_region', 'country_area')
+			.order_by('heritage_site_id'))
+
+	by_site = {}
+	for row in rows:
+		by_site.setdefault(row.heritage_site_id, []).append(row)
+	if not by_site:
+		return None
+
+	site_rows = max(by_site.values(), key=len)
+	if len(site_rows) < 2:
+		return None
+
+	first, last = site_rows[0], site_rows[-1]
+	intermediate = next(
+		(row.intermediate_region for row in site_rows if row.intermediate_region_id), None)
+	return {
+		'region': first.region,
+		'sub_region': last.sub_region,
+		'intermediate_region': intermediate,
+		'country_area': last.country_area,
+	}
+
+
+def legacy_queryset(params):
+	queryset = HeritageSite.objects.all()
+	for name, value in params.items():
+		queryset = queryset.filter(**{LEGACY_LOOKUPS[name]: str(value)})
+	return queryset
+
+
+def current_queryset(params):
+	data = {name: value.pk for name, value in params.items()}
+	return HeritageSiteFilter(data, queryset=HeritageSite.objects.all()).qs
+
+
+def time_query(queryset, repeat):
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		list(queryset.all())
+		timings.append((time.perf_counter() - start) * 1000)
+	return statistics.median(timings)
+
+
+def explain(queryset):
+	try:
+		return queryset.explain()
+	except Exception as err:
+		return 'EXPLAIN not available: {0}'.format(err)
+
+
+def parse_args(args):
+	parser = argparse.ArgumentParser(
+		description='''Benchmarks legacy (join) and current (semi-join) HeritageSiteFilter
+		geography filters for every filter combination.'''
+	)
+	parser.add_argument("-r", "--repeat", type=int, default=20, help="runs per query")
+	parser.add_argument("-e", "--explain", action='store_true', help="print query plans")
+	return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,82 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+import django
+django.setup()
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import HeritageSiteRowSerializer, HeritageSiteSerializer
+from api.views import SiteViewSet
+from heritagesites.refdata import get_reference_data
+
+
+def main(args):
+	"""
+	Compares the read path of the sites API before and after the row serializer: the model
+	instance QuerySet of SiteViewSet serialized by HeritageSiteSerializer, and the values()
+	rows of HeritageSiteRowSerializer. Each path fetches and serializes up to --sites sites
+	--repeat times (the best run is kept) and renders them with the JSON renderer; the script
+	reports rows per second and SQL statements for each and checks that both produce the
+	same bytes.
+	"""
+
+	# Setting logging format and default level
+	logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+	args = parse_args(args)
+	get_reference_data()
+	selected = HeritageSiteSerializer.select_fields(args.fields.split(',')) if args.fields else None
+
+	def generic():
+		queryset = SiteViewSet.queryset.all()
+		if selected is not None:
+			queryset = HeritageSiteSerializer.project_queryset(queryset, selected)
+		return HeritageSiteSerializer(queryset[:args.sites], many=True, fields=selected).data
+
+	def rows():
+		queryset = HeritageSiteRowSerializer.project_queryset(SiteViewSet.queryset.all(), selected)
+		return HeritageSiteRowSerializer(queryset[:args.sites], many=True, fields=selected).data
+
+	print('{0:<12} {1:>6} {2:>10} {3:>10} {4:>8}'.format('path', 'rows', 'ms', 'rows/s', 'queries'))
+	output = {}
+	for path in (generic, rows):
+		best = None
+		for _ in range(args.repeat):
+			with CaptureQueriesContext(connection) as queries:
+				start = time.perf_counter()
+				data = path()
+				content = JSONRenderer().render(data)
+				ms = (time.perf_counter() - start) * 1000
+			best = ms if best is None else min(best, ms)
+		output[path.__name__] = content
+		print('{0:<12} {1:>6} {2:>10.1f} {3:>10.1f} {4:>8}'.format(
+			path.__name__, len(data), best, len(data) / best * 1000 if data else 0, len(queries)))
+
+	if output['generic'] != output['rows']:
+		logging.error('The two paths produced different JSON.')
+	else:
+		logging.info('Both paths produced identical JSON ({0} bytes).'.format(len(output['rows'])))
+
+
+def parse_args(args):
+	parser = argparse.ArgumentParser(
+		description='''Benchmarks HeritageSiteSerializer against the values()-based
+		HeritageSiteRowSerializer on the sites API read path.'''
+	)
+	parser.add_argument("-s", "--sites", type=int, default=1000, help="sites to serialize")
+	parser.add_argument("-r", "--repeat", type=int, default=5, help="runs per path")
+	parser.add_argument("-f", "--fields", help="comma-separated sparse fieldset (default: all)")
+	return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,21 @@
+--
+-- Change log behind the incremental change feed (GET /heritagesites/api/changes/?since=).
+-- One row per created, updated or deleted heritage site (jurisdiction changes included)
+-- and heritage site category, appended by the Django app in the same transaction as the
+-- change (see heritagesites/changes.py). change_id is the feed cursor.
+--
+-- No foreign keys: entries for deleted sites and categories must remain.
+--
+
+CREATE TABLE IF NOT EXISTS site_change
+  (
+    change_id BIGINT NOT NULL AUTO_INCREMENT,
+    object_type VARCHAR(10) NOT NULL,
+    object_id INTEGER NOT NULL,
+    action VARCHAR(10) NOT NULL,
+    changed_at DATETIME(6) NOT NULL,
+    PRIMARY KEY (change_id)
+  )
+ENGINE=InnoDB
+CHARACTER SET utf8mb4
+COLLATE utf8mb4_0900_ai_ci;
@@ -0,0 +1,75 @@
+--
+-- Denormalized site geography. One row per heritage site and country/area with the
+-- UNSD location hierarchy (region, sub-region, intermediate region) ids and names
+-- pre-joined, so region lookups no longer walk
+-- heritage_site_jurisdiction -> country_area -> location -> region/sub_region/intermediate_region.
+--
+-- The Django app keeps this table current on every write path (see heritagesites/geography.py).
+-- Re-run this script, or `python manage.py rebuild_site_geography`, to rebuild it from scratch.
+--
+
+DROP TABLE IF EXISTS site_geography;
+
+CREATE TABLE IF NOT EXISTS site_geography
+  (
+    site_geography_id INTEGER NOT NULL AUTO_INCREMENT UNIQUE,
+    heritage_site_id INTEGER NOT NULL,
+    country_area_id INTEGER NOT NULL,
+    region_id INTEGER NULL,
+    sub_region_id INTEGER NULL,
+    intermediate_region_id INTEGER NULL,
+    country_area_name VARCHAR(100) NOT NULL,
+    iso_alpha3_code CHAR(3) NOT NULL,
+    region_name VARCHAR(100) NULL,
+    sub_region_name VARCHAR(100) NULL,
+    intermediate_region_name VARCHAR(100) NULL,
+    PRIMARY KEY (site_geography_id),
+    UNIQUE KEY site_geography_site_country (heritage_site_id, country_area_id),
+    KEY site_geography_region (region_id, heritage_site_id),
+    KEY site_geography_sub_region (sub_region_id, heritage_site_id),
+    KEY site_geography_intermediate_region (intermediate_region_id, heritage_site_id),
+    KEY site_geography_country_area (country_area_id, heritage_site_id),
+    FOREIGN KEY (heritage_site_id) REFERENCES heritage_site(heritage_site_id)
+    ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (country_area_id) REFERENCES country_area(country_area_id)
+    ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (region_id) REFERENCES region(region_id)
+    ON DELETE RESTRICT ON UPDATE CASCADE,
+    FOREIGN KEY (sub_region_id) REFERENCES sub_region(sub_region_id)
+    ON DELETE RESTRICT ON UPDATE CASCADE,
+    FOREIGN KEY (intermediate_region_id) REFERENCES intermediate_region(intermediate_region_id)
+    ON DELETE RESTRICT ON UPDATE CASCADE
+  )
+ENGINE=InnoDB
+CHARACTER SET utf8mb4
+COLLATE utf8mb4_0900_ai_ci;
+
+-- Populate from the existing jurisdictions.
+INSERT IGNORE INTO site_geography
+       (
+         heritage_site_id,
+         country_area_id,
+         region_id,
+         sub_region_id,
+         intermediate_region_id,
+         country_area_name,
+         iso_alpha3_code,
+         region_name,
+         sub_region_name,
+         intermediate_region_name
+       )
+SELECT hsj.heritage_site_id, ca.country_area_id,
+       l.region_id, l.sub_region_id, l.intermediate_region_id,
+       ca.country_area_name, ca.iso_alpha3_code,
+       r.region_name, sr.sub_region_name, ir.intermediate_region_name
+  FROM heritage_site_jurisdiction hsj
+       INNER JOIN country_area ca
+               ON hsj.country_area_id = ca.country_area_id
+       INNER JOIN location l
+               ON ca.location_id = l.location_id
+       LEFT JOIN region r
+              ON l.region_id = r.region_id
+       LEFT JOIN sub_region sr
+              ON l.sub_region_id = sr.sub_region_id
+       LEFT JOIN intermediate_region ir
+              ON l.intermediate_region_id = ir.intermediate_region_id;
@@ -0,0 +1,16 @@
+--
+-- Adds heritage_site.updated_at, the per-site modification time behind the ETag and
+-- Last-Modified headers of the site pages and API (see heritagesites/conditional.py).
+--
+-- The Django app sets it on every write path, including jurisdiction-only changes. Django
+-- stores UTC (USE_TZ = True), so existing rows are backfilled with UTC_TIMESTAMP() rather
+-- than a column default (MySQL only allows CURRENT_TIMESTAMP, in the session time zone).
+-- Rows inserted outside Django keep NULL until their first change through the app.
+--
+
+ALTER TABLE heritage_site
+            ADD COLUMN updated_at DATETIME(6) NULL;
+
+UPDATE heritage_site
+   SET updated_at = UTC_TIMESTAMP(6)
+ WHERE updated_at IS NULL;